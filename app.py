@@ -1,40 +1,457 @@
-from flask import Flask, jsonify, request, g
-import sqlite3, json
-from datetime import datetime, timedelta
+from flask import Flask, Response, jsonify, request, g
+import json, heapq, io, multiprocessing, os, threading, time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import archive
+import metrics
+import migrations
+import models
+import pagination
+import recurrence
+import scheduling
+import shards
+import freebusy
+import ical
+import timecodec
+from cache import LRUCache
+from intervals import BusyTimeline, first_gaps
+from pool import ConnectionPool
+from writequeue import WriteQueue
 
 app = Flask(__name__)
+app.json = models.JSONProvider(app)
 app.config['DATABASE'] = 'calendar.db'
+# POST /meetings/bulk commits after this many meetings
+app.config['BULK_COMMIT_SIZE'] = 5000
+# read-only connections kept per process, and how long to wait for one
+# (or for the writer) before answering 503
+app.config['DB_POOL_SIZE'] = 8
+app.config['DB_TIMEOUT'] = 5.0
+# rendered GET /meetings/<id> responses kept per process, and for how long
+app.config['MEETING_CACHE_SIZE'] = 1024
+app.config['MEETING_CACHE_TTL'] = 60.0
+# SQL statements slower than this are logged with their normalized text
+app.config['SLOW_SQL_SECONDS'] = 0.1
+# when set, requests sent with an `X-Profile: 1` header are run under
+# cProfile and the stats written to this directory
+app.config['PROFILE_DIR'] = None
+# served through asgi.py, requests run on REQUEST_WORKERS threads and the
+# availability searches on SEARCH_WORKERS threads of their own; a request
+# that has not started its response after REQUEST_TIMEOUT seconds is
+# cancelled with 504. SWEEP_PROCESSES moves the slot sweep of /free_slots
+# to a pool of processes, off the GIL the other requests need
+app.config['REQUEST_WORKERS'] = 6
+app.config['SEARCH_WORKERS'] = 2
+app.config['REQUEST_TIMEOUT'] = 30.0
+app.config['SWEEP_PROCESSES'] = 0
+# when set, small writes (new users, invitation answers) are handed to one
+# thread that commits them in groups of up to WRITE_QUEUE_MAX_BATCH, at
+# most WRITE_QUEUE_MAX_DELAY seconds after the first one of a group came in
+app.config['WRITE_QUEUE'] = False
+app.config['WRITE_QUEUE_MAX_BATCH'] = 64
+app.config['WRITE_QUEUE_MAX_DELAY'] = 0.002
+# when set, meetings that ended more than ARCHIVE_AFTER_DAYS days ago are
+# moved with their invitations to monthly archive files (archive.py), by a
+# thread of each process that looks every ARCHIVE_INTERVAL seconds
+app.config['ARCHIVE_AFTER_DAYS'] = None
+app.config['ARCHIVE_INTERVAL'] = 3600.0
+# GET /sync prunes deletions older than SYNC_TOKEN_DAYS days from the change
+# log at most every SYNC_PRUNE_INTERVAL seconds; tokens from before a pruned
+# deletion are answered with 410 and the client starts over without one
+app.config['SYNC_TOKEN_DAYS'] = 30
+app.config['SYNC_PRUNE_INTERVAL'] = 3600.0
+# when set, users, one-off meetings and their invitations are kept in SHARDS
+# files next to DATABASE (shards.py) instead of in it. the routes the shards
+# can answer go through them, the others (series, archives, sync, the feed)
+# answer 501
+app.config['SHARDS'] = 0
+
+# queries on the hot paths, kept here so the tests can check their plans
+
+# meetings the user organized or accepted inside a window, each half of the
+# union served by its own index
+USER_MEETINGS_SQL = (
+    'SELECT {0} FROM meetings AS m WHERE m.organizer_id = ? AND m.start_ts >= ? AND m.end_ts <= ? '
+    'UNION '
+    'SELECT {0} FROM invitations AS i JOIN meetings AS m ON m.id = i.meeting_id '
+    "WHERE i.user_id = ? AND i.status = 'accepted' AND m.start_ts >= ? AND m.end_ts <= ? "
+    'ORDER BY start_ts, id'
+).format(models.columns(models.Meeting, 'm'))
+
+# (start, end) of the meetings the user organized or accepted that overlap a window
+USER_BUSY_SQL = (
+    'SELECT start_ts, end_ts FROM meetings WHERE organizer_id = ? AND start_ts < ? AND end_ts > ? '
+    'UNION '
+    'SELECT m.start_ts, m.end_ts FROM invitations AS i JOIN meetings AS m ON m.id = i.meeting_id '
+    "WHERE i.user_id = ? AND i.status = 'accepted' AND m.start_ts < ? AND m.end_ts > ?"
+)
+
+MEETING_SQL = 'SELECT * FROM meetings WHERE id = ?'
+
+# a meeting with one row per invited user (a single row with no user when
+# nobody is invited), grouped by status when it is rendered
+MEETING_DETAILS_SQL = (
+    'SELECT m.id, m.title, m.description, m.start_ts, m.end_ts, m.location, m.version, '
+    'i.status, u.email, u.name FROM meetings AS m '
+    'LEFT JOIN invitations AS i ON i.meeting_id = m.id LEFT JOIN users AS u ON u.id = i.user_id '
+    'WHERE m.id = ?'
+)
+
+MEETING_VERSION_SQL = 'SELECT version FROM meetings WHERE id = ?'
+
+# every change to a meeting or its invitations moves its version on
+BUMP_MEETING_VERSION_SQL = 'UPDATE meetings SET version = version + 1 WHERE id = ?'
+
+INVITATION_SQL = 'SELECT status FROM invitations WHERE meeting_id = ? AND user_id = ?'
+
+RSVP_SQL = 'UPDATE invitations SET status = ? WHERE meeting_id = ? AND user_id = ?'
+
+# (position, meeting id, start, end, current status) of each [meeting_id,
+# user_id] pair of a JSON array, ids and status NULL when there is no such
+# meeting or invitation: a whole batch of answers checked in one query
+RSVP_LOOKUP_SQL = (
+    'SELECT p.key, m.id, m.start_ts, m.end_ts, i.status FROM json_each(?) AS p '
+    "LEFT JOIN meetings AS m ON m.id = json_extract(p.value, '$[0]') "
+    "LEFT JOIN invitations AS i ON i.meeting_id = m.id AND i.user_id = json_extract(p.value, '$[1]')"
+)
+
+# the same for [series_id, user_id] pairs
+SERIES_RSVP_LOOKUP_SQL = (
+    'SELECT p.key, s.id, si.status FROM json_each(?) AS p '
+    "LEFT JOIN meeting_series AS s ON s.id = json_extract(p.value, '$[0]') "
+    "LEFT JOIN series_invitations AS si ON si.series_id = s.id AND si.user_id = json_extract(p.value, '$[1]')"
+)
+
+SERIES_RSVP_SQL = 'UPDATE series_invitations SET status = ? WHERE series_id = ? AND user_id = ?'
+
+# the invited users of some meetings or series with their answers, for
+# a whole page of them at once
+ATTENDEES_SQL = (
+    'SELECT i.meeting_id, i.user_id, u.name, u.email, i.status FROM invitations AS i '
+    'LEFT JOIN users AS u ON u.id = i.user_id WHERE i.meeting_id IN ({})'
+)
+SERIES_ATTENDEES_SQL = (
+    'SELECT si.series_id, si.user_id, u.name, u.email, si.status FROM series_invitations AS si '
+    'LEFT JOIN users AS u ON u.id = si.user_id WHERE si.series_id IN ({})'
+)
+
+# series the user organized or accepted with an occurrence inside a window
+USER_SERIES_SQL = (
+    'SELECT s.* FROM meeting_series AS s WHERE s.organizer_id = ? AND s.span_start_ts < ? AND s.span_end_ts > ? '
+    'UNION '
+    'SELECT s.* FROM series_invitations AS si JOIN meeting_series AS s ON s.id = si.series_id '
+    "WHERE si.user_id = ? AND si.status = 'accepted' AND s.span_start_ts < ? AND s.span_end_ts > ?"
+)
+
+# the series any of some users organized or accepted with an occurrence
+# inside a window, once for each of those users
+USERS_SERIES_SQL = (
+    'SELECT s.organizer_id AS user_id, s.* FROM meeting_series AS s '
+    'WHERE s.organizer_id IN ({0}) AND s.span_start_ts < ? AND s.span_end_ts > ? '
+    'UNION ALL '
+    'SELECT si.user_id, s.* FROM series_invitations AS si JOIN meeting_series AS s ON s.id = si.series_id '
+    "WHERE si.user_id IN ({0}) AND si.status = 'accepted' AND s.span_start_ts < ? AND s.span_end_ts > ?"
+)
+
+SERIES_IN_WINDOW_SQL = 'SELECT * FROM meeting_series WHERE span_start_ts < ? AND span_end_ts > ?'
+
+SERIES_EXCEPTIONS_SQL = 'SELECT series_id, occurrence_ts, start_ts, end_ts FROM series_exceptions WHERE series_id IN ({})'
+
+# what a calendar feed is checked against before anything is read for it
+FEED_VERSION_SQL = 'SELECT name, feed_version, feed_changed_ts FROM users WHERE id = ?'
+
+# every meeting and series the user organized or accepted, for the feed; a
+# meeting the organizer is also invited to comes from the first half only,
+# so the rows can be streamed as they are without a UNION's dedup
+FEED_MEETINGS_SQL = (
+    'SELECT {0} FROM meetings AS m WHERE m.organizer_id = ? '
+    'UNION ALL '
+    'SELECT {0} FROM invitations AS i JOIN meetings AS m ON m.id = i.meeting_id '
+    "WHERE i.user_id = ? AND i.status = 'accepted' AND m.organizer_id != i.user_id"
+).format(models.columns(models.Meeting, 'm'))
+FEED_SERIES_SQL = (
+    'SELECT s.* FROM meeting_series AS s WHERE s.organizer_id = ? '
+    'UNION ALL '
+    'SELECT s.* FROM series_invitations AS si JOIN meeting_series AS s ON s.id = si.series_id '
+    "WHERE si.user_id = ? AND si.status = 'accepted' AND s.organizer_id != si.user_id"
+)
+
+_pool_lock = threading.Lock()
+
+def get_pool():
+    # one pool per process and database file; a forked worker or a new
+    # DATABASE setting starts a fresh one
+    pool = app.extensions.get('pool')
+    if pool is None or pool.path != app.config['DATABASE'] or pool.pid != os.getpid():
+        registry = get_registry()
+        with _pool_lock:
+            pool = app.extensions.get('pool')
+            if pool is None or pool.path != app.config['DATABASE'] or pool.pid != os.getpid():
+                if pool is not None and pool.pid == os.getpid():
+                    pool.close()
+                pool = ConnectionPool(app.config['DATABASE'], app.config['DB_POOL_SIZE'], app.config['DB_TIMEOUT'],
+                                      factory=metrics.InstrumentedConnection)
+                pool.on_connect.append(lambda db: setattr(db, 'registry', registry))
+                app.extensions['pool'] = pool
+    return pool
 
 def get_db():
+    # a read-only connection; once the request holds the writer, reads go
+    # through it as well so they see its uncommitted changes
+    if 'write_db' in g:
+        return g.write_db
     if 'db' not in g:
-        g.db = sqlite3.connect(app.config['DATABASE'])
-        g.db.row_factory = sqlite3.Row
+        g.db = watch_db_(get_pool().acquire_reader())
     return g.db
 
+def get_write_db():
+    # the process' single writer connection, held until the request ends
+    if 'write_db' not in g:
+        g.write_db = watch_db_(get_pool().acquire_writer())
+    return g.write_db
+
+def release_write_db():
+    # hand the writer back before the request ends, once what it wrote is
+    # committed, e.g. between the chunks of a slow upload
+    db = g.pop('write_db', None)
+    if db is not None:
+        cancellation = g.get('cancellation')
+        if cancellation is not None:
+            cancellation.forget(db)
+        get_pool().release(db)
+
+def watch_db_(db):
+    # requests served through asgi.py can be cancelled, which interrupts
+    # the statements running on the connections they hold
+    cancellation = g.get('cancellation')
+    if cancellation is not None:
+        cancellation.watch(db)
+    return db
+
+def archive_partitions_():
+    # the archived months, read once per request and only by the reads
+    # that can reach into them
+    if 'archive_partitions' not in g:
+        g.archive_partitions = archive.partitions(get_db())
+    return g.archive_partitions
+
+def get_archive_db(month):
+    # a read-only connection to a month's archive file, held until the
+    # request ends
+    if 'archive_dbs' not in g:
+        g.archive_dbs = {}
+    db = g.archive_dbs.get(month)
+    if db is None:
+        db = archive.connect(get_pool().path, month, app.config['DB_TIMEOUT'], get_registry())
+        g.archive_dbs[month] = watch_db_(db)
+    return db
+
 @app.teardown_appcontext
 def close_db(error):
-    if hasattr(g, 'db'):
-        g.db.close()
+    cancellation = g.get('cancellation')
+    for name in ('db', 'write_db'):
+        db = g.pop(name, None)
+        if db is not None:
+            if cancellation is not None:
+                cancellation.forget(db)
+            get_pool().release(db)
+    for db in g.pop('archive_dbs', {}).values():
+        if cancellation is not None:
+            cancellation.forget(db)
+        db.close()
+
+def get_shards():
+    # the shards of this process, None when SHARDS is 0; a forked worker or
+    # a new DATABASE or SHARDS setting opens them again
+    count = app.config['SHARDS']
+    if not count:
+        return None
+    store = app.extensions.get('shards')
+    if store is None or (store.database, store.count, store.pid) != (app.config['DATABASE'], count, os.getpid()):
+        registry = get_registry()
+        with _pool_lock:
+            store = app.extensions.get('shards')
+            if store is None or (store.database, store.count, store.pid) != (app.config['DATABASE'], count, os.getpid()):
+                if store is not None and store.pid == os.getpid():
+                    store.close()
+                store = shards.ShardedCalendar(app.config['DATABASE'], count, app.config['DB_POOL_SIZE'],
+                                               app.config['DB_TIMEOUT'], factory=metrics.InstrumentedConnection,
+                                               on_connect=[lambda db: setattr(db, 'registry', registry)])
+                app.extensions['shards'] = store
+    return store
+
+def get_write_queue():
+    # the group-commit queue of this process and pool, None when
+    # WRITE_QUEUE is off or the writes go to the shards
+    if not app.config['WRITE_QUEUE'] or app.config['SHARDS']:
+        return None
+    pool = get_pool()
+    write_queue = app.extensions.get('write_queue')
+    if write_queue is None or write_queue.pool is not pool:
+        registry = get_registry()
+        with _pool_lock:
+            write_queue = app.extensions.get('write_queue')
+            if write_queue is None or write_queue.pool is not pool:
+                if write_queue is not None:
+                    write_queue.close()
+                write_queue = WriteQueue(pool, app.config['WRITE_QUEUE_MAX_BATCH'],
+                                         app.config['WRITE_QUEUE_MAX_DELAY'], registry)
+                app.extensions['write_queue'] = write_queue
+    return write_queue
+
+def write_(operation, *args):
+    # run operation(db, *args) and commit it: on the request's writer, or
+    # through the write queue together with other requests' writes.
+    # operations return (body, status) and never commit themselves
+    # a request that already holds the writer would wait on itself
+    write_queue = get_write_queue()
+    if write_queue is None or 'write_db' in g:
+        db = get_write_db()
+        result = operation(db, *args)
+        db.commit()
+    else:
+        result = write_queue.run(operation, *args)
+    body, status = result
+    return jsonify(body), status
+
+def get_compactor():
+    # the archiving thread of this process and pool, None when
+    # ARCHIVE_AFTER_DAYS is not set or the meetings are on the shards
+    if not app.config['ARCHIVE_AFTER_DAYS'] or app.config['SHARDS']:
+        return None
+    pool = get_pool()
+    compactor = app.extensions.get('compactor')
+    if compactor is None or compactor.pool is not pool:
+        with _pool_lock:
+            compactor = app.extensions.get('compactor')
+            if compactor is None or compactor.pool is not pool:
+                if compactor is not None:
+                    compactor.close()
+                compactor = archive.Compactor(pool, int(app.config['ARCHIVE_AFTER_DAYS'] * timecodec.DAY),
+                                              app.config['ARCHIVE_INTERVAL'])
+                app.extensions['compactor'] = compactor
+    return compactor
+
+@app.before_request
+def start_archiving():
+    # each process starts archiving with the first request it serves
+    get_compactor()
+
+def get_sweep_pool():
+    # the processes /free_slots sweeps run in, None when SWEEP_PROCESSES is 0;
+    # spawned, since forking a process with threads and open connections
+    # isn't safe
+    if not app.config['SWEEP_PROCESSES']:
+        return None
+    sweep_pool = app.extensions.get('sweep_pool')
+    if sweep_pool is None or sweep_pool[0] != os.getpid():
+        with _pool_lock:
+            sweep_pool = app.extensions.get('sweep_pool')
+            if sweep_pool is None or sweep_pool[0] != os.getpid():
+                executor = ProcessPoolExecutor(app.config['SWEEP_PROCESSES'], multiprocessing.get_context('spawn'))
+                sweep_pool = app.extensions['sweep_pool'] = (os.getpid(), executor)
+    return sweep_pool[1]
+
+def get_meeting_cache():
+    # versioned keys keep entries from going stale, so each process can
+    # keep its own cache whoever does the writes
+    cache = app.extensions.get('meeting_cache')
+    if cache is None:
+        with _pool_lock:
+            cache = app.extensions.get('meeting_cache')
+            if cache is None:
+                cache = LRUCache(app.config['MEETING_CACHE_SIZE'], app.config['MEETING_CACHE_TTL'])
+                app.extensions['meeting_cache'] = cache
+    return cache
+
+def get_registry():
+    # request and SQL metrics of this process
+    registry = app.extensions.get('metrics')
+    if registry is None:
+        with _pool_lock:
+            registry = app.extensions.get('metrics')
+            if registry is None:
+                registry = metrics.Registry(app.config['SLOW_SQL_SECONDS'])
+                app.extensions['metrics'] = registry
+    return registry
+
+@app.before_request
+def start_request_metrics():
+    g.cancellation = request.environ.get('calendar.cancellation')
+    g.request_started = time.perf_counter()
+    metrics.begin_request()
+    if app.config['PROFILE_DIR'] and request.headers.get('X-Profile'):
+        g.profile = metrics.start_profile()
+
+# the routes a sharded app answers; the others read series, archived months
+# or the change log, which the shards don't have
+SHARDED_ENDPOINTS = frozenset({
+    'create_user', 'get_users', 'create_meeting', 'create_meetings_bulk', 'get_meeting', 'get_meetings',
+    'accept_invitation', 'decline_invitation', 'get_user_meetings', 'find_free_interval', 'find_free_intervals',
+    'get_metrics',
+})
+
+@app.before_request
+def check_sharded():
+    if app.config['SHARDS'] and request.endpoint is not None and request.endpoint not in SHARDED_ENDPOINTS:
+        return jsonify({'error': 'Not available on sharded storage'}), 501
+
+@app.after_request
+def record_request_metrics(response):
+    # the time to build the response; a streamed body is still being
+    # written after this
+    elapsed = time.perf_counter() - g.pop('request_started', time.perf_counter())
+    statements, sql_seconds = metrics.end_request()
+    registry = get_registry()
+    labels = (('method', request.method), ('route', request.url_rule.rule if request.url_rule else '(unmatched)'))
+    registry.count('calendar_requests_total', labels + (('status', response.status_code),))
+    registry.observe('calendar_request_seconds', elapsed, metrics.LATENCY_BUCKETS, labels)
+    registry.observe('calendar_request_sql_seconds', sql_seconds, metrics.SQL_BUCKETS, labels)
+    registry.observe('calendar_request_sql_statements', statements, metrics.STATEMENT_BUCKETS, labels)
+    response.headers['Server-Timing'] = (
+        f'sql;dur={sql_seconds * 1000:.3f};desc="{statements} statements", app;dur={elapsed * 1000:.3f}')
+
+    profile = g.pop('profile', None)
+    if profile is not None:
+        path = metrics.finish_profile(profile, app.config['PROFILE_DIR'], f'{request.method}-{request.path}')
+        response.headers['X-Profile-File'] = os.path.basename(path)
+    return response
+
+@app.teardown_request
+def stop_profile(error):
+    # a request that failed never got to after_request
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.disable()
+
+@app.errorhandler(TimeoutError)
+def database_busy(error):
+    return jsonify({'error': str(error)}), 503
 
 def init_db():
     with app.app_context():
-        db = get_db()
-        with app.open_resource('schema.sql', mode='r') as f:
-            db.cursor().executescript(f.read())
+        db = get_write_db()
+        if migrations.is_empty(db):
+            with app.open_resource('schema.sql', mode='r') as f:
+                db.cursor().executescript(f.read())
+            migrations.stamp(db)
+        else:
+            migrations.migrate(db)
         db.commit()
+        get_meeting_cache().clear()
 
 def drop_db():
     with app.app_context():
-        db = get_db()
+        db = get_write_db()
         with app.open_resource('drop_tables.sql', mode='r') as f:
             db.cursor().executescript(f.read())
         db.commit()
+        get_meeting_cache().clear()
 
 @app.route('/users', methods=['POST'])
 def create_user():
-    db = get_db()
-    cursor = db.cursor()
-
     # get the request data
     data = request.get_json()
 
@@ -46,183 +463,685 @@ def create_user():
     except KeyError as e:
         return jsonify({'error': f'{e} is required'}), 400
 
+    # optional timezone and working hours
+    hours, error = parse_working_hours_(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    store = get_shards()
+    if store is not None:
+        if store.create_user(name, email, password, hours) is None:
+            return jsonify({'error': 'Email already taken'}), 409
+        return jsonify({'message': 'User created successfully'})
+    return write_(create_user_, name, email, password, hours)
+
+def create_user_(db, name, email, password, hours):
+    cursor = db.cursor()
+
     # check if the email is already taken
     if cursor.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone():
-        return jsonify({'error': 'Email already taken'}), 409
+        return {'error': 'Email already taken'}, 409
 
     # create the new user
-    cursor.execute('INSERT INTO users (name, email, password) VALUES (?, ?, ?)', (name, email, password))
-    db.commit()
+    cursor.execute('INSERT INTO users (name, email, password, timezone, work_start, work_end, work_days) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                   (name, email, password, *hours))
+
+    return {'message': 'User created successfully'}, 200
+
+def parse_working_hours_(data):
+    # (timezone, work_start, work_end, work_days) of a user from a request,
+    # all None when not given; returns (hours, None) or (None, error)
+    timezone_name = data.get('timezone')
+    work_start = data.get('work_start')
+    work_end = data.get('work_end')
+    work_days = data.get('work_days')
+    try:
+        if timezone_name is not None:
+            ZoneInfo(timezone_name)
+    except (ValueError, ZoneInfoNotFoundError):
+        return None, f'Unknown timezone {timezone_name}'
+    if (work_start is None) != (work_end is None):
+        return None, 'work_start and work_end go together'
+    try:
+        if work_start is not None:
+            scheduling.parse_clock(work_start)
+            scheduling.parse_clock(work_end)
+    except (AttributeError, ValueError):
+        return None, 'Working hours must be in the format HH:MM'
+    if work_days is not None:
+        if not isinstance(work_days, list) or not all(type(day) is int and 0 <= day <= 6 for day in work_days):
+            return None, 'work_days must be a list of weekdays from 0 (Monday) to 6 (Sunday)'
+        work_days = json.dumps(work_days)
+    return (timezone_name, work_start, work_end, work_days), None
+
+@app.route('/users/<int:user_id>/working_hours', methods=['PUT'])
+def set_working_hours(user_id):
+    db = get_write_db()
+    cursor = db.cursor()
 
-    return jsonify({'message': 'User created successfully'})
+    # get the request data
+    data = request.get_json()
 
-@app.route('/users', methods=['GET'])
-def get_users():
-    db = get_db()
-    cursor = db.cursor()
+    hours, error = parse_working_hours_(data)
+    if error:
+        return jsonify({'error': error}), 400
 
-    # get users
-    users = [dict(row) for row in cursor.execute(
-        'SELECT name, email FROM users',
-    ).fetchall()]
+    # check if the user exists
+    if not cursor.execute('SELECT 1 FROM users WHERE id = ?', (user_id,)).fetchone():
+        return jsonify({'error': 'User not found'}), 404
 
-    return jsonify(users)
+    # fields left out are cleared
+    cursor.execute('UPDATE users SET timezone = ?, work_start = ?, work_end = ?, work_days = ? WHERE id = ?', (*hours, user_id))
+    db.commit()
 
-def create_meetings_(series_data):
-    db = get_db()
+    return jsonify({'message': 'Working hours updated successfully'})
+
+def parse_include_(args):
+    # whether a list request asked for include=attendees
+    include = args.get('include')
+    if include is None:
+        return False
+    if set(include.split(',')) != {'attendees'}:
+        raise ValueError('include can only be "attendees"')
+    return True
+
+def load_attendees_(db, sql, ids):
+    # {id: [Attendee, ...]} of some meetings or series, ordered by user id
+    attendees = {}
+    if not ids:
+        return attendees
     cursor = db.cursor()
+    cursor.row_factory = None
+    for item_id, *attendee in cursor.execute(sql.format(', '.join('?' * len(ids))), sorted(ids)).fetchall():
+        attendees.setdefault(item_id, []).append(models.Attendee(*attendee))
+    for users in attendees.values():
+        users.sort()
+    return attendees
+
+def with_attendees_(db, pairs, partitions=()):
+    # (key, item) pairs with the attendees of each meeting or series
+    # occurrence added, loaded for a batch of items at a time with one
+    # query for the meetings and one for the series; lazy, so a stream
+    # reads them as it goes. meetings read from the archived `partitions`
+    # have their invitations there
+    pairs = iter(pairs)
+    while True:
+        batch = list(islice(pairs, pagination.FETCH_SIZE))
+        if not batch:
+            return
+        meeting_ids = {item.id for _, item in batch if isinstance(item, models.Meeting)}
+        meetings = load_attendees_(db, ATTENDEES_SQL, meeting_ids)
+        for partition, ids in archive.holding(partitions, meeting_ids - meetings.keys()):
+            archived = archive.connect(get_pool().path, partition.month, app.config['DB_TIMEOUT'], get_registry())
+            try:
+                meetings.update(load_attendees_(archived, ATTENDEES_SQL, set(ids)))
+            finally:
+                archived.close()
+        series = load_attendees_(db, SERIES_ATTENDEES_SQL, {item['series_id'] for _, item in batch if isinstance(item, dict)})
+        for key, item in batch:
+            if isinstance(item, models.Meeting):
+                yield key, models.Attending(item, meetings.get(item.id, []))
+            else:
+                yield key, dict(item, attendees=[attendee._asdict() for attendee in series.get(item['series_id'], [])])
+
+def encode_item_(item):
+    # list records write their own JSON, anything else goes through the
+    # app's JSON provider
+    if isinstance(item, models.MODELS):
+        return item.json()
+    return app.json.dumps(item, separators=(',', ':'))
+
+def json_list_response_(items, headers=None):
+    # a JSON array of records and dicts, joined without building the list
+    # of dicts jsonify would need
+    body = '[' + ','.join(map(encode_item_, items)) + ']\n'
+    return Response(body, mimetype='application/json', headers=headers)
+
+def list_response_(items, limit, stream, attendees=False):
+    # answer a list request from (key, item) pairs in key order: one page
+    # when a limit is given, with the cursor of the next page in
+    # X-Next-Cursor, or everything, streamed when asked to; with
+    # `attendees` the meetings that are sent get their attendees
+    headers = {}
+    if limit is not None:
+        items, next_cursor = pagination.take_page(items, limit)
+        if next_cursor:
+            headers['X-Next-Cursor'] = next_cursor
+    if attendees:
+        items = with_attendees_(get_db(), items, g.get('archive_partitions', ()))
+    if not stream:
+        return json_list_response_((item for _, item in items), headers)
+
+    # the stream outlives the request, so it takes the connection over and
+    # hands it back to the pool once the last row has been sent; the shards
+    # have handed theirs back already
+    db = g.pop('db', None)
+    pool = get_pool() if db is not None else None
+    cancellation = g.get('cancellation')
+
+    def generate():
+        try:
+            yield from pagination.encode_stream(items, stream, encode_item_)
+        finally:
+            if db is not None:
+                if cancellation is not None:
+                    cancellation.forget(db)
+                pool.release(db)
 
-    for data in series_data:
-        # create the new meeting
-        cursor.execute(
-            'INSERT INTO meetings (title, description, start_time, end_time, location, organizer_id, invited_users) VALUES (?, ?, ?, ?, ?, ?, ?)',
-            (data['title'], data['description'], data['start_time'], data['end_time'], data['location'], data['organizer_id'], data['invited_users']))
-        meeting_id = cursor.lastrowid
-
-        # invite the users
-        for user_id in json.loads(data['invited_users']):
-            cursor.execute('INSERT INTO invitations (user_id, meeting_id, status) VALUES (?, ?, ?)',
-                           (user_id, meeting_id, "pending"))
-    db.commit()
+    return Response(generate(), mimetype=pagination.STREAM_FORMATS[stream], headers=headers)
 
-    return jsonify({'message': 'Meeting created successfully'})
-
-def create_series_of_meetings(data, num_of_repeats):
-    meeting_series = []
-    start_time = datetime.strptime(data['start_time'], '%Y-%m-%d %H:%M:%S')
-    end_time = datetime.strptime(data['end_time'], '%Y-%m-%d %H:%M:%S')
-
-    if data['repeat'] == 'daily':
-        for i in range(num_of_repeats):
-            data['start_time'] = start_time + i * timedelta(days=1)
-            data['end_time'] = end_time + i * timedelta(days=1)
-            meeting_series.append(data)
-    elif data['repeat'] == 'weekly':
-        for i in range(num_of_repeats):
-            data['start_time'] = start_time + i * timedelta(weeks=1)
-            data['end_time'] = end_time + i * timedelta(weeks=1)
-            meeting_series.append(data)
-    elif data['repeat'] == 'monthly':
-        for i in range(num_of_repeats):
-            data['start_time'] = start_time.replace(day=1) + timedelta(days=i*31)
-            data['start_time'] = data['start_time'].replace(day=start_time.day)
-            data['end_time'] = end_time.replace(day=1) + timedelta(days=i*31)
-            data['end_time'] = data['end_time'].replace(day=end_time.day)
-            meeting_series.append(data)
-    elif data['repeat'] == 'yearly':
-        for i in range(num_of_repeats):
-            data['start_time'] = start_time.replace(year=start_time.year+i)
-            data['end_time'] = end_time.replace(year=end_time.year+i)
-            meeting_series.append(data)
-    elif data['repeat'] == 'every weekday':
-        i = 0
-        j = 0
-        while j < num_of_repeats:
-            data['start_time'] = start_time + i * timedelta(days=1)
-            data['end_time'] = end_time + i * timedelta(days=1)
-            if data['start_time'].weekday() < 5:
-                meeting_series.append(data)
-                j += 1
-            i += 1
-    return meeting_series
 
+@app.route('/users', methods=['GET'])
+def get_users():
+    try:
+        limit, after, stream = pagination.parse_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # get users, in id order so they can be paged by id
+    sql = f'SELECT {models.columns(models.User)} FROM users WHERE id > ? ORDER BY id'
+    params = [after[0] if after else 0]
+    store = get_shards()
+    if store is not None:
+        # a page at most from each shard, merged
+        users = store.select(sql + (' LIMIT ?' if limit else ''), params + ([limit + 1] if limit else []),
+                             models.row_factory(models.User), shards.USER_ORDER)
+    else:
+        cursor = get_db().cursor()
+        cursor.row_factory = models.row_factory(models.User)
+        cursor.execute(sql, params)
+        users = pagination.fetch_rows(cursor)
+
+    return list_response_((([user.id], user) for user in users), limit, stream)
 
-@app.route('/meetings', methods=['POST'])
-def create_meeting():
-    # get the request data
-    data = request.get_json()
+# a series may not repeat more often or for longer than this
+SERIES_MAX_REPEATS = 10000
+SERIES_HORIZON = 100 * 366 * timecodec.DAY
+
+
+def parse_meeting_(data):
+    # check a meeting (or a series) from a request and prepare it for
+    # create_meetings_; returns (meeting, None) or (None, (error, status))
+    if not isinstance(data, dict):
+        return None, ('A meeting must be a JSON object', 400)
 
     # check if the required fields are present
     try:
-        title = data['title']
-        start_time = data['start_time']
-        end_time = data['end_time']
-        organizer_id = data['organizer_id']
+        meeting = {
+            'title': data['title'],
+            'description': data.get('description'),
+            'start_time': data['start_time'],
+            'end_time': data['end_time'],
+            'location': data['location'],
+            'organizer_id': data['organizer_id'],
+            'repeat': data.get('repeat'),
+        }
         invited_users = data['invited_users']
     except KeyError as e:
-        return jsonify({'error': f'{e} is required'}), 400
+        return None, (f'{e} is required', 400)
 
-    if 'repeat' in data:
-        try:
-            repeat = data['repeat']
-        except json.decoder.JSONDecodeError:
-            return jsonify({'error': 'Invalid JSON in repeat field'}), 400
+    # who is invited is only kept as invitations, one per user
+    try:
+        invitees = json.loads(invited_users)
+    except (TypeError, ValueError):
+        invitees = None
+    if not isinstance(invitees, list) or any(type(user_id) is not int for user_id in invitees):
+        return None, ('invited_users must be a JSON list of user ids', 400)
+    meeting['invitees'] = list(dict.fromkeys(invitees))
+
+    # times are kept as epoch seconds from here on
+    try:
+        meeting['start_ts'] = timecodec.parse(meeting.pop('start_time'))
+        meeting['end_ts'] = timecodec.parse(meeting.pop('end_time'))
+        until = timecodec.parse_or_none(data.get('until') or None)
+    except ValueError:
+        return None, ('Times must be in the format YYYY-mm-dd HH:MM:SS', 400)
+    if meeting['end_ts'] <= meeting['start_ts']:
+        return None, ('end_time must be after start_time', 400)
+
+    if meeting['repeat'] is None:
+        return meeting, None
+
+    if meeting['repeat'] not in recurrence.REPEATS:
+        return None, ('Repeat can only be from "daily", "weekly", "monthly", "yearly", "every weekday"', 404)
+
+    # a series ends after num_of_repeats occurrences or at the until time,
+    # whichever comes first; without either it has 2 occurrences
+    num_of_repeats = data.get('num_of_repeats')
+    if num_of_repeats is None and until is None:
+        num_of_repeats = 2
+    if num_of_repeats is not None and (type(num_of_repeats) is not int or not 1 <= num_of_repeats <= SERIES_MAX_REPEATS):
+        return None, (f'num_of_repeats must be an integer between 1 and {SERIES_MAX_REPEATS}', 400)
+    if until is not None and until - meeting['start_ts'] > SERIES_HORIZON:
+        return None, (f'A series must end within {SERIES_HORIZON // timecodec.DAY} days of its start', 400)
+
+    last = recurrence.last_occurrence(
+        timecodec.to_datetime(meeting['start_ts']), timecodec.to_datetime(meeting['end_ts']), meeting['repeat'],
+        num_of_repeats, timecodec.to_datetime(until) if until is not None else None)
+    if last is None:
+        return None, ('The series has no occurrences', 400)
+    if timecodec.from_datetime(last[1]) - meeting['start_ts'] > SERIES_HORIZON:
+        return None, (f'A series must end within {SERIES_HORIZON // timecodec.DAY} days of its start', 400)
+
+    meeting.update({
+        'num_of_repeats': num_of_repeats,
+        'until_ts': until,
+        'span_end_ts': timecodec.from_datetime(last[1]),
+    })
+    return meeting, None
+
+# the first ids past the live rows and the archived ones, so an id of an
+# archived meeting or invitation is never handed out again
+NEXT_MEETING_ID_SQL = ('SELECT MAX((SELECT COALESCE(MAX(id), 0) FROM meetings), '
+                       '(SELECT COALESCE(MAX(max_id), 0) FROM archive_partitions)) + 1')
+NEXT_INVITATION_ID_SQL = ('SELECT MAX((SELECT COALESCE(MAX(id), 0) FROM invitations), '
+                          '(SELECT COALESCE(MAX(max_invitation_id), 0) FROM archive_partitions)) + 1')
+
+def create_meetings_(meetings):
+    # store parsed meetings and series in one transaction with one
+    # executemany per table, and return the id of each (series ids for series)
+    store = get_shards()
+    if store is not None:
+        # one-off meetings only, checked by the routes
+        return store.create_meetings(meetings)
+    db = get_write_db()
+    cursor = db.cursor()
+    if not db.in_transaction:
+        cursor.execute('BEGIN IMMEDIATE')
+
+    try:
+        # ids are handed out up front while holding the write lock, so the
+        # invitations can be batched along with their meetings
+        single = [meeting for meeting in meetings if meeting['repeat'] is None]
+        series = [meeting for meeting in meetings if meeting['repeat'] is not None]
+        next_meeting_id = cursor.execute(NEXT_MEETING_ID_SQL).fetchone()[0]
+        next_invitation_id = cursor.execute(NEXT_INVITATION_ID_SQL).fetchone()[0]
+        next_series_id = cursor.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM meeting_series').fetchone()[0]
+        ids = {}
+        for meeting in single:
+            ids[id(meeting)] = next_meeting_id
+            next_meeting_id += 1
+        for meeting in series:
+            ids[id(meeting)] = next_series_id
+            next_series_id += 1
+
+        # create the new meetings and invite the users
+        cursor.executemany(
+            'INSERT INTO meetings (id, title, description, start_ts, end_ts, location, organizer_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(ids[id(data)], data['title'], data['description'], data['start_ts'], data['end_ts'], data['location'], data['organizer_id'])
+             for data in single])
+        invitations = []
+        for data in single:
+            for user_id in data['invitees']:
+                invitations.append((next_invitation_id, user_id, ids[id(data)], 'pending'))
+                next_invitation_id += 1
+        cursor.executemany('INSERT INTO invitations (id, user_id, meeting_id, status) VALUES (?, ?, ?, ?)', invitations)
+
+        # a series stores its rule once, the occurrences are expanded when they are read
+        cursor.executemany(
+            'INSERT INTO meeting_series (id, title, description, start_ts, end_ts, location, organizer_id, repeat, num_of_repeats, until_ts, span_start_ts, span_end_ts) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(ids[id(data)], data['title'], data['description'], data['start_ts'], data['end_ts'], data['location'], data['organizer_id'],
+              data['repeat'], data['num_of_repeats'], data['until_ts'], data['start_ts'], data['span_end_ts'])
+             for data in series])
+        cursor.executemany(
+            'INSERT INTO series_invitations (user_id, series_id, status) VALUES (?, ?, ?)',
+            [(user_id, ids[id(data)], 'pending') for data in series for user_id in data['invitees']])
+
+        # organizers are busy for their meetings from the start
+        freebusy.add(db, [(data['organizer_id'], data['start_ts'], data['end_ts']) for data in single])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
 
-        allowed_repeats = {'daily', 'weekly', 'monthly', 'yearly', 'every weekday'}
+    return [ids[id(meeting)] for meeting in meetings]
 
-        if repeat not in allowed_repeats:
-            return jsonify({'error': 'Repeat can only be from "daily", "weekly", "monthly", "yearly", "every weekday"'}), 404
 
-        # let's set default value 2 repeats and max 10 repeats
-        if data['num_of_repeats'] > 10:
-            raise ValueError("Number of repeats exceeds maximum allowed value of 10.")
-        num_of_repeats = 2 if 'num_of_repeats' not in data else min(data['num_of_repeats'], 10)
+CONFLICT_POLICIES = ('ignore', 'warn', 'reject')
 
-        meeting_series = create_series_of_meetings(data, num_of_repeats)
-        create_meetings_(meeting_series)
-    else:
-        create_meetings_([data])
 
-    return jsonify({'message': 'Meeting created successfully'})
+def meeting_occurrences_(meeting):
+    # (start, end) of every occurrence of a parsed meeting or series
+    if meeting['repeat'] is None:
+        return [(meeting['start_ts'], meeting['end_ts'])]
+    to_datetime, from_datetime = timecodec.to_datetime, timecodec.from_datetime
+    until = meeting['until_ts']
+    return [(from_datetime(start), from_datetime(end)) for start, end, _ in recurrence.expand(
+        to_datetime(meeting['start_ts']), to_datetime(meeting['end_ts']), meeting['repeat'],
+        to_datetime(meeting['start_ts']), to_datetime(meeting['span_end_ts']), meeting['num_of_repeats'],
+        None if until is None else to_datetime(until))]
+
+
+def get_busy_by_user_(users, day_numbers, span_start, span_end):
+    # {user_id: (start, end) busy intervals} of each of `users`: their
+    # bitmaps on the given days from one query, and the occurrences inside
+    # [span_start, span_end) of the series they organized or accepted from
+    # another; the shards have only the bitmaps
+    store = get_shards()
+    if store is not None:
+        return store.busy_by_user(users, day_numbers)
+    db = get_db()
+    busy = freebusy.busy_by_user(db, users, day_numbers)
+
+    series = {}
+    series_users = {}
+    placeholders = ', '.join('?' * len(users))
+    for row in db.execute(USERS_SERIES_SQL.format(placeholders), (*users, span_end, span_start) * 2).fetchall():
+        series[row['id']] = row
+        series_users.setdefault(row['id'], set()).add(row['user_id'])
+    for start, end, _, row in expand_series_(list(series.values()), span_start, span_end):
+        for user_id in series_users[row['id']]:
+            busy.setdefault(user_id, []).append((start, end))
+    return busy
+
+
+def find_conflicts_(meeting):
+    # the occurrences of a parsed meeting or series that overlap something
+    # the organizer or an invitee organized or accepted, with who is busy.
+    # one query reads the users' busy bitmaps on the days the occurrences
+    # fall on and one their series over the whole span; every occurrence
+    # is then a bisect into each user's timeline. the bitmaps are kept to
+    # the minute, so a hit is checked against the user's meetings to the
+    # second before it counts: one that ends within the minute the next
+    # one starts in is no conflict
+    occurrences = meeting_occurrences_(meeting)
+    users = list(dict.fromkeys([meeting['organizer_id'], *meeting['invitees']]))
+    span_start, span_end = occurrences[0][0], occurrences[-1][1]
+
+    day_numbers = set()
+    for start, end in occurrences:
+        first_day, last_day = freebusy.days(start, end)
+        day_numbers.update(range(first_day, last_day + 1))
+    timelines = {user_id: BusyTimeline(intervals)
+                 for user_id, intervals in get_busy_by_user_(users, day_numbers, span_start, span_end).items()}
+    exact_timelines = {}
+    conflicts = []
+    for start, end in occurrences:
+        busy_users = [user_id for user_id in users if user_id in timelines and timelines[user_id].overlaps(start, end)]
+        for user_id in busy_users:
+            if user_id not in exact_timelines:
+                exact_timelines[user_id] = BusyTimeline(get_user_busy_(user_id, span_start, span_end))
+        busy_users = [user_id for user_id in busy_users if exact_timelines[user_id].overlaps(start, end)]
+        if busy_users:
+            conflicts.append({'start_time': timecodec.format(start), 'end_time': timecodec.format(end), 'users': busy_users})
+    return conflicts
+
+
+@app.route('/meetings', methods=['POST'])
+def create_meeting():
+    # get the request data
+    data = request.get_json()
+
+    meeting, error = parse_meeting_(data)
+    if error:
+        message, status = error
+        return jsonify({'error': message}), status
+
+    # optionally check the occurrences against everyone's calendar first,
+    # holding the write lock so nothing can be booked in between
+    policy = data.get('conflict_policy', 'ignore')
+    if policy not in CONFLICT_POLICIES:
+        return jsonify({'error': 'conflict_policy can only be "ignore", "warn" or "reject"'}), 400
+    if app.config['SHARDS'] and (meeting['repeat'] is not None or policy != 'ignore'):
+        return jsonify({'error': 'Series and conflict checks are not available on sharded storage'}), 501
+    conflicts = None
+    if policy != 'ignore':
+        db = get_write_db()
+        db.execute('BEGIN IMMEDIATE')
+        conflicts = find_conflicts_(meeting)
+        if conflicts and policy == 'reject':
+            db.rollback()
+            return jsonify({'error': 'The meeting conflicts with other meetings', 'conflicts': conflicts}), 409
+
+    meeting_id, = create_meetings_([meeting])
+
+    key = 'id' if meeting['repeat'] is None else 'series_id'
+    result = {'message': 'Meeting created successfully', key: meeting_id}
+    if conflicts is not None:
+        result['conflicts'] = conflicts
+    return jsonify(result)
+
+
+def read_bulk_items_():
+    # a bulk body is either a JSON array or NDJSON, one meeting per line;
+    # NDJSON is read line by line off the request stream, buffered since the
+    # raw stream reads lines a byte at a time
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        for line in io.BufferedReader(request.stream, 1 << 16):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+        return
+
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        raise ValueError('Expected a JSON array or NDJSON of meetings')
+    yield from items
+
+
+@app.route('/meetings/bulk', methods=['POST'])
+def create_meetings_bulk():
+    chunk_size = app.config['BULK_COMMIT_SIZE']
+    results = []
+    chunk = []
+    created = 0
+
+    def flush():
+        for (index, meeting), meeting_id in zip(chunk, create_meetings_([meeting for _, meeting in chunk])):
+            results[index] = {'index': index, 'id' if meeting['repeat'] is None else 'series_id': meeting_id}
+        chunk.clear()
+        # the chunk is committed; other writers get their turn while the
+        # next one is read off the request
+        release_write_db()
+
+    # validate every item once and write them a chunk (one transaction) at a time
+    try:
+        for index, item in enumerate(read_bulk_items_()):
+            meeting, error = parse_meeting_(item) if item is not None else (None, ('Invalid JSON', 400))
+            if not error and app.config['SHARDS'] and meeting['repeat'] is not None:
+                error = ('Series are not available on sharded storage', 501)
+            if error:
+                results.append({'index': index, 'error': error[0]})
+                continue
+            results.append(None)
+            chunk.append((index, meeting))
+            created += 1
+            if len(chunk) >= chunk_size:
+                flush()
+        flush()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'created': created, 'failed': len(results) - created, 'results': results})
+
+
+def meeting_dict_(row):
+    # a meetings row as the API shows it, with the times rendered as text
+    return {
+        'id': row['id'],
+        'title': row['title'],
+        'description': row['description'],
+        'start_time': timecodec.format(row['start_ts']),
+        'end_time': timecodec.format(row['end_ts']),
+        'location': row['location'],
+        'organizer_id': row['organizer_id'],
+    }
 
 
 @app.route('/meetings/<int:meeting_id>', methods=['GET'])
 def get_meeting(meeting_id):
+    store = get_shards()
+    if store is not None:
+        # the shards' answers don't bump a version, so this is read afresh
+        found = store.get_meeting(meeting_id)
+        if found is None:
+            return jsonify({'error': 'Meeting not found'}), 404
+        meeting, answers = found
+        return jsonify(meeting_details_(meeting._asdict(), answers))
+
     db = get_db()
     cursor = db.cursor()
 
-    # get the meeting from the database
-    meeting = cursor.execute('SELECT * FROM meetings WHERE id = ?', (meeting_id,)).fetchone()
+    # clients poll this page to watch the answers come in: the version
+    # alone tells whether what they (or the cache) have is still current
+    meeting = cursor.execute(MEETING_VERSION_SQL, (meeting_id,)).fetchone()
+
+    # or it may have been archived, in one of the months whose ids take it in
+    if not meeting:
+        for partition, _ in archive.holding(archive_partitions_(), [meeting_id]):
+            cursor = get_archive_db(partition.month).cursor()
+            meeting = cursor.execute(MEETING_VERSION_SQL, (meeting_id,)).fetchone()
+            if meeting:
+                break
 
     # check if the meeting exists
     if not meeting:
         return jsonify({'error': 'Meeting not found'}), 404
 
-    # get the pending users
-    pending_users = [dict(row) for row in cursor.execute(
-            'SELECT users.email, users.name FROM users JOIN invitations ON users.id = invitations.user_id WHERE meeting_id = ? AND status = ?',
-            (meeting_id, 'pending')
-        ).fetchall()]
-
-    # get the accepted users
-    accepted_users = [dict(row) for row in cursor.execute(
-            'SELECT users.email, users.name FROM users JOIN invitations ON users.id = invitations.user_id WHERE meeting_id = ? AND status = ?',
-            (meeting_id, 'accepted')
-        ).fetchall()]
-
-    # get the declined users
-    declined_users = [dict(row) for row in cursor.execute(
-            'SELECT users.email, users.name FROM users JOIN invitations ON users.id = invitations.user_id WHERE meeting_id = ? AND status = ?',
-            (meeting_id, 'declined')
-        ).fetchall()]
+    etag = f'{meeting_id}.{meeting["version"]}'
+    if request.if_none_match.contains(etag):
+        return meeting_response_(None, etag)
+
+    cache = get_meeting_cache()
+    payload = cache.get((meeting_id, meeting['version']))
+    if payload is None:
+        # get the meeting and every invited user in one query
+        rows = cursor.execute(MEETING_DETAILS_SQL, (meeting_id,)).fetchall()
+        if not rows:
+            return jsonify({'error': 'Meeting not found'}), 404
+        meeting = rows[0]
+        result = meeting_details_(meeting, [(row['status'], row['email'], row['name'])
+                                            for row in rows if row['status'] is not None])
+
+        # stored under the version it was read at, which may be newer
+        # than the one looked up above
+        etag = f'{meeting_id}.{meeting["version"]}'
+        payload = app.json.dumps(result)
+        cache.put((meeting_id, meeting['version']), payload)
+
+    return meeting_response_(payload, etag)
+
+def meeting_details_(meeting, answers):
+    # a meeting with its invited users grouped by the (status, email, name)
+    # of their answers
+    users = {'pending': [], 'accepted': [], 'declined': []}
+    for status, email, name in answers:
+        users[status].append({'email': email, 'name': name})
 
     # create a dictionary with the meeting details and invited users
-    result = {
+    return {
         'id': meeting['id'],
         'title': meeting['title'],
         'description': meeting['description'],
-        'start_time': meeting['start_time'],
-        'end_time': meeting['end_time'],
+        'start_time': timecodec.format(meeting['start_ts']),
+        'end_time': timecodec.format(meeting['end_ts']),
         'location': meeting['location'],
-        'pending_users': pending_users,
-        'accepted_users': accepted_users,
-        'declined_users': declined_users
+        'pending_users': users['pending'],
+        'accepted_users': users['accepted'],
+        'declined_users': users['declined']
     }
 
-    return jsonify(result)
+def meeting_response_(payload, etag):
+    # a meeting's details, or 304 Not Modified without a payload;
+    # no-cache makes clients check back with the ETag every time
+    response = Response(payload, status=200 if payload is not None else 304, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def window_occurrences_(window, organizer_id, after, after_time):
+    # (key, occurrence) of the series occurrences inside the window that
+    # come after the `after` key, in key order
+    window_start, window_end = window
+    search_start = max(window_start, after_time) if after else window_start
+    series = get_db().execute(
+        SERIES_IN_WINDOW_SQL + (' AND organizer_id = ?' if organizer_id else ''),
+        (window_end, search_start) + ((organizer_id,) if organizer_id else ())
+    ).fetchall()
+    occurrences = expand_series_(series, search_start, window_end)
+
+    # the series are read right away, only the expansion is left lazy
+    def paired():
+        for start, end, occurrence_start, row in occurrences:
+            if start < search_start or end > window_end:
+                continue
+            key = [start, 1, row['id'], occurrence_start]
+            if not after or key > after:
+                yield key, occurrence_dict_(start, end, occurrence_start, row)
+
+    return paired()
 
 
 @app.route('/meetings', methods=['GET'])
 def get_meetings():
-    db = get_db()
-    cursor = db.cursor()
-
-    # get users
-    meetings = [dict(row) for row in cursor.execute(
-        'SELECT * FROM meetings',
-    ).fetchall()]
-
-    return jsonify(meetings)
+    # optional filters: an organizer and a window, which also brings in the
+    # occurrences of recurring meetings
+    start_time = request.args.get('start_time')
+    end_time = request.args.get('end_time')
+    organizer_id = request.args.get('organizer_id')
+    try:
+        limit, after, stream = pagination.parse_args(request.args)
+        attendees = parse_include_(request.args)
+        window = start_time and end_time and (timecodec.parse(start_time, clamp=True), timecodec.parse(end_time, clamp=True))
+        organizer_id = organizer_id and int(organizer_id)
+        if after and (len(after) < 3 or after[1] not in (0, 1)):
+            raise ValueError('Invalid cursor')
+        after_time = after and after[0]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # meetings are sorted and paged by (start_ts, id); occurrences sort
+    # after the meetings that start at the same time
+    conditions = []
+    params = []
+    if organizer_id:
+        conditions.append('organizer_id = ?')
+        params.append(organizer_id)
+    if window:
+        conditions.append('start_ts >= ? AND end_ts <= ?')
+        params += window
+    if after and after[1] == 0:
+        conditions.append('(start_ts, id) > (?, ?)')
+        params += [after[0], after[2]]
+    elif after:
+        conditions.append('start_ts > ?')
+        params.append(after[0])
+    sql = f'SELECT {models.columns(models.Meeting)} FROM meetings' + (' WHERE ' + ' AND '.join(conditions) if conditions else '') + ' ORDER BY start_ts, id'
+
+    store = get_shards()
+    if store is not None:
+        if attendees:
+            return jsonify({'error': 'include=attendees is not available on sharded storage'}), 501
+        # a page at most from each shard, merged; an organizer's meetings
+        # are all on their own shard
+        rows = store.select(sql + (' LIMIT ?' if limit else ''), params + ([limit + 1] if limit else []),
+                            models.row_factory(models.Meeting), shards.MEETING_ORDER,
+                            [shards.shard_of(organizer_id, store.count)] if organizer_id else None)
+        return list_response_((([meeting.start_ts, 0, meeting.id], meeting) for meeting in rows), limit, stream)
+
+    cursor = get_db().cursor()
+    cursor.row_factory = models.row_factory(models.Meeting)
+    cursor.execute(sql, params)
+    meetings = (([meeting.start_ts, 0, meeting.id], meeting) for meeting in pagination.fetch_rows(cursor))
+
+    if window:
+        # archived meetings are only listed for a window that reaches into
+        # their months, a page of them at most from each
+        archived = []
+        for partition in archive.overlapping(archive_partitions_(), *window):
+            archive_cursor = get_archive_db(partition.month).cursor()
+            archive_cursor.row_factory = models.row_factory(models.Meeting)
+            rows = archive_cursor.execute(sql + (' LIMIT ?' if limit else ''), params + ([limit + 1] if limit else [])).fetchall()
+            archived.append([([meeting.start_ts, 0, meeting.id], meeting) for meeting in rows])
+        meetings = heapq.merge(meetings, *archived, window_occurrences_(window, organizer_id, after, after_time),
+                               key=lambda pair: pair[0])
+
+    return list_response_(meetings, limit, stream, attendees)
 
 
 @app.route('/invitations', methods=['GET'])
@@ -230,78 +1149,386 @@ def get_invitations():
     db = get_db()
     cursor = db.cursor()
 
-    # get invitations
-    invitations = [dict(row) for row in cursor.execute(
-        'SELECT * FROM invitations',
-    ).fetchall()]
+    try:
+        limit, after, stream = pagination.parse_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    return jsonify(invitations)
+    # get invitations, in id order so they can be paged by id
+    cursor.row_factory = models.row_factory(models.Invitation)
+    cursor.execute(
+        f'SELECT {models.columns(models.Invitation)} FROM invitations WHERE id > ? ORDER BY id',
+        (after[0] if after else 0,)
+    )
+    invitations = (([invitation.id], invitation) for invitation in pagination.fetch_rows(cursor))
+
+    return list_response_(invitations, limit, stream)
 
 
 @app.route('/meeting/<int:meeting_id>/invite/<int:user_id>/accept', methods=['POST'])
 def accept_invitation(meeting_id, user_id):
-    db = get_db()
+    store = get_shards()
+    if store is not None:
+        return sharded_rsvp_(store, meeting_id, user_id, 'accepted', 'Invitation accepted successfully')
+    return write_(accept_invitation_, meeting_id, user_id)
+
+def accept_invitation_(db, meeting_id, user_id):
     cursor = db.cursor()
 
     # check if the meeting exists
-    meeting = cursor.execute('SELECT * FROM meetings WHERE id = ?', (meeting_id,)).fetchone()
+    meeting = cursor.execute(MEETING_SQL, (meeting_id,)).fetchone()
     if not meeting:
-        return jsonify({'error': 'Meeting not found'}), 404
+        return {'error': 'Meeting not found'}, 404
 
     # check if the user is invited to the meeting
-    invitation = cursor.execute('SELECT * FROM invitations WHERE meeting_id = ? AND user_id = ?', (meeting_id, user_id)).fetchone()
+    invitation = cursor.execute(INVITATION_SQL, (meeting_id, user_id)).fetchone()
     if not invitation:
-        return jsonify({'error': 'Invitation not found'}), 404
+        return {'error': 'Invitation not found'}, 404
 
     # accept the invitation
-    cursor.execute('UPDATE invitations SET status = "accepted" WHERE meeting_id = ? AND user_id = ?', (meeting_id, user_id))
-    db.commit()
+    cursor.execute(RSVP_SQL, ('accepted', meeting_id, user_id))
+    cursor.execute(BUMP_MEETING_VERSION_SQL, (meeting_id,))
+    freebusy.add(db, [(user_id, meeting['start_ts'], meeting['end_ts'])])
 
-    return jsonify({'message': 'Invitation accepted successfully'})
+    return {'message': 'Invitation accepted successfully'}, 200
 
 @app.route('/meeting/<int:meeting_id>/invite/<int:user_id>/decline', methods=['POST'])
 def decline_invitation(meeting_id, user_id):
-    db = get_db()
+    store = get_shards()
+    if store is not None:
+        return sharded_rsvp_(store, meeting_id, user_id, 'declined', 'Invitation declined successfully')
+    return write_(decline_invitation_, meeting_id, user_id)
+
+def decline_invitation_(db, meeting_id, user_id):
     cursor = db.cursor()
 
     # check if the meeting exists
-    meeting = cursor.execute('SELECT * FROM meetings WHERE id = ?', (meeting_id,)).fetchone()
+    meeting = cursor.execute(MEETING_SQL, (meeting_id,)).fetchone()
     if not meeting:
-        return jsonify({'error': 'Meeting not found'}), 404
+        return {'error': 'Meeting not found'}, 404
 
     # check if the user is invited to the meeting
-    invitation = cursor.execute('SELECT * FROM invitations WHERE meeting_id = ? AND user_id = ?', (meeting_id, user_id)).fetchone()
+    invitation = cursor.execute(INVITATION_SQL, (meeting_id, user_id)).fetchone()
     if not invitation:
-        return jsonify({'error': 'Invitation not found'}), 404
+        return {'error': 'Invitation not found'}, 404
 
     # decline the invitation
-    cursor.execute('UPDATE invitations SET status = "declined" WHERE meeting_id = ? AND user_id = ?', (meeting_id, user_id))
+    cursor.execute(RSVP_SQL, ('declined', meeting_id, user_id))
+    cursor.execute(BUMP_MEETING_VERSION_SQL, (meeting_id,))
+    if invitation['status'] == 'accepted':
+        refresh_freebusy_(db, user_id, meeting['start_ts'], meeting['end_ts'])
+
+    return {'message': 'Invitation declined successfully'}, 200
+
+def sharded_rsvp_(store, meeting_id, user_id, status, message):
+    # answer on the invitee's shard; whether it was the meeting or the
+    # invitation that is missing is only looked up when one is
+    if not store.rsvp(meeting_id, user_id, status):
+        if meeting_id not in store.meetings([meeting_id]):
+            return jsonify({'error': 'Meeting not found'}), 404
+        return jsonify({'error': 'Invitation not found'}), 404
+    return jsonify({'message': message})
+
+# answers POST /invitations/rsvp takes at once
+RSVP_MAX_BATCH = 10000
+
+
+@app.route('/invitations/rsvp', methods=['POST'])
+def rsvp_invitations():
+    # answer many invitations at once: a JSON array of {meeting_id or
+    # series_id, user_id, status}, checked with one query per kind and
+    # written with one executemany per statement in one transaction
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        return jsonify({'error': 'Expected a JSON array of answers'}), 400
+    if len(items) > RSVP_MAX_BATCH:
+        return jsonify({'error': f'At most {RSVP_MAX_BATCH} answers can be sent at once'}), 400
+
+    results = [None] * len(items)
+    answers = {'meeting_id': [], 'series_id': []}
+    for index, item in enumerate(items):
+        kinds = [kind for kind in answers if isinstance(item, dict) and kind in item]
+        if len(kinds) != 1:
+            results[index] = {'index': index, 'error': 'Each answer needs either meeting_id or series_id'}
+        elif type(item[kinds[0]]) is not int or type(item.get('user_id')) is not int:
+            results[index] = {'index': index, 'error': f'{kinds[0]} and user_id must be ids'}
+        elif item.get('status') not in ('accepted', 'declined'):
+            results[index] = {'index': index, 'error': 'status must be "accepted" or "declined"'}
+        else:
+            answers[kinds[0]].append((index, item[kinds[0]], item['user_id'], item['status']))
+
+    db = get_write_db()
+    if not db.in_transaction:
+        db.execute('BEGIN IMMEDIATE')
+    try:
+        # the answers that refer to an invitation, in order, and per
+        # invitation the status it had before and the meeting's times
+        updates = []
+        invitations = {}
+        answered = answers['meeting_id']
+        pairs = json.dumps([[meeting_id, user_id] for _, meeting_id, user_id, _ in answered])
+        for position, meeting_id, start, end, previous in db.execute(RSVP_LOOKUP_SQL, (pairs,)).fetchall() if answered else ():
+            index, _, user_id, status = answered[position]
+            if meeting_id is None:
+                results[index] = {'index': index, 'error': 'Meeting not found'}
+            elif previous is None:
+                results[index] = {'index': index, 'error': 'Invitation not found'}
+            else:
+                results[index] = {'index': index, 'status': status}
+                updates.append((status, meeting_id, user_id))
+                invitations.setdefault((meeting_id, user_id), [previous, start, end])
+        db.executemany(RSVP_SQL, updates)
+        db.executemany(BUMP_MEETING_VERSION_SQL, [(meeting_id,) for meeting_id in sorted({meeting_id for _, meeting_id, _ in updates})])
+
+        # busy time follows the last answer each invitation got
+        final = {(meeting_id, user_id): status for status, meeting_id, user_id in updates}
+        accepted = []
+        for (meeting_id, user_id), status in final.items():
+            previous, start, end = invitations[(meeting_id, user_id)]
+            if status == 'accepted':
+                accepted.append((user_id, start, end))
+            elif previous == 'accepted':
+                refresh_freebusy_(db, user_id, start, end)
+        freebusy.add(db, accepted)
+
+        # one answer covers every occurrence of a series
+        updates = []
+        answered = answers['series_id']
+        pairs = json.dumps([[series_id, user_id] for _, series_id, user_id, _ in answered])
+        for position, series_id, previous in db.execute(SERIES_RSVP_LOOKUP_SQL, (pairs,)).fetchall() if answered else ():
+            index, _, user_id, status = answered[position]
+            if series_id is None:
+                results[index] = {'index': index, 'error': 'Series not found'}
+            elif previous is None:
+                results[index] = {'index': index, 'error': 'Invitation not found'}
+            else:
+                results[index] = {'index': index, 'status': status}
+                updates.append((status, series_id, user_id))
+        db.executemany(SERIES_RSVP_SQL, updates)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    updated = sum(1 for result in results if 'status' in result)
+    return jsonify({'updated': updated, 'failed': len(results) - updated, 'results': results})
+
+
+def refresh_freebusy_(db, user_id, start, end):
+    # busy bits can't be taken back one meeting at a time, since another
+    # meeting may cover the same minutes: the days [start, end) touches are
+    # recomputed from the meetings instead
+    first_day, last_day = freebusy.days(start, end)
+    window = ((last_day + 1) * timecodec.DAY, first_day * timecodec.DAY)
+    intervals = db.execute(USER_BUSY_SQL, (user_id, *window) * 2).fetchall()
+    # archived meetings on those days keep the user busy as well; this may
+    # run on the write queue's thread, so the months are read through `db`
+    database = archive.database_file(db)
+    for partition in archive.overlapping(archive.partitions(db), window[1], window[0]):
+        archived = archive.connect(database, partition.month)
+        try:
+            intervals += archived.execute(USER_BUSY_SQL, (user_id, *window) * 2).fetchall()
+        finally:
+            archived.close()
+    freebusy.replace(db, user_id, first_day, last_day, intervals)
+
+def expand_series_(series, window_start, window_end):
+    # lazily yield (start, end, occurrence_start, series) of the occurrences
+    # of the given series rows that overlap the window, in start order, all
+    # times in epoch seconds
+    db = get_db()
+    to_datetime, from_datetime = timecodec.to_datetime, timecodec.from_datetime
+
+    def optional_datetime(seconds):
+        return None if seconds is None else to_datetime(seconds)
+
+    if not series:
+        return iter(())
+
+    # exceptions are sparse, so load the ones of all these series at once
+    exceptions = {}
+    rows = db.execute(SERIES_EXCEPTIONS_SQL.format(', '.join('?' * len(series))), [row['id'] for row in series]).fetchall()
+    for row in rows:
+        exceptions.setdefault(row['series_id'], []).append((
+            to_datetime(row['occurrence_ts']), optional_datetime(row['start_ts']), optional_datetime(row['end_ts'])))
+
+    # the rules step through calendar days and months as datetimes, what
+    # comes out of them is epoch seconds again
+    window_start, window_end = to_datetime(window_start), to_datetime(window_end)
+
+    def occurrences(row):
+        for start, end, occurrence_start in recurrence.expand(
+                to_datetime(row['start_ts']), to_datetime(row['end_ts']), row['repeat'], window_start, window_end,
+                row['num_of_repeats'], optional_datetime(row['until_ts']), exceptions.get(row['id'], ())):
+            yield from_datetime(start), from_datetime(end), from_datetime(occurrence_start), row
+
+    return heapq.merge(*(occurrences(row) for row in series), key=lambda occurrence: occurrence[:2])
+
+def occurrence_dict_(start, end, occurrence_start, series):
+    return {
+        'id': None,
+        'series_id': series['id'],
+        'occurrence_start': timecodec.format(occurrence_start),
+        'title': series['title'],
+        'description': series['description'],
+        'start_time': timecodec.format(start),
+        'end_time': timecodec.format(end),
+        'location': series['location'],
+        'organizer_id': series['organizer_id'],
+    }
+
+
+@app.route('/series/<int:series_id>', methods=['GET'])
+def get_series(series_id):
+    db = get_db()
+    cursor = db.cursor()
+
+    # get the series from the database
+    series = cursor.execute('SELECT * FROM meeting_series WHERE id = ?', (series_id,)).fetchone()
+
+    # check if the series exists
+    if not series:
+        return jsonify({'error': 'Series not found'}), 404
+
+    # get the invited users by their answer
+    users = {'pending': [], 'accepted': [], 'declined': []}
+    for row in cursor.execute(
+            'SELECT users.email, users.name, series_invitations.status FROM series_invitations '
+            'JOIN users ON users.id = series_invitations.user_id WHERE series_invitations.series_id = ?',
+            (series_id,)
+    ).fetchall():
+        users[row['status']].append({'email': row['email'], 'name': row['name']})
+
+    # the occurrences that were moved or cancelled
+    exceptions = [exception_dict_(row) for row in cursor.execute(
+        'SELECT occurrence_ts, start_ts, end_ts FROM series_exceptions WHERE series_id = ? ORDER BY occurrence_ts',
+        (series_id,)
+    ).fetchall()]
+
+    result = {
+        'id': series['id'],
+        'title': series['title'],
+        'description': series['description'],
+        'start_time': timecodec.format(series['start_ts']),
+        'end_time': timecodec.format(series['end_ts']),
+        'location': series['location'],
+        'repeat': series['repeat'],
+        'num_of_repeats': series['num_of_repeats'],
+        'until': timecodec.format_or_none(series['until_ts']),
+        'exceptions': exceptions,
+        'pending_users': users['pending'],
+        'accepted_users': users['accepted'],
+        'declined_users': users['declined']
+    }
+
+    return jsonify(result)
+
+
+def respond_to_series_(db, series_id, user_id, status, message):
+    cursor = db.cursor()
+
+    # check if the series exists
+    series = cursor.execute('SELECT 1 FROM meeting_series WHERE id = ?', (series_id,)).fetchone()
+    if not series:
+        return {'error': 'Series not found'}, 404
+
+    # check if the user is invited to the series
+    invitation = cursor.execute('SELECT 1 FROM series_invitations WHERE series_id = ? AND user_id = ?', (series_id, user_id)).fetchone()
+    if not invitation:
+        return {'error': 'Invitation not found'}, 404
+
+    # one answer covers every occurrence
+    cursor.execute(SERIES_RSVP_SQL, (status, series_id, user_id))
+
+    return {'message': message}, 200
+
+@app.route('/series/<int:series_id>/invite/<int:user_id>/accept', methods=['POST'])
+def accept_series_invitation(series_id, user_id):
+    return write_(respond_to_series_, series_id, user_id, 'accepted', 'Invitation accepted successfully')
+
+@app.route('/series/<int:series_id>/invite/<int:user_id>/decline', methods=['POST'])
+def decline_series_invitation(series_id, user_id):
+    return write_(respond_to_series_, series_id, user_id, 'declined', 'Invitation declined successfully')
+
+
+@app.route('/series/<int:series_id>/exceptions', methods=['POST'])
+def create_series_exception(series_id):
+    db = get_write_db()
+    cursor = db.cursor()
+
+    # get the request data
+    data = request.get_json()
+
+    # check if the series exists
+    series = cursor.execute('SELECT * FROM meeting_series WHERE id = ?', (series_id,)).fetchone()
+    if not series:
+        return jsonify({'error': 'Series not found'}), 404
+
+    # an exception either moves one occurrence or cancels it
+    try:
+        occurrence_start = timecodec.parse(data['occurrence_start'])
+        cancelled = bool(data.get('cancelled'))
+        start_time = None if cancelled else timecodec.parse(data['start_time'])
+        end_time = None if cancelled else timecodec.parse(data['end_time'])
+    except KeyError as e:
+        return jsonify({'error': f'{e} is required'}), 400
+    except ValueError:
+        return jsonify({'error': 'Times must be in the format YYYY-mm-dd HH:MM:SS'}), 400
+    if not cancelled and end_time <= start_time:
+        return jsonify({'error': 'end_time must be after start_time'}), 400
+
+    if not recurrence.is_occurrence(
+            timecodec.to_datetime(series['start_ts']), timecodec.to_datetime(series['end_ts']), series['repeat'],
+            timecodec.to_datetime(occurrence_start), series['num_of_repeats'],
+            timecodec.to_datetime(series['until_ts']) if series['until_ts'] is not None else None):
+        return jsonify({'error': 'Occurrence not found'}), 404
+
+    cursor.execute(
+        'INSERT OR REPLACE INTO series_exceptions (series_id, occurrence_ts, start_ts, end_ts) VALUES (?, ?, ?, ?)',
+        (series_id, occurrence_start, start_time, end_time))
+
+    # a moved occurrence may fall outside the span the series was indexed with
+    if not cancelled:
+        cursor.execute('UPDATE meeting_series SET span_start_ts = MIN(span_start_ts, ?), span_end_ts = MAX(span_end_ts, ?) WHERE id = ?',
+                       (start_time, end_time, series_id))
     db.commit()
 
-    return jsonify({'message': 'Invitation declined successfully'})
+    return jsonify({'message': 'Occurrence cancelled successfully' if cancelled else 'Occurrence moved successfully'})
+
 
 def get_user_meetings_(user_id, start_time, end_time):
     db = get_db()
     cursor = db.cursor()
+    window_start, window_end = timecodec.parse(start_time, clamp=True), timecodec.parse(end_time, clamp=True)
 
     # get the user's meetings, all the meetings user created and all the meetings user accepted
-    meetings = [dict(row) for row in cursor.execute(
-        'SELECT DISTINCT m.* FROM meetings as m JOIN invitations as i WHERE (i.user_id = ? AND i.status = "accepted" OR m.organizer_id = ?) AND m.start_time >= ? AND m.end_time <= ?',
-        (user_id, user_id, start_time, end_time)
-    ).fetchall()]
+    cursor.row_factory = models.row_factory(models.Meeting)
+    params = (user_id, window_start, window_end, user_id, window_start, window_end)
+    meetings = [(meeting.start_ts, meeting) for meeting in cursor.execute(USER_MEETINGS_SQL, params).fetchall()]
+
+    # the same from the archived months the window reaches into
+    for partition in archive.overlapping(archive_partitions_(), window_start, window_end):
+        cursor = get_archive_db(partition.month).cursor()
+        cursor.row_factory = models.row_factory(models.Meeting)
+        meetings += [(meeting.start_ts, meeting) for meeting in cursor.execute(USER_MEETINGS_SQL, params).fetchall()]
+
+    # and the occurrences of the series user created or accepted
+    series = db.execute(USER_SERIES_SQL, (user_id, window_end, window_start) * 2).fetchall()
+    meetings += [(occurrence[0], occurrence_dict_(*occurrence)) for occurrence in expand_series_(series, window_start, window_end)
+                 if occurrence[0] >= window_start and occurrence[1] <= window_end]
+    meetings.sort(key=lambda pair: pair[0])
 
-    return meetings
+    return [meeting for _, meeting in meetings]
 
 
 @app.route('/users/<int:user_id>/meetings', methods=['GET'])
 def get_user_meetings(user_id):
-    db = get_db()
-    cursor = db.cursor()
-
-    # check if the user exists
-    user = cursor.execute('SELECT DISTINCT id FROM users WHERE id = ?',(user_id,)).fetchone()
-    if not user:
-        return jsonify({'error': 'User not found'}), 404
+    # check if the user exists; the shards tell along with the meetings
+    store = get_shards()
+    if store is None:
+        user = get_db().execute('SELECT DISTINCT id FROM users WHERE id = ?',(user_id,)).fetchone()
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
 
     # get the start_time and end_time parameters
     start_time = request.args.get('start_time')
@@ -310,14 +1537,225 @@ def get_user_meetings(user_id):
     # validate the parameters
     if not start_time or not end_time:
         return jsonify({'error': 'start_time and end_time are required query parameters'}), 400
+    try:
+        attendees = parse_include_(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if attendees and store is not None:
+        return jsonify({'error': 'include=attendees is not available on sharded storage'}), 501
+    try:
+        if store is not None:
+            meetings = store.user_meetings(user_id, timecodec.parse(start_time, clamp=True), timecodec.parse(end_time, clamp=True))
+        else:
+            meetings = get_user_meetings_(user_id, start_time, end_time)
+    except ValueError:
+        return jsonify({'error': 'Times must be in the format YYYY-mm-dd HH:MM:SS'}), 400
+    if meetings is None:
+        return jsonify({'error': 'User not found'}), 404
 
-    return jsonify(get_user_meetings_(user_id, start_time, end_time))
+    if attendees:
+        meetings = (item for _, item in with_attendees_(get_db(), ((None, meeting) for meeting in meetings), g.get('archive_partitions', ())))
+    return json_list_response_(meetings)
+
+
+@app.route('/users/<int:user_id>/calendar.ics', methods=['GET'])
+def get_user_calendar(user_id):
+    # the user's meetings and series as an iCalendar feed for calendar
+    # clients to subscribe to
+    db = get_db()
+    user = db.execute(FEED_VERSION_SQL, (user_id,)).fetchone()
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+
+    # clients poll feeds every few minutes: while the user's feed counter
+    # stays put they are told so without a meeting being read
+    etag = f'{user_id}.{user["feed_version"]}'
+    changed = user['feed_changed_ts']
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        since = request.if_modified_since
+        not_modified = since is not None and changed is not None and changed <= timecodec.from_datetime(since)
+    if not_modified:
+        return feed_response_(None, etag, changed)
+
+    # the feed is written as the rows are read, so it takes the connection
+    # over like a streamed list and hands it back at the end
+    g.pop('db')
+    pool = get_pool()
+    cancellation = g.get('cancellation')
+    events = calendar_events_(db, user_id, changed or 0)
+
+    def generate():
+        try:
+            yield from ical.calendar(events, user['name'])
+        finally:
+            if cancellation is not None:
+                cancellation.forget(db)
+            pool.release(db)
+
+    return feed_response_(generate(), etag, changed)
+
+def feed_meeting_events_(db, user_id, stamp):
+    # the VEVENT texts of the meetings in the user's feed that `db` holds
+    cursor = db.cursor()
+    cursor.row_factory = models.row_factory(models.Meeting)
+    cursor.execute(FEED_MEETINGS_SQL, (user_id, user_id))
+    for meeting in pagination.fetch_rows(cursor):
+        yield ical.event(f'meeting-{meeting.id}@calendar-backend', stamp, meeting.start_ts, meeting.end_ts,
+                         meeting.title, meeting.description, meeting.location)
+
+def calendar_events_(db, user_id, stamp):
+    # the VEVENT texts of the user's feed, read a batch of rows at a time:
+    # the live meetings, the archived ones, then the series with the
+    # exceptions of each batch
+    yield from feed_meeting_events_(db, user_id, stamp)
+
+    # a feed has no window, so every archived month is read, one file at a
+    # time; the feed outlives the request, so not through get_archive_db
+    database = archive.database_file(db)
+    for partition in archive.partitions(db):
+        archived = archive.connect(database, partition.month, app.config['DB_TIMEOUT'], get_registry())
+        try:
+            yield from feed_meeting_events_(archived, user_id, stamp)
+        finally:
+            archived.close()
+
+    cursor = db.cursor()
+    cursor.execute(FEED_SERIES_SQL, (user_id, user_id))
+    while True:
+        series = cursor.fetchmany(pagination.FETCH_SIZE)
+        if not series:
+            return
+        exceptions = {}
+        for series_id, *exception in db.execute(SERIES_EXCEPTIONS_SQL.format(', '.join('?' * len(series))),
+                                                [row['id'] for row in series]):
+            exceptions.setdefault(series_id, []).append(exception)
+        for row in series:
+            yield from ical.series_events(f'series-{row["id"]}@calendar-backend', stamp, row,
+                                          sorted(exceptions.get(row['id'], ())))
+
+def feed_response_(body, etag, changed):
+    # a feed, or 304 Not Modified without one
+    response = Response(body, status=200 if body is not None else 304, mimetype='text/calendar')
+    response.set_etag(etag)
+    if changed is not None:
+        response.last_modified = changed
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def get_user_busy_(user_id, window_start, window_end):
+    db = get_db()
+    window = (window_end, window_start)
+
+    # get the (start, end) epoch seconds of every meeting the user organized
+    # or accepted that overlaps the window, including the ones that are
+    # already running; plain tuples straight from SQLite
+    cursor = db.cursor()
+    cursor.row_factory = None
+    busy = cursor.execute(USER_BUSY_SQL, (user_id, *window) * 2).fetchall()
+    for partition in archive.overlapping(archive_partitions_(), window_start, window_end):
+        cursor = get_archive_db(partition.month).cursor()
+        cursor.row_factory = None
+        busy += cursor.execute(USER_BUSY_SQL, (user_id, *window) * 2).fetchall()
+
+    # and of the occurrences of the series user organized or accepted
+    return busy + get_user_series_busy_(user_id, window_start, window_end)
+
+
+def get_user_series_busy_(user_id, window_start, window_end):
+    # (start, end) of the occurrences of the series the user organized or
+    # accepted that overlap the window
+    series = get_db().execute(USER_SERIES_SQL, (user_id, window_end, window_start) * 2).fetchall()
+    return [(start, end) for start, end, _, _ in expand_series_(series, window_start, window_end)]
+
+
+def get_users_freebusy_(users, window_start, window_end):
+    # (start, end) of the time any of the users is busy around the window:
+    # one-off meetings come from the bitmaps, rounded out to whole minutes
+    # and covering the whole days the window touches, series are expanded.
+    # the shards have no series
+    store = get_shards()
+    if store is not None:
+        return store.busy(users, window_start, window_end)
+    busy = freebusy.busy(get_db(), users, window_start, window_end)
+    for user in users:
+        busy += get_user_series_busy_(user, window_start, window_end)
+    return busy
+
+
+@app.route('/users/<int:user_id>/freebusy', methods=['GET'])
+def get_user_freebusy(user_id):
+    db = get_db()
+
+    # check if the user exists
+    if not db.execute('SELECT 1 FROM users WHERE id = ?', (user_id,)).fetchone():
+        return jsonify({'error': 'User not found'}), 404
+
+    try:
+        window_start = timecodec.parse(request.args['start_time'], clamp=True)
+        window_end = timecodec.parse(request.args['end_time'], clamp=True)
+    except KeyError:
+        return jsonify({'error': 'start_time and end_time are required query parameters'}), 400
+    except ValueError:
+        return jsonify({'error': 'Times must be in the format YYYY-mm-dd HH:MM:SS'}), 400
+    if not 0 < window_end - window_start <= FREE_SLOTS_MAX_WINDOW:
+        return jsonify({'error': f'The window must be between 0 and {FREE_SLOTS_MAX_WINDOW // timecodec.DAY} days long'}), 400
+
+    # merged busy blocks, cut to the window
+    busy = [(max(start, window_start), min(end, window_end))
+            for start, end in BusyTimeline(get_users_freebusy_([user_id], window_start, window_end))
+            if start < window_end and end > window_start]
+    return jsonify({'busy': [{'start_time': timecodec.format(start), 'end_time': timecodec.format(end)} for start, end in busy]})
+
+
+# the free interval search looks at most this far ahead, one chunk at a time
+FREE_INTERVAL_HORIZON = 520 * timecodec.WEEK
+FREE_INTERVAL_FIRST_CHUNK = timecodec.DAY
+FREE_INTERVAL_MAX_CHUNK = 12 * timecodec.WEEK
+
+
+def check_search_(users, meeting_duration):
+    # the error of a free time search request, or None
+    if not isinstance(users, list) or not users or not all(type(user) is int for user in users):
+        return 'users must be a non-empty list of user ids'
+    if type(meeting_duration) not in (int, float) or not 0 < meeting_duration < float('inf'):
+        return 'meeting_duration must be a positive number of minutes'
+    return None
+
+def find_free_interval_(users, meeting_duration, now):
+    # epoch seconds of the first moment from `now` on when every user is
+    # free for `meeting_duration` minutes, or None
+    duration = int(meeting_duration * timecodec.MINUTE)
+    horizon = now + FREE_INTERVAL_HORIZON
+    chunk = FREE_INTERVAL_FIRST_CHUNK
+
+    # walk forward from now and only load the busy time of the chunk being
+    # searched, so a gap found early costs a few bitmap reads
+    candidate = now
+    window_start = now
+    while window_start < horizon:
+        window_end = min(window_start + chunk, horizon)
+        timeline = BusyTimeline(get_users_freebusy_(users, window_start, window_end))
+        slot = timeline.first_gap(candidate, duration, window_end)
+        if slot is not None:
+            return slot
+
+        # the last free run may continue into the next chunk
+        candidate = timeline.resume_point(candidate, window_end)
+        window_start = max(window_end, candidate)
+        chunk = min(chunk * 2, FREE_INTERVAL_MAX_CHUNK)
+
+    return None
 
 
 @app.route('/free_interval', methods=['GET'])
 def find_free_interval():
     # get the request data
     data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({'error': 'The request must be a JSON object'}), 400
 
     # check if the required fields are present
     try:
@@ -325,37 +1763,344 @@ def find_free_interval():
         meeting_duration = data['meeting_duration'] # I assume that meeting duration is in minutes
     except KeyError as e:
         return jsonify({'error': f'{e} is required'}), 400
+    error = check_search_(users, meeting_duration)
+    if error:
+        return jsonify({'error': error}), 400
+
+    # the search starts now (UTC) unless asked otherwise
+    try:
+        now = timecodec.parse(data['start_time'], clamp=True) if data.get('start_time') else timecodec.now()
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Times must be in the format YYYY-mm-dd HH:MM:SS'}), 400
+    slot = find_free_interval_(users, meeting_duration, now)
+    if slot is None:
+        return jsonify({'message': 'No time for a new meeting'})
+
+    return jsonify({'message': 'Next meeting can be created at {prev_time}'.format(prev_time=timecodec.format(slot))})
+
+
+# queries POST /free_interval/batch takes at once, and distinct users
+# across them
+FREE_INTERVAL_MAX_BATCH = 1000
+FREE_INTERVAL_MAX_BATCH_USERS = 5000
+
+
+def parse_interval_query_(item, now):
+    # (users, duration, start, end) of one POST /free_interval/batch query,
+    # or (None, error)
+    if not isinstance(item, dict):
+        return None, 'Each query must be a JSON object'
+    if 'users' not in item or 'meeting_duration' not in item:
+        return None, 'users and meeting_duration are required'
+    error = check_search_(item['users'], item['meeting_duration'])
+    if error:
+        return None, error
+    try:
+        start = timecodec.parse(item['start_time'], clamp=True) if item.get('start_time') else now
+        end = timecodec.parse(item['end_time'], clamp=True) if item.get('end_time') else start + FREE_SLOTS_WINDOW
+    except (TypeError, ValueError):
+        return None, 'Times must be in the format YYYY-mm-dd HH:MM:SS'
+    if not 0 < end - start <= FREE_SLOTS_MAX_WINDOW:
+        return None, f'The window must be between 0 and {FREE_SLOTS_MAX_WINDOW // timecodec.DAY} days long'
+    return (frozenset(item['users']), int(item['meeting_duration'] * timecodec.MINUTE), start, end), None
+
+
+def merged_timelines_(groups, timelines):
+    # {users: BusyTimeline} of every group of users, merged from the users'
+    # own timelines. smaller groups are merged first and each group starts
+    # from the largest one already merged inside it, so the same team with
+    # and without its optional attendees only merges the optional ones again
+    merged = {}
+    for group in sorted(groups, key=len):
+        base = max((done for done in merged if done < group), key=len, default=frozenset())
+        parts = [merged[base]] if base else []
+        parts += [timelines[user] for user in group - base if user in timelines]
+        merged[group] = parts[0] if len(parts) == 1 else BusyTimeline.merge(parts)
+    return merged
+
+
+@app.route('/free_interval/batch', methods=['POST'])
+def find_free_intervals():
+    # answer many free interval queries at once: a JSON array of {users,
+    # meeting_duration, start_time, end_time}. every user's busy time is
+    # read once for the whole batch, the timelines of each group of users
+    # are merged once however many queries ask about that group, and each
+    # query is then a walk over its group's timeline
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        return jsonify({'error': 'Expected a JSON array of queries'}), 400
+    if len(items) > FREE_INTERVAL_MAX_BATCH:
+        return jsonify({'error': f'At most {FREE_INTERVAL_MAX_BATCH} queries can be sent at once'}), 400
+
+    now = timecodec.now()
+    results = [None] * len(items)
+    searches = {}
+    for index, item in enumerate(items):
+        query, error = parse_interval_query_(item, now)
+        if error:
+            results[index] = {'index': index, 'error': error}
+            continue
+        users, duration, start, end = query
+        searches.setdefault(users, []).append((index, (start, duration, end)))
+
+    if searches:
+        users = sorted(frozenset().union(*searches))
+        if len(users) > FREE_INTERVAL_MAX_BATCH_USERS:
+            return jsonify({'error': f'A batch can ask about at most {FREE_INTERVAL_MAX_BATCH_USERS} users'}), 400
+        queries = [search for group in searches.values() for _, search in group]
+        span_start = min(start for start, _, _ in queries)
+        span_end = max(end for _, _, end in queries)
+        if span_end - span_start > FREE_SLOTS_MAX_WINDOW:
+            return jsonify({'error': f'The windows of a batch must fit in {FREE_SLOTS_MAX_WINDOW // timecodec.DAY} days'}), 400
+
+        # the bitmaps of just the days some window touches
+        day_numbers = set()
+        for start, _, end in queries:
+            first_day, last_day = freebusy.days(start, end)
+            day_numbers.update(range(first_day, last_day + 1))
+        timelines = {user_id: BusyTimeline(intervals)
+                     for user_id, intervals in get_busy_by_user_(users, day_numbers, span_start, span_end).items()}
+        merged = merged_timelines_(searches, timelines)
+
+        # the walks are pure CPU, so with SWEEP_PROCESSES set the groups are
+        # shared out between the sweep processes
+        groups = list(searches)
+        arguments = [merged[group] for group in groups], [[search for _, search in searches[group]] for group in groups]
+        sweep_pool = get_sweep_pool()
+        if sweep_pool is None or len(groups) == 1:
+            answers = map(first_gaps, *arguments)
+        else:
+            chunksize = -(-len(groups) // app.config['SWEEP_PROCESSES'])
+            answers = sweep_pool.map(first_gaps, *arguments, chunksize=chunksize)
+        for group, slots in zip(groups, answers):
+            for (index, (_, duration, _)), slot in zip(searches[group], slots):
+                if slot is None:
+                    results[index] = {'index': index, 'message': 'No time for a new meeting'}
+                else:
+                    results[index] = {'index': index, 'start_time': timecodec.format(slot),
+                                      'end_time': timecodec.format(slot + duration)}
+
+    found = sum(1 for result in results if 'start_time' in result)
+    return jsonify({'found': found, 'results': results})
+
+
+# how far ahead /free_slots looks by default, and at most
+FREE_SLOTS_WINDOW = 2 * timecodec.WEEK
+FREE_SLOTS_MAX_WINDOW = 366 * timecodec.DAY
+FREE_SLOTS_MAX_K = 100
+
+
+@app.route('/free_slots', methods=['GET', 'POST'])
+def find_free_slots():
+    db = get_db()
+    cursor = db.cursor()
+
+    # get the request data
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({'error': 'The request must be a JSON object'}), 400
+
+    # check if the required fields are present
+    try:
+        users = data['users']
+        meeting_duration = data['meeting_duration'] # in minutes, like /free_interval
+    except KeyError as e:
+        return jsonify({'error': f'{e} is required'}), 400
+    error = check_search_(users, meeting_duration)
+    if error:
+        return jsonify({'error': error}), 400
+
+    try:
+        start = timecodec.parse(data['start_time'], clamp=True) if data.get('start_time') else timecodec.now()
+        end = timecodec.parse(data['end_time'], clamp=True) if data.get('end_time') else start + FREE_SLOTS_WINDOW
+    except ValueError:
+        return jsonify({'error': 'Times must be in the format YYYY-mm-dd HH:MM:SS'}), 400
+    if not 0 < end - start <= FREE_SLOTS_MAX_WINDOW:
+        return jsonify({'error': f'The window must be between 0 and {FREE_SLOTS_MAX_WINDOW // timecodec.DAY} days long'}), 400
+
+    k = data.get('k', 5)
+    buffer_minutes = data.get('buffer_minutes', 0)
+    granularity_minutes = data.get('granularity_minutes')
+    if type(k) is not int or not 1 <= k <= FREE_SLOTS_MAX_K:
+        return jsonify({'error': f'k must be between 1 and {FREE_SLOTS_MAX_K}'}), 400
+    if not isinstance(buffer_minutes, (int, float)) or buffer_minutes < 0:
+        return jsonify({'error': 'buffer_minutes must not be negative'}), 400
+    if granularity_minutes is not None and (not isinstance(granularity_minutes, int) or granularity_minutes < 1):
+        return jsonify({'error': 'granularity_minutes must be a positive whole number of minutes'}), 400
+
+    # check that every user exists
+    rows = {row['id']: row for row in cursor.execute(
+        'SELECT id, timezone, work_start, work_end, work_days FROM users WHERE id IN ({})'.format(', '.join('?' * len(users))),
+        users
+    ).fetchall()}
+    missing = [user for user in users if user not in rows]
+    if missing:
+        return jsonify({'error': f'Users not found: {missing}'}), 404
+
+    # everything that rules a moment out is an epoch interval: the users'
+    # meetings padded by the buffer, and the time outside their working hours
+    buffer = int(buffer_minutes * timecodec.MINUTE)
+    starts, ends = [], []
+    for user in rows.values():
+        for busy_start, busy_end in get_user_busy_(user['id'], start - buffer, end + buffer):
+            starts.append(busy_start - buffer)
+            ends.append(busy_end + buffer)
+        if data.get('working_hours', True) and user['work_start']:
+            hours = scheduling.working_hours(
+                start, end, user['timezone'] or 'UTC', user['work_start'], user['work_end'],
+                json.loads(user['work_days']) if user['work_days'] else scheduling.WORK_DAYS)
+            for off_start, off_end in scheduling.off_hours(start, end, hours):
+                starts.append(off_start)
+                ends.append(off_end)
+
+    duration = int(meeting_duration * timecodec.MINUTE)
+    sweep = (starts, ends, start, end, duration, k, granularity_minutes and granularity_minutes * 60)
+    sweep_pool = get_sweep_pool()
+    if sweep_pool is None:
+        slots = scheduling.find_slots(*sweep)
+    else:
+        slots = sweep_pool.submit(scheduling.find_slots, *sweep).result()
+
+    return jsonify({'slots': [
+        {'start_time': timecodec.format(slot), 'end_time': timecodec.format(slot + duration)}
+        for slot in slots
+    ]})
+
+
+# the changes after a sync token, oldest first; the log keeps only the
+# latest change of each item, so this is at most one entry per item
+CHANGES_SQL = 'SELECT id, kind, item_id, deleted FROM changes WHERE id > ? ORDER BY id LIMIT ?'
+CHANGES_PRUNED_SQL = 'SELECT position, pruned_ts FROM changes_pruned'
+
+SYNC_PAGE_SIZE = 1000
+
+
+def series_dict_(row):
+    # a meeting_series row as the API shows it
+    return {
+        'id': row['id'],
+        'title': row['title'],
+        'description': row['description'],
+        'start_time': timecodec.format(row['start_ts']),
+        'end_time': timecodec.format(row['end_ts']),
+        'location': row['location'],
+        'organizer_id': row['organizer_id'],
+        'repeat': row['repeat'],
+        'num_of_repeats': row['num_of_repeats'],
+        'until': timecodec.format_or_none(row['until_ts']),
+    }
 
-    start_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    end_time = (datetime.now() + timedelta(weeks=520)).strftime('%Y-%m-%d %H:%M:%S')
-    timestampts = [(0, start_time), (0, end_time)]
 
-    # let's take wider window of time for looking for users' meetings
-    # in order to take into account relevant meetings
-    start_time = datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S') - timedelta(days=1)
-    for user in users:
-        user_meetings = get_user_meetings_(user, start_time, end_time)
-        for meeting in user_meetings:
-            timestampts.append((1, meeting['start_time']))
-            timestampts.append((-1, meeting['end_time']))
+def exception_dict_(row):
+    # a series_exceptions row as the API shows it
+    return {
+        'occurrence_start': timecodec.format(row['occurrence_ts']),
+        'start_time': timecodec.format_or_none(row['start_ts']),
+        'end_time': timecodec.format_or_none(row['end_ts']),
+    }
+
 
-    start_time = (start_time + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+def prune_changes_(db, now):
+    # drop the deletions logged more than SYNC_TOKEN_DAYS ago, remembering
+    # the newest one dropped: tokens before it would miss it.
+    # returns the position tokens have to be at or after
+    cutoff = now - int(app.config['SYNC_TOKEN_DAYS'] * timecodec.DAY)
+    db.execute('UPDATE changes_pruned SET pruned_ts = ?, position = MAX(position, COALESCE('
+               '(SELECT MAX(id) FROM changes WHERE deleted = 1 AND changed_ts < ?), 0))', (now, cutoff))
+    db.execute('DELETE FROM changes WHERE deleted = 1 AND changed_ts < ?', (cutoff,))
+    return db.execute(CHANGES_PRUNED_SQL).fetchone()['position']
 
-    timestampts.sort(key=lambda x: x[1])
 
-    prev_time = None
-    cur_balance = 0
+# how each kind in the change log is read and shown, by its response key
+SYNC_KINDS = {
+    'meeting': ('meetings', 'meetings', meeting_dict_),
+    'invitation': ('invitations', 'invitations', dict),
+    'series': ('series', 'meeting_series', series_dict_),
+    'series_invitation': ('series_invitations', 'series_invitations', dict),
+}
+
+
+@app.route('/sync', methods=['GET'])
+def sync():
+    db = get_db()
+
+    # the token is the position in the change log the client has seen
+    try:
+        token = request.args.get('token')
+        position = pagination.decode_cursor(token) if token else [0]
+        if len(position) != 1:
+            raise ValueError('Invalid token')
+        after, = position
+        limit, _, _ = pagination.parse_args({'limit': request.args.get('limit', SYNC_PAGE_SIZE)})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    horizon, pruned_ts = db.execute(CHANGES_PRUNED_SQL).fetchone()
+    now = timecodec.now()
+    if pruned_ts <= now - app.config['SYNC_PRUNE_INTERVAL']:
+        write_db = get_write_db()
+        horizon = prune_changes_(write_db, now)
+        write_db.commit()
+        release_write_db()
+    if token and after < horizon:
+        return jsonify({'error': 'The token has expired, sync again without one'}), 410
+
+    changes = db.execute(CHANGES_SQL, (after, limit + 1)).fetchall()
+    more = len(changes) > limit
+    del changes[limit:]
+
+    changed = {kind: [] for kind in SYNC_KINDS}
+    for change in changes:
+        if not change['deleted']:
+            changed[change['kind']].append(change['item_id'])
+
+    # the current rows of everything that changed, one query per kind;
+    # a row that is gone by now is reported as deleted
+    result = {key: [] for key, _, _ in SYNC_KINDS.values()}
+    result['deleted'] = {key: [] for key, _, _ in SYNC_KINDS.values()}
+    for kind, (key, table, render) in SYNC_KINDS.items():
+        found = set()
+        ids = changed[kind]
+        if ids:
+            for row in db.execute(f'SELECT * FROM {table} WHERE id IN ({", ".join("?" * len(ids))}) ORDER BY id', ids):
+                found.add(row['id'])
+                result[key].append(render(row))
+        result['deleted'][key] = [change['item_id'] for change in changes
+                                  if change['kind'] == kind and (change['deleted'] or change['item_id'] not in found)]
+
+    # series come with their moved and cancelled occurrences
+    if result['series']:
+        exceptions = {series['id']: [] for series in result['series']}
+        sql = SERIES_EXCEPTIONS_SQL.format(', '.join('?' * len(exceptions))) + ' ORDER BY occurrence_ts'
+        for row in db.execute(sql, list(exceptions)):
+            exceptions[row['series_id']].append(exception_dict_(row))
+        for series in result['series']:
+            series['exceptions'] = exceptions[series['id']]
+
+    result['token'] = pagination.encode_cursor([changes[-1]['id'] if changes else after])
+    result['more'] = more
+    return jsonify(result)
 
-    # count a balance, if the balance is zero then it is a free slot
-    for balance, time in timestampts:
-        if prev_time is not None and cur_balance == 0 and prev_time >= start_time:
-            diff_time = datetime.strptime(time, '%Y-%m-%d %H:%M:%S') - datetime.strptime(prev_time, '%Y-%m-%d %H:%M:%S')
-            if diff_time.total_seconds() >= 60 * meeting_duration:
-                return jsonify({'message': 'Next meeting can be created at {prev_time}'.format(prev_time=prev_time)})
-        cur_balance += balance
-        prev_time = time
 
-    return jsonify({'message': 'No time for a new meeting'})
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    # everything in the Prometheus text format, for this process only
+    # with SHARDS set the pools of all the shards, added up
+    store = get_shards()
+    gauges = metrics.stats_gauges('calendar_pool', (store or get_pool()).stats(), (
+        'connections_opened', 'reader_acquisitions', 'reader_reuses', 'reader_waits',
+        'writer_acquisitions', 'writer_waits', 'wait_seconds', 'timeouts'))
+    gauges += metrics.stats_gauges('calendar_meeting_cache', get_meeting_cache().stats(), (
+        'hits', 'misses', 'evictions', 'expirations'))
+    write_queue = get_write_queue()
+    if write_queue is not None:
+        gauges += metrics.stats_gauges('calendar_write_queue', write_queue.stats(), (
+            'operations', 'failed_operations', 'batches', 'failed_batches', 'commit_seconds'))
+    compactor = get_compactor()
+    if compactor is not None:
+        gauges += metrics.stats_gauges('calendar_archive', compactor.stats(), (
+            'runs', 'failed_runs', 'meetings_moved', 'invitations_moved', 'run_seconds'))
+    return Response(get_registry().render(gauges), mimetype='text/plain; version=0.0.4')
 
 
 if __name__ == '__main__':
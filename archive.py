@@ -0,0 +1,253 @@
+# time partitioned storage: one-off meetings that ended long enough ago are
+# moved, with their invitations, out of the live tables into one SQLite file
+# per month they started in, next to the database
+#
+#     calendar.db  ->  calendar-archive-2022-03.db, calendar-archive-2022-04.db, ...
+#
+# so the tables and indexes the hot queries walk only hold current and
+# future meetings. the live database keeps a row per archived month with the
+# times and ids its meetings span, and reads look into a month's file only
+# when the range or ids they ask for reach into it. series stay live: a
+# series is one row however many occurrences it has.
+#
+#     python archive.py calendar.db 90
+#
+# archives the meetings of calendar.db that ended more than 90 days ago,
+# as the app does on its own when ARCHIVE_AFTER_DAYS is set
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+from urllib.request import pathname2url
+
+import metrics
+import timecodec
+
+logger = logging.getLogger('calendar.archive')
+
+# meetings moved per transaction; the writer is handed back in between
+ARCHIVE_BATCH = 5000
+
+MEETING_COLUMNS = 'id, title, description, start_ts, end_ts, location, organizer_id, version'
+INVITATION_COLUMNS = 'id, user_id, meeting_id, status'
+
+# the tables of an archive file, attached as `archive`: the live ones
+# without their foreign keys, since users stay in the live database, and
+# the indexes the routed reads use
+ARCHIVE_SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS archive.meetings (
+        id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL,
+        description TEXT,
+        start_ts INTEGER NOT NULL,
+        end_ts INTEGER NOT NULL,
+        location TEXT NOT NULL,
+        organizer_id INTEGER NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0
+    )''',
+    '''CREATE TABLE IF NOT EXISTS archive.invitations (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        meeting_id INTEGER NOT NULL,
+        status TEXT NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_invitations_user_status ON invitations (user_id, status, meeting_id)',
+    'CREATE INDEX IF NOT EXISTS archive.idx_invitations_meeting ON invitations (meeting_id, user_id, status)',
+    'CREATE INDEX IF NOT EXISTS archive.idx_meetings_organizer_start ON meetings (organizer_id, start_ts, end_ts)',
+    'CREATE INDEX IF NOT EXISTS archive.idx_meetings_start_end ON meetings (start_ts, end_ts)',
+)
+
+# the oldest meetings that ended before a cutoff, served by idx_meetings_start_end
+ARCHIVABLE_SQL = 'SELECT id, start_ts FROM meetings WHERE start_ts < ? AND end_ts < ? ORDER BY start_ts LIMIT ?'
+
+COPY_MEETINGS_SQL = (
+    f'INSERT OR REPLACE INTO archive.meetings ({MEETING_COLUMNS}) '
+    f'SELECT {MEETING_COLUMNS} FROM main.meetings WHERE id IN (SELECT value FROM json_each(?))'
+)
+COPY_INVITATIONS_SQL = (
+    f'INSERT OR REPLACE INTO archive.invitations ({INVITATION_COLUMNS}) '
+    f'SELECT {INVITATION_COLUMNS} FROM main.invitations WHERE meeting_id IN (SELECT value FROM json_each(?))'
+)
+DELETE_INVITATIONS_SQL = 'DELETE FROM main.invitations WHERE meeting_id IN (SELECT value FROM json_each(?))'
+DELETE_MEETINGS_SQL = 'DELETE FROM main.meetings WHERE id IN (SELECT value FROM json_each(?))'
+
+# what a month's file holds, recounted after every move into it
+PARTITION_SQL = (
+    'INSERT OR REPLACE INTO main.archive_partitions '
+    '(month, meetings, first_start_ts, last_end_ts, min_id, max_id, max_invitation_id) '
+    'SELECT ?, COUNT(*), MIN(start_ts), MAX(end_ts), MIN(id), MAX(id), '
+    '(SELECT COALESCE(MAX(id), 0) FROM archive.invitations) FROM archive.meetings'
+)
+
+PARTITIONS_SQL = 'SELECT month, meetings, first_start_ts, last_end_ts, min_id, max_id FROM archive_partitions ORDER BY month'
+
+Partition = namedtuple('Partition', 'month meetings first_start_ts last_end_ts min_id max_id')
+
+
+def path(database, month):
+    # the archive file of a month ('YYYY-mm') of a database
+    stem, extension = os.path.splitext(database)
+    return f'{stem}-archive-{month}{extension or ".db"}'
+
+
+def partitions(db):
+    # every archived month of the live database `db` is connected to
+    return [Partition(*row) for row in db.execute(PARTITIONS_SQL)]
+
+
+def overlapping(partitions, start, end):
+    # the months that may hold a meeting overlapping [start, end]
+    return [partition for partition in partitions if partition.first_start_ts <= end and partition.last_end_ts >= start]
+
+
+def holding(partitions, ids):
+    # (partition, ids) of the months whose id range takes in some of `ids`
+    found = []
+    for partition in partitions:
+        inside = [item_id for item_id in ids if partition.min_id <= item_id <= partition.max_id]
+        if inside:
+            found.append((partition, inside))
+    return found
+
+
+def database_file(db):
+    # the file of the database `db` is connected to
+    return db.execute('PRAGMA database_list').fetchone()[2]
+
+
+def _read_only(file):
+    return 'file:' + pathname2url(os.path.abspath(file)) + '?mode=ro'
+
+
+def connect(database, month, timeout=5.0, registry=None):
+    # a read-only connection to a month's file with the live database
+    # attached: the month's meetings and invitations come first and every
+    # other table (users) resolves to the live one, so the app's queries
+    # run on it unchanged
+    db = sqlite3.connect(_read_only(path(database, month)), uri=True, timeout=timeout, check_same_thread=False,
+                         factory=metrics.InstrumentedConnection)
+    db.registry = registry
+    db.row_factory = sqlite3.Row
+    db.execute('ATTACH DATABASE ? AS live', (_read_only(database),))
+    return db
+
+
+def move(db, database, month, ids):
+    # move meetings that all started in `month`, and their invitations, into
+    # its file; the copy is committed before the live rows are deleted, so a
+    # crash in between leaves copies that the next run replaces rather than
+    # losing anything. the deletes run with the month in `archiving`, which
+    # keeps them out of the change log and the feed versions: the meetings
+    # are still there, only elsewhere. returns the number of invitations moved
+    ids = json.dumps(ids)
+    db.execute('ATTACH DATABASE ? AS archive', (path(database, month),))
+    try:
+        for statement in ARCHIVE_SCHEMA:
+            db.execute(statement)
+        db.execute(COPY_MEETINGS_SQL, (ids,))
+        db.execute(COPY_INVITATIONS_SQL, (ids,))
+        db.commit()
+        db.execute('INSERT INTO main.archiving (month) VALUES (?)', (month,))
+        invitations = db.execute(DELETE_INVITATIONS_SQL, (ids,)).rowcount
+        db.execute(DELETE_MEETINGS_SQL, (ids,))
+        db.execute('DELETE FROM main.archiving')
+        db.execute(PARTITION_SQL, (month,))
+        db.commit()
+        return invitations
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.execute('DETACH DATABASE archive')
+
+
+def compact(pool, database, cutoff, batch_size=ARCHIVE_BATCH):
+    # archive every meeting that ended before `cutoff`, oldest first, a
+    # batch per turn on the pool's writer; returns (meetings, invitations)
+    # moved
+    meetings = invitations = 0
+    while True:
+        db = pool.acquire_writer()
+        try:
+            rows = db.execute(ARCHIVABLE_SQL, (cutoff, cutoff, batch_size)).fetchall()
+            months = {}
+            for meeting_id, start_ts in rows:
+                months.setdefault(timecodec.format(start_ts)[:7], []).append(meeting_id)
+            for month, ids in sorted(months.items()):
+                invitations += move(db, database, month, ids)
+        finally:
+            pool.release(db)
+        meetings += len(rows)
+        if len(rows) < batch_size:
+            return meetings, invitations
+
+
+class Compactor:
+    # archives the meetings that ended more than `age` seconds ago, every
+    # `interval` seconds on a thread of its own, for as long as the pool
+    # is in use
+
+    def __init__(self, pool, age, interval):
+        self.pool = pool
+        self.age = age
+        self.interval = interval
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'runs': 0,
+            'failed_runs': 0,
+            'meetings_moved': 0,
+            'invitations_moved': 0,
+            'run_seconds': 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name='archive', daemon=True)
+        self._thread.start()
+
+    def run(self):
+        # one pass; returns (meetings, invitations) moved
+        started = time.perf_counter()
+        try:
+            meetings, invitations = compact(self.pool, self.pool.path, timecodec.now() - self.age)
+        except Exception:
+            with self._stats_lock:
+                self._stats['failed_runs'] += 1
+            raise
+        with self._stats_lock:
+            self._stats['runs'] += 1
+            self._stats['meetings_moved'] += meetings
+            self._stats['invitations_moved'] += invitations
+            self._stats['run_seconds'] += time.perf_counter() - started
+        return meetings, invitations
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run()
+            except Exception:
+                logger.exception('Archiving past meetings failed')
+            self._stop.wait(self.interval)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({'age': self.age, 'interval': self.interval})
+        return stats
+
+
+if __name__ == '__main__':
+    from pool import ConnectionPool
+
+    database = sys.argv[1] if len(sys.argv) > 1 else 'calendar.db'
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 90
+    pool = ConnectionPool(database, size=1)
+    meetings, invitations = compact(pool, database, timecodec.now() - days * timecodec.DAY)
+    pool.close()
+    print('Archived', meetings, 'meetings and', invitations, 'invitations')
@@ -0,0 +1,239 @@
+# an ASGI entry point for the same routes, for an async server
+#
+#     uvicorn asgi:application
+#
+# the Flask app stays synchronous and SQLite calls block, so every request
+# runs on a bounded pool of threads, and the availability searches on a
+# smaller pool of their own: a burst of slow searches can then only take
+# their own threads, and cheap reads like GET /meetings/<id> keep being
+# served next to them. a request that hasn't started its response after
+# REQUEST_TIMEOUT seconds is answered with 504, and it and a request whose
+# client went away are cancelled: the statements running on their SQLite
+# connections are interrupted
+import asyncio
+import io
+import json
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app
+
+# routes whose requests run on the search threads
+SEARCH_PATHS = ('/free_interval', '/free_interval/batch', '/free_slots')
+
+
+class Cancellation:
+    # the SQLite connections one request holds, so the event loop can
+    # interrupt them, and whether the request got to answer first
+
+    def __init__(self):
+        self.cancelled = False
+        self.responding = False
+        self._lock = threading.Lock()
+        self._connections = set()
+
+    def watch(self, db):
+        with self._lock:
+            if self.cancelled:
+                raise TimeoutError('The request was cancelled')
+            self._connections.add(db)
+
+    def forget(self, db):
+        with self._lock:
+            self._connections.discard(db)
+
+    def respond(self):
+        # called before the response starts; False once it was cancelled
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.responding = True
+            return True
+
+    def cancel(self, timed_out=False):
+        # on a timeout only a request that hasn't started to answer is
+        # cancelled; returns whether it was
+        with self._lock:
+            if timed_out and self.responding:
+                return False
+            self.cancelled = True
+            for db in self._connections:
+                db.interrupt()
+            return True
+
+
+def wsgi_environ(scope, body):
+    # the WSGI environ of an ASGI HTTP request
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    # the body is read whole, so its length is known even when chunked
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+class AsyncCalendar:
+
+    def __init__(self, wsgi_app, request_workers, search_workers, timeout):
+        self.wsgi_app = wsgi_app
+        self.timeout = timeout
+        self.requests = ThreadPoolExecutor(request_workers, thread_name_prefix='request')
+        self.searches = ThreadPoolExecutor(search_workers, thread_name_prefix='search') if search_workers else self.requests
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError(f'Unsupported ASGI scope {scope["type"]}')
+
+        body = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+
+        loop = asyncio.get_running_loop()
+        cancellation = Cancellation()
+        environ = wsgi_environ(scope, b''.join(body))
+        environ['calendar.cancellation'] = cancellation
+        started = loop.create_future()
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def mark_started():
+            loop.call_soon_threadsafe(lambda: started.done() or started.set_result(None))
+
+        def finished(future):
+            # a cancelled request's thread may fail long after its answer
+            # was sent; its error is taken here so it isn't reported as lost
+            if not future.cancelled():
+                future.exception()
+            if not started.done():
+                started.set_result(None)
+
+        executor = self.searches if scope['path'] in SEARCH_PATHS else self.requests
+        work = loop.run_in_executor(executor, self._run, environ, cancellation, send_from_thread, mark_started)
+        work.add_done_callback(finished)
+        disconnected = asyncio.ensure_future(self._disconnect(receive))
+        try:
+            await asyncio.wait({started, disconnected}, timeout=self.timeout, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                cancellation.cancel()
+                return
+            if not started.done() and cancellation.cancel(timed_out=True):
+                await self._timed_out(send)
+                return
+            await asyncio.wait({work, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if not work.done():
+                cancellation.cancel()
+                return
+            work.result()
+        finally:
+            disconnected.cancel()
+
+    def _run(self, environ, cancellation, send, mark_started):
+        # runs on a worker thread: the whole WSGI request, sent back a
+        # chunk at a time unless it was cancelled meanwhile
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+        body = self.wsgi_app(environ, start_response)
+        try:
+            if not cancellation.respond():
+                return
+            send({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+            mark_started()
+            for chunk in body:
+                if cancellation.cancelled:
+                    return
+                if chunk:
+                    send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+    async def _disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def _timed_out(self, send):
+        body = json.dumps({'error': f'The request took longer than {self.timeout} seconds'}).encode()
+        await send({'type': 'http.response.start', 'status': 504,
+                    'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.requests.shutdown(wait=False, cancel_futures=True)
+                self.searches.shutdown(wait=False, cancel_futures=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+async def call(application, method, path, query_string=b'', json_body=None, headers=()):
+    # one request through an ASGI app without a server, for the tests and
+    # the benchmark; returns (status, headers, body)
+    body = b'' if json_body is None else json.dumps(json_body).encode()
+    headers = list(headers) + ([(b'content-type', b'application/json')] if json_body is not None else [])
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string, 'headers': headers,
+             'http_version': '1.1', 'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 0)}
+    requests = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    finished = asyncio.Event()
+    response = {'body': []}
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = message['headers']
+        else:
+            response['body'].append(message.get('body', b''))
+            if not message.get('more_body'):
+                finished.set()
+
+    await application(scope, receive, send)
+    finished.set()
+    return response.get('status'), dict(response.get('headers', ())), b''.join(response['body'])
+
+
+application = AsyncCalendar(app, app.config['REQUEST_WORKERS'], app.config['SEARCH_WORKERS'], app.config['REQUEST_TIMEOUT'])
@@ -0,0 +1,126 @@
+# load tests against synthetic calendars
+#
+#     python -m benchmarks run --meetings 5000 --concurrency 4 --scaling 1000,5000,20000 --output baseline.json
+#     python -m benchmarks run --output current.json && python -m benchmarks compare baseline.json current.json
+#     python -m benchmarks traffic --output traffic.jsonl
+#     python -m benchmarks run --url http://127.0.0.1:5000 --traffic traffic.jsonl --no-load
+#
+# `run` builds a fresh database from the generator, replays generated (or
+# recorded) traffic and prints or saves per-endpoint numbers; `compare`
+# exits with 1 when the second result regressed against the first
+import argparse
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+from app import app
+from benchmarks import generator, replay, report, scaling
+from benchmarks.scaling import fresh_target
+
+
+def parse_anchor(value):
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+def dataset_args(args):
+    users = args.users or max(20, args.meetings // 25)
+    return generator.generate(users, args.meetings, args.seed, args.anchor)
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as directory:
+        dataset = dataset_args(args)
+        if args.url:
+            target = replay.HttpTarget(args.url)
+        else:
+            target = fresh_target(os.path.join(directory, 'bench.db'))
+        ids = generator.fresh_ids(dataset) if args.no_load else generator.load(target, dataset)
+
+        if args.traffic:
+            requests = replay.read_traffic(args.traffic)
+        else:
+            requests = generator.traffic(dataset, ids, args.requests, args.seed)
+        replay.replay(target, requests[:args.warmup], app, args.concurrency)
+        records, wall = replay.replay(target, requests, app, args.concurrency)
+        result = report.summarize(records, wall)
+        result['config'] = {'users': len(dataset['users']), 'meetings': args.meetings, 'seed': args.seed,
+                            'requests': len(requests), 'concurrency': args.concurrency,
+                            'target': args.url or 'test-client'}
+        # against a server this process is only the load generator, whose
+        # memory says nothing about the app's
+        if not args.url:
+            result['peak_rss_mb'] = report.peak_rss_mb()
+
+        if args.scaling:
+            result['scaling'] = scaling.measure(
+                args.scaling, directory, users=args.users, seed=args.seed, anchor=args.anchor,
+                requests=args.scaling_requests, concurrency=args.concurrency)
+
+    if args.output:
+        report.save(args.output, result)
+    print(json.dumps(result, indent=2, sort_keys=True))
+
+
+def traffic(args):
+    # traffic for the dataset `run` builds with the same options, to replay
+    # against a server that loaded it
+    dataset = dataset_args(args)
+    ids = generator.fresh_ids(dataset)
+    replay.write_traffic(args.output, generator.traffic(dataset, ids, args.requests, args.seed))
+
+
+def compare(args):
+    baseline, current = report.load(args.baseline), report.load(args.current)
+    if baseline.get('config') != current.get('config'):
+        print('Note: the runs used different settings:', baseline.get('config'), current.get('config'))
+    regressions = report.compare(baseline, current, args.tolerance)
+    for regression in regressions:
+        print(regression)
+    if regressions:
+        sys.exit(1)
+    print('No regressions')
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_dataset_options(command):
+        command.add_argument('--users', type=int, help='default: one per 25 meetings, at least 20')
+        command.add_argument('--meetings', type=int, default=5000)
+        command.add_argument('--seed', type=int, default=0)
+        command.add_argument('--anchor', type=parse_anchor, help='YYYY-mm-dd the data starts at, default: this Monday')
+        command.add_argument('--requests', type=int, default=2000)
+
+    command = commands.add_parser('run', help='replay traffic and report per-endpoint numbers')
+    add_dataset_options(command)
+    command.add_argument('--concurrency', type=int, default=1)
+    command.add_argument('--warmup', type=int, default=100, help='requests sent before measuring')
+    command.add_argument('--traffic', help='a recorded traffic JSONL file to replay instead of generated traffic')
+    command.add_argument('--url', help='a running server to send the requests to, instead of the test client')
+    command.add_argument('--no-load', action='store_true', help='the server already has the data')
+    command.add_argument('--scaling', type=lambda value: [int(size) for size in value.split(',')],
+                         help='comma-separated meeting counts to measure /free_interval and /users/<id>/meetings at')
+    command.add_argument('--scaling-requests', type=int, default=200)
+    command.add_argument('--output', help='save the result as a JSON baseline')
+    command.set_defaults(handler=run)
+
+    command = commands.add_parser('traffic', help='write generated traffic as JSONL')
+    add_dataset_options(command)
+    command.add_argument('--output', required=True)
+    command.set_defaults(handler=traffic)
+
+    command = commands.add_parser('compare', help='fail when a result regressed against a baseline')
+    command.add_argument('baseline')
+    command.add_argument('current')
+    command.add_argument('--tolerance', type=float, default=0.2, help='allowed relative change, default 0.2')
+    command.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# measures GET /meetings/<id> while slow /free_slots searches for a large
+# group keep coming in, served through asgi.py two ways: every request on
+# one pool of threads, as a threaded WSGI server would, and with the
+# searches on threads of their own and their sweeps in worker processes
+#
+#     python -m benchmarks.async_mode --meetings 20000 --seconds 10
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import asgi
+from app import app
+from benchmarks.bulk_import import fresh_client, make_meetings
+from benchmarks.report import percentile
+
+# (name, request threads, search threads, sweep processes)
+MODES = (
+    ('shared_threads', 8, 0, 0),
+    ('search_threads_and_processes', 6, 2, 2),
+)
+
+
+async def client(application, make_request, deadline, latencies):
+    while time.perf_counter() < deadline:
+        method, path, body = make_request()
+        started = time.perf_counter()
+        status, _, _ = await asgi.call(application, method, path, json_body=body)
+        latencies.append((time.perf_counter() - started, status))
+
+
+def summary(latencies):
+    times = sorted(seconds * 1000 for seconds, _ in latencies)
+    return {
+        'requests': len(times),
+        'errors': sum(1 for _, status in latencies if status >= 400),
+        'p50_ms': round(percentile(times, 0.5), 2) if times else None,
+        'p95_ms': round(percentile(times, 0.95), 2) if times else None,
+        'p99_ms': round(percentile(times, 0.99), 2) if times else None,
+    }
+
+
+def measure(mode, meetings, users, seconds, searches, readers, seed=0):
+    name, request_workers, search_workers, sweep_processes = mode
+    app.config['SWEEP_PROCESSES'] = sweep_processes
+    application = asgi.AsyncCalendar(app, request_workers, search_workers, timeout=60)
+    rng = random.Random(seed)
+    group = list(range(1, users + 1))
+
+    def search():
+        return 'POST', '/free_slots', {
+            'users': rng.sample(group, min(40, users)), 'meeting_duration': 45, 'k': 100, 'granularity_minutes': 5,
+            'working_hours': False, 'start_time': '2022-01-03 00:00:00', 'end_time': '2022-12-31 00:00:00'}
+
+    def read():
+        return 'GET', f'/meetings/{rng.randrange(1, meetings + 1)}', None
+
+    async def run():
+        deadline = time.perf_counter() + seconds
+        search_latencies, read_latencies = [], []
+        await asyncio.gather(
+            *(client(application, search, deadline, search_latencies) for _ in range(searches)),
+            *(client(application, read, deadline, read_latencies) for _ in range(readers)))
+        return {'GET /meetings/<int:meeting_id>': summary(read_latencies), 'POST /free_slots': summary(search_latencies)}
+
+    try:
+        return name, asyncio.run(run())
+    finally:
+        application.requests.shutdown()
+        application.searches.shutdown()
+        sweep_pool = app.extensions.pop('sweep_pool', None)
+        if sweep_pool is not None:
+            sweep_pool[1].shutdown()
+        app.config['SWEEP_PROCESSES'] = 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--meetings', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=60)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--searches', type=int, default=8, help='clients sending /free_slots back to back')
+    parser.add_argument('--readers', type=int, default=4, help='clients sending GET /meetings/<id> back to back')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        client = fresh_client(path, args.users)
+        response = client.post('/meetings/bulk', json=make_meetings(args.meetings, args.users))
+        assert response.status_code == 200, response.data
+        # weekly series are stored apart, so there are fewer meeting rows
+        db = sqlite3.connect(path)
+        meetings = db.execute('SELECT max(id) FROM meetings').fetchone()[0]
+        db.close()
+        for mode in MODES:
+            name, result = measure(mode, meetings, args.users, args.seconds, args.searches, args.readers)
+            results[name] = result
+    app.config['DATABASE'] = 'calendar.db'
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# measures POST /meetings/bulk against one POST /meetings per meeting
+#
+#     python -m benchmarks.bulk_import --meetings 20000
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from app import app, init_db
+
+
+def make_meetings(count, users, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2022, 1, 3, 8, 0)
+    meetings = []
+    for i in range(count):
+        begin = start + timedelta(minutes=30 * rng.randrange(0, 365 * 24))
+        meeting = {
+            'title': f'Meeting {i}',
+            'description': 'Imported meeting',
+            'start_time': begin.strftime('%Y-%m-%d %H:%M:%S'),
+            'end_time': (begin + timedelta(minutes=rng.choice((15, 30, 60)))).strftime('%Y-%m-%d %H:%M:%S'),
+            'location': 'Office',
+            'organizer_id': rng.randrange(1, users + 1),
+            'invited_users': json.dumps(rng.sample(range(1, users + 1), rng.randrange(0, min(users, 8)))),
+        }
+        # one in twenty is a weekly series
+        if rng.random() < 0.05:
+            meeting.update(repeat='weekly', num_of_repeats=rng.randrange(2, 52))
+        meetings.append(meeting)
+    return meetings
+
+
+def fresh_client(path, users):
+    if os.path.exists(path):
+        os.remove(path)
+    app.config['DATABASE'] = path
+    init_db()
+    client = app.test_client()
+    for i in range(1, users + 1):
+        client.post('/users', json={'name': f'User {i}', 'email': f'user{i}@example.com', 'password': 'password'})
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--meetings', type=int, default=20000)
+    parser.add_argument('--single', type=int, default=1000, help='meetings sent one request each')
+    parser.add_argument('--users', type=int, default=50)
+    args = parser.parse_args()
+
+    meetings = make_meetings(args.meetings, args.users)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+
+        client = fresh_client(path, args.users)
+        started = time.perf_counter()
+        for meeting in meetings[:args.single]:
+            client.post('/meetings', json=meeting)
+        elapsed = time.perf_counter() - started
+        results['single_requests'] = {'meetings': args.single, 'seconds': round(elapsed, 3),
+                                      'meetings_per_second': round(args.single / elapsed, 1)}
+
+        for name, content_type, body in (
+                ('bulk_json', 'application/json', json.dumps(meetings)),
+                ('bulk_ndjson', 'application/x-ndjson', '\n'.join(map(json.dumps, meetings)))):
+            client = fresh_client(path, args.users)
+            started = time.perf_counter()
+            response = client.post('/meetings/bulk', data=body, content_type=content_type)
+            elapsed = time.perf_counter() - started
+            assert response.status_code == 200, response.data
+            results[name] = {'meetings': response.json['created'], 'seconds': round(elapsed, 3),
+                             'meetings_per_second': round(response.json['created'] / elapsed, 1)}
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# measures POST /free_interval/batch against one GET /free_interval per
+# query, for what a scheduling assistant asks: a few teams, each with and
+# without its optional attendees and at a few durations
+#
+#     python -m benchmarks.free_interval_batch --meetings 5000 --teams 50
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from app import app
+from benchmarks import generator
+from benchmarks.scaling import fresh_target
+
+DURATIONS = (30, 60, 90)
+
+
+def make_queries(users, teams, start_time, seed=0):
+    # every team alone and with one or two optional attendees, at each
+    # duration, searching from `start_time`
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(teams):
+        team = rng.sample(range(1, users + 1), rng.randrange(3, 9))
+        optional = rng.sample([user for user in range(1, users + 1) if user not in team], 2)
+        for group in (team, team + optional[:1], team + optional):
+            for duration in DURATIONS:
+                queries.append({'users': group, 'meeting_duration': duration, 'start_time': start_time})
+    return queries
+
+
+def one_at_a_time(client, queries):
+    # the start of each answer, None when there was none
+    answers = []
+    for query in queries:
+        message = client.get('/free_interval', json=query).get_json()['message']
+        answers.append(message.rsplit(' at ', 1)[1] if ' at ' in message else None)
+    return answers
+
+
+def batched(client, queries):
+    response = client.post('/free_interval/batch', json=queries)
+    assert response.status_code == 200, response.data
+    return [result.get('start_time') for result in response.get_json()['results']]
+
+
+def measure(name, run, client, queries, repeats):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        answers = run(client, queries)
+    elapsed = (time.perf_counter() - started) / repeats
+    return answers, {name: {'queries': len(queries), 'seconds': round(elapsed, 4),
+                            'queries_per_second': round(len(queries) / elapsed, 1)}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--meetings', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--teams', type=int, default=50, help='each asked about 9 ways')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--processes', type=int, default=2, help='SWEEP_PROCESSES of the last run')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        # every search starts at 9:00 on the first Monday of the data
+        anchor = datetime(2022, 3, 7)
+        target = fresh_target(os.path.join(directory, 'bench.db'))
+        generator.load(target, generator.generate(args.users, args.meetings, anchor=anchor))
+        client = app.test_client()
+        queries = make_queries(args.users, args.teams, '2022-03-07 09:00:00')
+
+        expected, result = measure('single_requests', one_at_a_time, client, queries, args.repeats)
+        results.update(result)
+        answers, result = measure('batch', batched, client, queries, args.repeats)
+        results.update(result)
+        app.config['SWEEP_PROCESSES'] = args.processes
+        try:
+            batched(client, queries[:20])  # start the processes first
+            answers, result = measure(f'batch_{args.processes}_processes', batched, client, queries, args.repeats)
+            results.update(result)
+        finally:
+            sweep_pool = app.extensions.pop('sweep_pool', None)
+            if sweep_pool is not None:
+                sweep_pool[1].shutdown()
+            app.config['SWEEP_PROCESSES'] = 0
+        # the batch only looks two weeks ahead, a single search further
+        results['same_answers'] = sum(1 for single, batch in zip(expected, answers) if single == batch)
+    app.config['DATABASE'] = 'calendar.db'
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+# deterministic synthetic calendars: the same seed and anchor always give
+# the same users, meetings, invitations, answers and traffic
+import json
+import random
+from datetime import datetime, timedelta, timezone
+
+TIMEZONES = ('UTC', 'Europe/Berlin', 'Europe/London', 'America/New_York', 'America/Los_Angeles', 'Asia/Tokyo')
+
+# meeting length in minutes and how often it comes up
+DURATIONS = ((15, 20), (30, 40), (45, 10), (60, 25), (90, 5))
+
+# how many people a meeting invites: mostly a few, sometimes a crowd
+INVITEES = ((0, 10), (1, 25), (2, 20), (3, 15), (4, 10), (6, 10), (10, 6), (25, 4))
+
+# one meeting in five is a series; the rule and how it is bounded
+SERIES_SHARE = 0.2
+REPEATS = (('weekly', 50), ('every weekday', 20), ('daily', 10), ('monthly', 20))
+
+# what invitees answer
+ANSWERS = (('accepted', 60), ('declined', 15), (None, 25))
+
+# requests in generated traffic and how often each one is made
+TRAFFIC_MIX = (
+    ('meeting', 30),
+    ('user_meetings', 25),
+    ('free_interval', 10),
+    ('free_slots', 10),
+    ('meetings_window', 10),
+    ('rsvp', 10),
+    ('create_meeting', 5),
+)
+
+
+def current_monday():
+    # data is laid out from the start of this week, so searches that begin
+    # at the wall clock (/free_interval) run into it
+    today = datetime.now(timezone.utc).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=today.weekday())
+
+
+def _pick(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+
+def _format(moment):
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def generate(users=200, meetings=5000, seed=0, anchor=None, days=90):
+    # a dataset of `users` users and `meetings` meetings or series spread
+    # over `days` days from `anchor`, with who is invited and what they
+    # answered; meetings[i] is answered by answers entries naming index i
+    rng = random.Random(seed)
+    anchor = anchor or current_monday()
+
+    dataset = {'anchor': _format(anchor), 'users': [], 'meetings': [], 'answers': []}
+    for i in range(1, users + 1):
+        user = {'name': f'User {i}', 'email': f'user{i}@example.com', 'password': 'password'}
+        if rng.random() < 0.7:
+            user.update(timezone=rng.choice(TIMEZONES), work_start='09:00', work_end=rng.choice(('17:00', '18:00')))
+        dataset['users'].append(user)
+
+    # a few people organize most meetings
+    organizer_weights = [1 / (rank + 1) ** 0.8 for rank in range(users)]
+    for index in range(meetings):
+        day = anchor + timedelta(days=rng.randrange(days))
+        start = day + timedelta(hours=rng.randrange(7, 19), minutes=rng.choice((0, 15, 30, 45)))
+        end = start + timedelta(minutes=_pick(rng, DURATIONS))
+        organizer = rng.choices(range(1, users + 1), organizer_weights)[0]
+        others = [user for user in range(1, users + 1) if user != organizer]
+        invitees = sorted(rng.sample(others, min(_pick(rng, INVITEES), len(others))))
+
+        meeting = {
+            'title': f'Meeting {index}',
+            'description': 'Synthetic meeting',
+            'start_time': _format(start),
+            'end_time': _format(end),
+            'location': rng.choice(('Office', 'Room 1', 'Room 2', 'Online')),
+            'organizer_id': organizer,
+            'invited_users': json.dumps(invitees),
+        }
+        if rng.random() < SERIES_SHARE:
+            meeting['repeat'] = _pick(rng, REPEATS)
+            if rng.random() < 0.5:
+                meeting['num_of_repeats'] = rng.randrange(2, 60)
+            else:
+                meeting['until'] = _format(start + timedelta(days=rng.randrange(14, 365)))
+        dataset['meetings'].append(meeting)
+
+        for user in invitees:
+            status = _pick(rng, ANSWERS)
+            if status:
+                dataset['answers'].append({'meeting': index, 'user_id': user, 'status': status})
+
+    return dataset
+
+
+def load(target, dataset):
+    # create the dataset through the API of a target with an empty
+    # database, and return the ids the meetings got as (kind, id) pairs
+    for user in dataset['users']:
+        target.request('POST', '/users', json=user)
+
+    response = target.request('POST', '/meetings/bulk', json=dataset['meetings'])
+    ids = []
+    for result in response.json()['results']:
+        if 'error' in result:
+            raise ValueError(f"Meeting {result['index']} was rejected: {result['error']}")
+        ids.append(('meeting', result['id']) if 'id' in result else ('series', result['series_id']))
+
+    for answer in dataset['answers']:
+        kind, meeting_id = ids[answer['meeting']]
+        verb = 'accept' if answer['status'] == 'accepted' else 'decline'
+        path = f'/meeting/{meeting_id}' if kind == 'meeting' else f'/series/{meeting_id}'
+        target.request('POST', f"{path}/invite/{answer['user_id']}/{verb}")
+    return ids
+
+
+def fresh_ids(dataset):
+    # the (kind, id) pairs `load` gets from an empty database, where
+    # meetings and series are each numbered from 1 in order
+    counters = {'meeting': 0, 'series': 0}
+    ids = []
+    for meeting in dataset['meetings']:
+        kind = 'meeting' if meeting.get('repeat') is None else 'series'
+        counters[kind] += 1
+        ids.append((kind, counters[kind]))
+    return ids
+
+
+def traffic(dataset, ids, count=2000, seed=0, mix=TRAFFIC_MIX):
+    # `count` recorded-traffic style requests against a loaded dataset:
+    # {'method', 'path', 'query', 'json'}, the format replay.read_traffic reads
+    rng = random.Random(seed)
+    anchor = datetime.strptime(dataset['anchor'], '%Y-%m-%d %H:%M:%S')
+    users = len(dataset['users'])
+    meeting_ids = [meeting_id for kind, meeting_id in ids if kind == 'meeting']
+    invitations = [(index, invitee) for index, meeting in enumerate(dataset['meetings']) if ids[index][0] == 'meeting'
+                   for invitee in json.loads(meeting['invited_users'])]
+
+    requests = []
+    for _ in range(count):
+        kind = _pick(rng, mix)
+        user = rng.randrange(1, users + 1)
+        day = anchor + timedelta(days=rng.randrange(90))
+        if kind == 'meeting':
+            request = {'method': 'GET', 'path': f'/meetings/{rng.choice(meeting_ids)}'}
+        elif kind == 'user_meetings':
+            request = {'method': 'GET', 'path': f'/users/{user}/meetings',
+                       'query': {'start_time': _format(day), 'end_time': _format(day + timedelta(days=7))}}
+        elif kind == 'free_interval':
+            request = {'method': 'GET', 'path': '/free_interval',
+                       'json': {'users': rng.sample(range(1, users + 1), min(3, users)), 'meeting_duration': rng.choice((30, 60))}}
+        elif kind == 'free_slots':
+            request = {'method': 'POST', 'path': '/free_slots',
+                       'json': {'users': rng.sample(range(1, users + 1), min(3, users)), 'meeting_duration': 30,
+                                'start_time': _format(day), 'end_time': _format(day + timedelta(days=7)), 'k': 5}}
+        elif kind == 'meetings_window':
+            request = {'method': 'GET', 'path': '/meetings',
+                       'query': {'start_time': _format(day), 'end_time': _format(day + timedelta(days=1)), 'limit': 100}}
+        elif kind == 'rsvp' and invitations:
+            index, invitee = rng.choice(invitations)
+            verb = rng.choice(('accept', 'decline'))
+            request = {'method': 'POST', 'path': f'/meeting/{ids[index][1]}/invite/{invitee}/{verb}'}
+        else:
+            start = day + timedelta(hours=rng.randrange(7, 19))
+            request = {'method': 'POST', 'path': '/meetings', 'json': {
+                'title': 'New meeting', 'description': 'Synthetic meeting', 'start_time': _format(start),
+                'end_time': _format(start + timedelta(minutes=30)), 'location': 'Online', 'organizer_id': user,
+                'invited_users': json.dumps(rng.sample(range(1, users + 1), min(2, users)))}}
+        requests.append(request)
+    return requests
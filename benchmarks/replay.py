@@ -0,0 +1,144 @@
+# feeds requests to the app, in process through the Flask test client or
+# over HTTP to a running server, and records how each one went
+import http.client
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps
+from urllib.parse import urlencode, urlsplit
+
+from werkzeug.exceptions import HTTPException
+
+
+class Reply:
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class StatementCounter:
+    # counts the SQL statements each thread runs, through a trace callback
+    # on every connection of the app's pool
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def install(self, pool):
+        pool.on_connect.append(lambda db: db.set_trace_callback(self._trace))
+
+    def _trace(self, statement):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def take(self):
+        count = getattr(self._local, 'count', 0)
+        self._local.count = 0
+        return count
+
+
+class TestClientTarget:
+    # the app in this process, one test client per thread; the app's pool
+    # gets a statement counter, so this has to be made before any request
+    # opens a connection
+
+    def __init__(self, app, get_pool):
+        self.app = app
+        self.statements = StatementCounter()
+        self.statements.install(get_pool())
+        self._local = threading.local()
+
+    def request(self, method, path, query=None, json=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, query_string=query, json=json)
+        return Reply(response.status_code, response.get_data())
+
+
+class HttpTarget:
+    # a running server, one keep-alive connection per thread
+
+    statements = None
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self._local = threading.local()
+
+    def request(self, method, path, query=None, json=None):
+        if query:
+            path += '?' + urlencode(query)
+        headers = {}
+        body = None
+        if json is not None:
+            body = dumps(json).encode()
+            headers['Content-Type'] = 'application/json'
+        for attempt in (0, 1):
+            connection = getattr(self._local, 'connection', None)
+            if connection is None:
+                connection = self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                return Reply(response.status, response.read())
+            except (http.client.HTTPException, ConnectionError):
+                # the server may close idle connections; retry once on a new one
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+
+
+def read_traffic(path):
+    # recorded traffic: one JSON object per line with `method`, `path` and
+    # optionally `query` (a dict) and `json` (the body)
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_traffic(path, requests):
+    with open(path, 'w') as f:
+        for request in requests:
+            f.write(json.dumps(request) + '\n')
+
+
+def endpoint_of(app, method, path):
+    # requests are reported by route, e.g. 'GET /meetings/<int:meeting_id>'
+    try:
+        rule, _ = app.url_map.bind('localhost').match(path, method, return_rule=True)
+    except HTTPException:
+        return f'{method} (unmatched)'
+    return f'{method} {rule.rule}'
+
+
+def replay(target, requests, app, concurrency=1):
+    # send the requests, `concurrency` at a time, and return one record per
+    # request plus the wall time the whole run took
+    def send(request):
+        if target.statements:
+            target.statements.take()
+        started = time.perf_counter()
+        try:
+            reply = target.request(request['method'], request['path'], request.get('query'), request.get('json'))
+            status = reply.status
+        except Exception:
+            status = None
+        elapsed = time.perf_counter() - started
+        return {
+            'endpoint': endpoint_of(app, request['method'], request['path']),
+            'status': status,
+            'seconds': elapsed,
+            'statements': target.statements.take() if target.statements else None,
+        }
+
+    started = time.perf_counter()
+    if concurrency <= 1:
+        records = [send(request) for request in requests]
+    else:
+        with ThreadPoolExecutor(concurrency) as executor:
+            records = list(executor.map(send, requests))
+    return records, time.perf_counter() - started
@@ -0,0 +1,99 @@
+# turns replay records into per-endpoint numbers and compares them with a
+# saved baseline
+import json
+import resource
+import sys
+
+# metrics where higher is worse, and the one where lower is
+COSTS = ('p50_ms', 'p95_ms', 'p99_ms', 'sql_per_request', 'peak_rss_mb')
+RATES = ('throughput',)
+
+
+def percentile(ordered, fraction):
+    # linear interpolation between the closest ranks of a sorted list
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * fraction
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def peak_rss_mb():
+    # the largest resident set this process has had so far, in MiB (Linux
+    # reports ru_maxrss in KiB, macOS in bytes); it never goes down, so a
+    # number per dataset needs a process per dataset
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def summarize(records, wall_seconds):
+    # {endpoint: numbers} for the records of one run
+    by_endpoint = {}
+    for record in records:
+        by_endpoint.setdefault(record['endpoint'], []).append(record)
+
+    endpoints = {}
+    for endpoint, group in sorted(by_endpoint.items()):
+        latencies = sorted(record['seconds'] * 1000 for record in group)
+        statements = [record['statements'] for record in group if record['statements'] is not None]
+        endpoints[endpoint] = {
+            'requests': len(group),
+            'errors': sum(1 for record in group if record['status'] is None or record['status'] >= 500),
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'throughput': round(len(group) / wall_seconds, 1),
+            'sql_per_request': round(sum(statements) / len(statements), 2) if statements else None,
+        }
+    return {
+        'requests': len(records),
+        'seconds': round(wall_seconds, 3),
+        'throughput': round(len(records) / wall_seconds, 1),
+        'endpoints': endpoints,
+    }
+
+
+def save(path, result):
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _compare_numbers(name, baseline, current, tolerance, regressions):
+    for metric in COSTS + RATES:
+        old, new = baseline.get(metric), current.get(metric)
+        if old is None or new is None:
+            continue
+        if metric in COSTS and new > old * (1 + tolerance) and new - old > 1e-9:
+            regressions.append(f'{name} {metric}: {old} -> {new}')
+        elif metric in RATES and new < old * (1 - tolerance):
+            regressions.append(f'{name} {metric}: {old} -> {new}')
+
+
+def compare(baseline, current, tolerance=0.2):
+    # the regressions of `current` against `baseline`, as readable lines:
+    # a cost up or a throughput down by more than `tolerance`, or an
+    # endpoint or scaling point that is gone
+    regressions = []
+    _compare_numbers('run', baseline, current, tolerance, regressions)
+    for endpoint, numbers in baseline.get('endpoints', {}).items():
+        if endpoint not in current.get('endpoints', {}):
+            regressions.append(f'{endpoint}: missing')
+            continue
+        _compare_numbers(endpoint, numbers, current['endpoints'][endpoint], tolerance, regressions)
+
+    for endpoint, points in baseline.get('scaling', {}).items():
+        current_points = {point['meetings']: point for point in current.get('scaling', {}).get(endpoint, [])}
+        for point in points:
+            if point['meetings'] not in current_points:
+                regressions.append(f"{endpoint} at {point['meetings']} meetings: missing")
+                continue
+            _compare_numbers(f"{endpoint} at {point['meetings']} meetings", point,
+                             current_points[point['meetings']], tolerance, regressions)
+    return regressions
@@ -0,0 +1,46 @@
+# how the endpoints whose cost grows with the data do at several sizes,
+# each measured in a process of its own: ru_maxrss is a high-water mark for
+# the whole process, so only a fresh one gives a peak RSS per size
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from app import app, get_pool, init_db
+from benchmarks import generator, replay, report
+
+# the endpoints whose cost grows with the data, measured at each size
+SCALING_MIX = (('free_interval', 1), ('user_meetings', 1))
+
+
+def fresh_target(path):
+    # the in-process app on an empty database at `path`
+    if os.path.exists(path):
+        os.remove(path)
+    app.config['DATABASE'] = path
+    target = replay.TestClientTarget(app, get_pool)
+    init_db()
+    return target
+
+
+def point(size, directory, users=None, seed=0, anchor=None, requests=200, concurrency=1):
+    # {endpoint: numbers} of the scaling mix on a fresh database of `size`
+    # meetings, with the peak RSS of the process that built and queried it
+    dataset = generator.generate(users or max(20, size // 25), size, seed, anchor)
+    target = fresh_target(os.path.join(directory, f'scaling-{size}.db'))
+    ids = generator.load(target, dataset)
+    records, wall = replay.replay(target, generator.traffic(dataset, ids, requests, seed, SCALING_MIX), app, concurrency)
+    endpoints = report.summarize(records, wall)['endpoints']
+    for numbers in endpoints.values():
+        numbers.update(meetings=size, users=len(dataset['users']), peak_rss_mb=report.peak_rss_mb())
+    return endpoints
+
+
+def measure(sizes, directory, **options):
+    # {endpoint: [numbers at each size]}, every size in a new process
+    points = {}
+    for size in sizes:
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            endpoints = executor.submit(point, size, directory, **options).result()
+        for endpoint, numbers in endpoints.items():
+            points.setdefault(endpoint, []).append(numbers)
+    return points
@@ -0,0 +1,115 @@
+# measures the list endpoints per 10k rows: the rows turned into dicts and
+# encoded by json, as the endpoints used to, against records built by a
+# row_factory that write their own JSON, with the time and the peak memory
+# allocated by each, and the endpoints themselves through the test client
+#
+#     python -m benchmarks.serialization --rows 10000
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+import models
+from app import app, meeting_dict_
+from benchmarks.bulk_import import fresh_client
+
+WINDOW = ('2022-01-01 00:00:00', '2023-12-31 23:59:59')
+
+# (name, query with the old select list, query for the records, params,
+# old row to dict, record model)
+QUERIES = (
+    ('GET /meetings', 'SELECT * FROM meetings ORDER BY start_ts, id',
+     f'SELECT {models.columns(models.Meeting)} FROM meetings ORDER BY start_ts, id', (), meeting_dict_, models.Meeting),
+    ('GET /invitations', 'SELECT * FROM invitations WHERE id > ? ORDER BY id',
+     f'SELECT {models.columns(models.Invitation)} FROM invitations WHERE id > ? ORDER BY id', (0,), dict, models.Invitation),
+    ('GET /users/<int:user_id>/meetings', 'SELECT * FROM meetings WHERE organizer_id = ? ORDER BY start_ts, id',
+     f'SELECT {models.columns(models.Meeting)} FROM meetings WHERE organizer_id = ? ORDER BY start_ts, id', (1,),
+     meeting_dict_, models.Meeting),
+)
+
+PATHS = (
+    ('/meetings', 'GET /meetings'),
+    ('/invitations', 'GET /invitations'),
+    (f'/users/1/meetings?start_time={WINDOW[0]}&end_time={WINDOW[1]}', 'GET /users/<int:user_id>/meetings'),
+)
+
+
+def make_meetings(count):
+    # every meeting organized by user 1 with user 2 invited, so each
+    # endpoint has `count` rows to send
+    meetings = []
+    for i in range(count):
+        start = 1641024000 + 1800 * i
+        meetings.append({
+            'title': f'Meeting {i}', 'description': 'Listed meeting',
+            'start_time': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start)),
+            'end_time': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start + 1500)),
+            'location': 'Office', 'organizer_id': 1, 'invited_users': '[2]',
+        })
+    return meetings
+
+
+def with_dicts(db, sql, params, to_dict):
+    db.row_factory = sqlite3.Row
+    rows = [to_dict(row) for row in db.execute(sql, params).fetchall()]
+    return json.dumps(rows, sort_keys=True, separators=(',', ':'))
+
+
+def with_records(db, sql, params, model):
+    cursor = db.cursor()
+    cursor.row_factory = models.row_factory(model)
+    return '[' + ','.join(record.json() for record in cursor.execute(sql, params)) + ']'
+
+
+def timed(function, repeat, scale):
+    # best time of `repeat` runs and the peak traced memory of one, both
+    # scaled to 10k rows
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'ms_per_10k': round(best * 1000 * scale, 2), 'peak_kib_per_10k': round(peak / 1024 * scale, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    scale = 10000 / args.rows
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        client = fresh_client(path, 2)
+        response = client.post('/meetings/bulk', json=make_meetings(args.rows))
+        assert response.status_code == 200, response.data
+
+        db = sqlite3.connect(path)
+        for name, old_sql, sql, params, to_dict, model in QUERIES:
+            results[name] = {
+                'dicts': timed(lambda: with_dicts(db, old_sql, params, to_dict), args.repeat, scale),
+                'records': timed(lambda: with_records(db, sql, params, model), args.repeat, scale),
+            }
+        db.close()
+
+        for path, name in PATHS:
+            def get():
+                response = client.get(path)
+                assert response.status_code == 200, response.data
+            results[name]['endpoint'] = timed(get, args.repeat, scale)
+    app.config['DATABASE'] = 'calendar.db'
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# measures write throughput against the number of user shards: worker
+# processes each create meetings for their own users, with invitees spread
+# over everyone, and answer the invitations they get, as fast as they can
+#
+#     python -m benchmarks.sharding --shards 1,2,4 --processes 4 --writes 500
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+import shards
+import timecodec
+
+
+def make_meeting(rng, organizer, users):
+    start = timecodec.parse('2022-01-03 08:00:00') + 30 * timecodec.MINUTE * rng.randrange(0, 365 * 24)
+    return {'title': 'Meeting', 'description': None, 'start_ts': start, 'end_ts': start + 30 * timecodec.MINUTE,
+            'location': 'Office', 'organizer_id': organizer, 'invitees': rng.sample(users, 2), 'repeat': None}
+
+
+def worker(database, count, synchronous, users, writes, seed, processes, start, results):
+    # every other write is a new meeting of one of the worker's users, the
+    # rest answer an invitation to one of them
+    rng = random.Random(seed)
+    store = shards.ShardedCalendar(database, count, synchronous=synchronous)
+    own = users[seed::processes]
+    invited = []
+    start.wait()
+    started = time.perf_counter()
+    try:
+        for i in range(writes):
+            if i % 2 == 0 or not invited:
+                organizer = rng.choice(own)
+                meeting = make_meeting(rng, organizer, [user for user in users if user != organizer])
+                meeting_id, = store.create_meetings([meeting])
+                invited += [(meeting_id, user) for user in meeting['invitees']]
+            else:
+                meeting_id, user = invited.pop(rng.randrange(len(invited)))
+                store.rsvp(meeting_id, user, rng.choice(('accepted', 'declined')))
+    finally:
+        store.close()
+    results.put(time.perf_counter() - started)
+
+
+def measure(directory, count, processes, writes, synchronous='FULL', users=200):
+    database = os.path.join(directory, f'bench-{synchronous.lower()}-{count}.db')
+    store = shards.ShardedCalendar(database, count)
+    ids = [store.create_user(f'User {i}', f'user{i}@example.com', 'password') for i in range(users)]
+    store.close()
+
+    context = multiprocessing.get_context('spawn')
+    start, results = context.Event(), context.Queue()
+    workers = [context.Process(target=worker, args=(database, count, synchronous, ids, writes, seed, processes, start, results))
+               for seed in range(processes)]
+    for process in workers:
+        process.start()
+    time.sleep(1)  # let every worker open its shards first
+    started = time.perf_counter()
+    start.set()
+    seconds = [results.get() for _ in workers]
+    wall = time.perf_counter() - started
+    for process in workers:
+        process.join()
+    total = processes * writes
+    return {'shards': count, 'synchronous': synchronous, 'writes': total, 'seconds': round(wall, 3), 'writes_per_second': round(total / wall, 1),
+            'slowest_worker_seconds': round(max(seconds), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--shards', type=lambda value: [int(count) for count in value.split(',')], default=[1, 2, 4])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--writes', type=int, default=500, help='writes per process')
+    parser.add_argument('--synchronous', default='FULL,NORMAL', help='the sync settings to measure, FULL commits wait for the disk')
+    parser.add_argument('--dir', help='where to put the databases, default: a temporary directory')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        results = [measure(directory, count, args.processes, args.writes, synchronous)
+                   for synchronous in args.synchronous.split(',') for count in args.shards]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,12 @@
 DROP TABLE IF EXISTS users;
 DROP TABLE IF EXISTS meetings;
-DROP TABLE IF EXISTS invitations;
\ No newline at end of file
+DROP TABLE IF EXISTS invitations;
+DROP TABLE IF EXISTS meeting_series;
+DROP TABLE IF EXISTS series_invitations;
+DROP TABLE IF EXISTS series_exceptions;
+DROP TABLE IF EXISTS freebusy;
+DROP TABLE IF EXISTS changes;
+DROP TABLE IF EXISTS changes_pruned;
+DROP TABLE IF EXISTS archive_partitions;
+DROP TABLE IF EXISTS archiving;
+PRAGMA user_version = 0;
\ No newline at end of file
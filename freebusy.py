@@ -0,0 +1,139 @@
+# materialized free/busy time: per user and UTC day, a bitmap with one bit
+# per minute that is set when the user organized or accepted a one-off
+# meeting overlapping that minute. availability for a group is then an OR
+# of a few blobs per day instead of a range query per user over meetings
+# and invitations. series stay rules and are expanded when they are read,
+# so they are not in here.
+#
+#     python freebusy.py calendar.db
+#
+# rebuilds the bitmaps of an existing database from its meetings
+import json
+import sqlite3
+import sys
+
+import timecodec
+
+RESOLUTION = timecodec.MINUTE
+SLOTS = timecodec.DAY // RESOLUTION
+BITMAP_BYTES = SLOTS // 8
+
+# the bitmaps of some users over a range of days
+FREEBUSY_SQL = 'SELECT day, busy FROM freebusy WHERE user_id IN ({}) AND day BETWEEN ? AND ?'
+
+# the bitmaps of some users on the days of a JSON array
+FREEBUSY_DAYS_SQL = 'SELECT user_id, day, busy FROM freebusy WHERE user_id IN ({}) AND day IN (SELECT value FROM json_each(?))'
+
+# the one-off meetings that keep each user busy
+ALL_BUSY_SQL = (
+    'SELECT organizer_id, start_ts, end_ts FROM meetings '
+    'UNION ALL '
+    'SELECT i.user_id, m.start_ts, m.end_ts FROM invitations AS i JOIN meetings AS m ON m.id = i.meeting_id '
+    "WHERE i.status = 'accepted'"
+)
+
+
+def days(start, end):
+    # the first and last day number [start, end) touches
+    return start // timecodec.DAY, (end - 1) // timecodec.DAY
+
+
+def masks(intervals):
+    # {day: bits} of [start, end) epoch intervals; a minute counts as busy
+    # when any part of it is, so busy time is rounded out to whole minutes
+    bits = {}
+    for start, end in intervals:
+        if end <= start:
+            continue
+        first_day, last_day = days(start, end)
+        for day in range(first_day, last_day + 1):
+            midnight = day * timecodec.DAY
+            low = (max(start, midnight) - midnight) // RESOLUTION
+            high = (min(end, midnight + timecodec.DAY) - midnight - 1) // RESOLUTION
+            bits[day] = bits.get(day, 0) | ((1 << (high + 1)) - (1 << low))
+    return bits
+
+
+def runs(day, bits):
+    # the busy [start, end) epoch intervals of one day's bits
+    midnight = day * timecodec.DAY
+    while bits:
+        low = (bits & -bits).bit_length() - 1
+        shifted = bits >> low
+        length = (shifted ^ (shifted + 1)).bit_length() - 1
+        yield midnight + low * RESOLUTION, midnight + (low + length) * RESOLUTION
+        bits &= ~(((1 << length) - 1) << low)
+
+
+def _encode(bits):
+    return bits.to_bytes(BITMAP_BYTES, 'little')
+
+
+def _decode(blob):
+    return int.from_bytes(blob, 'little')
+
+
+def add(db, busy):
+    # mark (user_id, start, end) as busy on top of what is stored, one
+    # range read per user
+    by_user = {}
+    for user_id, start, end in busy:
+        by_user.setdefault(user_id, []).append((start, end))
+    for user_id, intervals in by_user.items():
+        bits = masks(intervals)
+        if not bits:
+            continue
+        stored = db.execute(FREEBUSY_SQL.format('?'), (user_id, min(bits), max(bits))).fetchall()
+        for day, blob in stored:
+            if day in bits:
+                bits[day] |= _decode(blob)
+        db.executemany('INSERT OR REPLACE INTO freebusy (user_id, day, busy) VALUES (?, ?, ?)',
+                       [(user_id, day, _encode(value)) for day, value in bits.items()])
+
+
+def replace(db, user_id, first_day, last_day, intervals):
+    # store the user's days from `first_day` to `last_day` as exactly the
+    # busy time of `intervals`, e.g. after an answer changed from accepted
+    db.execute('DELETE FROM freebusy WHERE user_id = ? AND day BETWEEN ? AND ?', (user_id, first_day, last_day))
+    db.executemany('INSERT INTO freebusy (user_id, day, busy) VALUES (?, ?, ?)',
+                   [(user_id, day, _encode(value)) for day, value in masks(intervals).items()
+                    if first_day <= day <= last_day])
+
+
+def busy(db, users, start, end):
+    # the merged busy intervals of all `users` on the days [start, end)
+    # touches, from one OR per day
+    first_day, last_day = days(start, end)
+    merged = {}
+    cursor = db.execute(FREEBUSY_SQL.format(', '.join('?' * len(users))), (*users, first_day, last_day))
+    for day, blob in cursor.fetchall():
+        merged[day] = merged.get(day, 0) | _decode(blob)
+    return [interval for day in sorted(merged) for interval in runs(day, merged[day])]
+
+
+def busy_by_user(db, users, day_numbers):
+    # {user_id: busy intervals} of each of `users` on just the given days,
+    # e.g. the ones the occurrences of a new series fall on
+    intervals = {}
+    cursor = db.execute(FREEBUSY_DAYS_SQL.format(', '.join('?' * len(users))), (*users, json.dumps(sorted(day_numbers))))
+    for user_id, day, blob in cursor.fetchall():
+        intervals.setdefault(user_id, []).extend(runs(day, _decode(blob)))
+    return intervals
+
+
+def rebuild(db):
+    # recompute every bitmap from the meetings and invitations
+    busy = {}
+    for user_id, start, end in db.execute(ALL_BUSY_SQL).fetchall():
+        busy.setdefault(user_id, []).append((start, end))
+    db.execute('DELETE FROM freebusy')
+    for user_id, intervals in busy.items():
+        db.executemany('INSERT INTO freebusy (user_id, day, busy) VALUES (?, ?, ?)',
+                       [(user_id, day, _encode(value)) for day, value in masks(intervals).items()])
+
+
+if __name__ == '__main__':
+    db = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else 'calendar.db')
+    with db:
+        rebuild(db)
+    print('Rebuilt', db.execute('SELECT COUNT(*) FROM freebusy').fetchone()[0], 'user-days')
@@ -0,0 +1,120 @@
+# iCalendar (RFC 5545) text for the calendar feeds. times are written in
+# UTC, series as one VEVENT with an RRULE instead of their occurrences, and
+# the feed comes out a chunk at a time as its events are read
+import recurrence
+import timecodec
+from pagination import CHUNK_SIZE
+
+PRODID = '-//calendar-backend//Calendar feed//EN'
+
+# the rule of each repeat; an 'every weekday' series starts on its first
+# weekday, so its DTSTART is moved there to keep it in step with the rule
+RRULES = {
+    'daily': 'FREQ=DAILY',
+    'weekly': 'FREQ=WEEKLY',
+    'monthly': 'FREQ=MONTHLY',
+    'yearly': 'FREQ=YEARLY',
+    'every weekday': 'FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR',
+}
+
+# content lines are folded at 75 octets
+LINE_OCTETS = 75
+
+
+def escape(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def fold(line):
+    # a long line goes on over lines starting with a space, never cut
+    # inside a UTF-8 character
+    encoded = line.encode()
+    if len(encoded) <= LINE_OCTETS:
+        return line
+    parts = []
+    start = 0
+    limit = LINE_OCTETS
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        while end < len(encoded) and encoded[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode())
+        start = end
+        limit = LINE_OCTETS - 1
+    return '\r\n '.join(parts)
+
+
+def timestamp(seconds):
+    # a UTC DATE-TIME, 20220301T100000Z
+    text = timecodec.format(seconds)
+    return f'{text[:4]}{text[5:7]}{text[8:10]}T{text[11:13]}{text[14:16]}{text[17:19]}Z'
+
+
+def event(uid, stamp, start, end, title, description, location, extra=()):
+    # one VEVENT; `extra` holds more content lines, like its RRULE
+    lines = ['BEGIN:VEVENT', f'UID:{uid}', f'DTSTAMP:{timestamp(stamp)}', f'DTSTART:{timestamp(start)}',
+             f'DTEND:{timestamp(end)}', fold(f'SUMMARY:{escape(str(title))}')]
+    if description:
+        lines.append(fold(f'DESCRIPTION:{escape(str(description))}'))
+    if location:
+        lines.append(fold(f'LOCATION:{escape(str(location))}'))
+    lines += extra
+    lines.append('END:VEVENT')
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def rrule(series):
+    # the RRULE of a meeting_series row, None for one without occurrences.
+    # RFC 5545 takes COUNT or UNTIL but not both, so a series bounded by
+    # both ends at its last occurrence instead
+    rule = RRULES[series['repeat']]
+    count, until = series['num_of_repeats'], series['until_ts']
+    if count is not None and until is not None:
+        to_datetime = timecodec.to_datetime
+        last = recurrence.last_occurrence(to_datetime(series['start_ts']), to_datetime(series['end_ts']),
+                                          series['repeat'], count, to_datetime(until))
+        if last is None:
+            return None
+        count, until = None, timecodec.from_datetime(last[0])
+    if count is not None:
+        rule += f';COUNT={count}'
+    if until is not None:
+        rule += f';UNTIL={timestamp(until)}'
+    return rule
+
+
+def series_events(uid, stamp, series, exceptions):
+    # the VEVENTs of a meeting_series row: the rule, with its cancelled
+    # occurrences taken out by EXDATE, and one more event per moved
+    # occurrence that overrides the rule's by RECURRENCE-ID. `exceptions`
+    # holds (occurrence_ts, start_ts, end_ts) rows, start and end None for
+    # the cancelled ones
+    rule = rrule(series)
+    if rule is None:
+        return
+    start, end = series['start_ts'], series['end_ts']
+    if series['repeat'] == 'every weekday':
+        first = timecodec.from_datetime(recurrence.first_weekday(timecodec.to_datetime(start)))
+        start, end = first, first + end - start
+    extra = [f'RRULE:{rule}'] + [f'EXDATE:{timestamp(occurrence)}' for occurrence, moved, _ in exceptions if moved is None]
+    yield event(uid, stamp, start, end, series['title'], series['description'], series['location'], extra)
+    for occurrence, moved_start, moved_end in exceptions:
+        if moved_start is not None:
+            yield event(uid, stamp, moved_start, moved_end, series['title'], series['description'], series['location'],
+                        [f'RECURRENCE-ID:{timestamp(occurrence)}'])
+
+
+def calendar(events, name):
+    # the VCALENDAR of some VEVENT texts, in chunks of about CHUNK_SIZE
+    buffer = [f'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:{PRODID}\r\nCALSCALE:GREGORIAN\r\n',
+              fold(f'X-WR-CALNAME:{escape(name)}') + '\r\n']
+    size = 0
+    for text in events:
+        buffer.append(text)
+        size += len(text)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer.clear()
+            size = 0
+    buffer.append('END:VCALENDAR\r\n')
+    yield ''.join(buffer)
@@ -0,0 +1,75 @@
+from bisect import bisect_left, bisect_right
+
+
+class BusyTimeline:
+    # merged busy time of one or more users, kept as two sorted arrays
+    # of disjoint [start, end) intervals so lookups are a bisect away
+
+    def __init__(self, intervals=()):
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(intervals):
+            if end <= start:
+                continue
+            # overlapping or touching intervals collapse into one busy block
+            if self.ends and start <= self.ends[-1]:
+                if end > self.ends[-1]:
+                    self.ends[-1] = end
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    @classmethod
+    def merge(cls, timelines):
+        intervals = []
+        for timeline in timelines:
+            intervals.extend(zip(timeline.starts, timeline.ends))
+        return cls(intervals)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return zip(self.starts, self.ends)
+
+    def overlaps(self, start, end):
+        # whether any busy time falls inside [start, end)
+        i = bisect_right(self.ends, start)
+        return i < len(self.starts) and self.starts[i] < end
+
+    def next_free(self, moment):
+        # the first moment at or after `moment` that is not busy
+        i = bisect_right(self.starts, moment) - 1
+        if i >= 0 and self.ends[i] > moment:
+            return self.ends[i]
+        return moment
+
+    def first_gap(self, after, duration, until):
+        # the start of the first free gap of at least `duration` that begins
+        # at or after `after` and fits before `until`, or None
+        moment = self.next_free(after)
+        i = bisect_right(self.starts, moment)
+        while moment < until:
+            gap_end = min(self.starts[i], until) if i < len(self.starts) else until
+            if gap_end - moment >= duration:
+                return moment
+            if i >= len(self.starts):
+                break
+            moment = self.ends[i]
+            i += 1
+        return None
+
+    def resume_point(self, after, until):
+        # where a search that ran out at `until` has to pick up again: the
+        # start of the free run reaching `until`, or the end of the busy
+        # block that spans it
+        i = bisect_left(self.starts, until) - 1
+        if i >= 0 and self.ends[i] > after:
+            return self.ends[i]
+        return after
+
+
+def first_gaps(timeline, searches):
+    # the first_gap of each (after, duration, until) search on one timeline,
+    # a module function so a process pool can run it
+    return [timeline.first_gap(after, duration, until) for after, duration, until in searches]
@@ -0,0 +1,228 @@
+import bisect
+import cProfile
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger('calendar.sql')
+
+# histogram buckets: request latency and SQL time in seconds, and the
+# number of statements a request runs
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+# (type, help) of everything the registry can hold
+METRICS = {
+    'calendar_requests_total': ('counter', 'Requests answered, by route and status'),
+    'calendar_request_seconds': ('histogram', 'Time to build the response, by route'),
+    'calendar_request_sql_seconds': ('histogram', 'Time spent in SQL per request, by route'),
+    'calendar_request_sql_statements': ('histogram', 'SQL statements run per request, by route'),
+    'calendar_sql_statements_total': ('counter', 'SQL statements run, by their first keyword'),
+    'calendar_sql_seconds': ('histogram', 'Time per SQL statement'),
+    'calendar_sql_slow_statements_total': ('counter', 'SQL statements slower than the slow statement threshold'),
+    'calendar_write_batch_size': ('histogram', 'Writes committed together by the write queue'),
+}
+
+# parameter lists and literals are left out, so one statement shape is
+# logged the same whatever it was run with
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACE = re.compile(r'\s+')
+
+
+def normalize(sql):
+    sql = _SPACE.sub(' ', sql).strip()
+    sql = _LITERAL.sub('?', sql)
+    return _IN_LIST.sub('(?, ...)', sql)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    # counters and histograms for one process, rendered in the Prometheus
+    # text format
+
+    def __init__(self, slow_statement_seconds=0.1):
+        self.slow_statement_seconds = slow_statement_seconds
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def count(self, name, labels=(), amount=1):
+        key = (name, tuple(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, buckets, labels=()):
+        key = (name, tuple(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def render(self, gauges=()):
+        # `gauges` adds (name, type, help, value) of numbers kept elsewhere,
+        # like the connection pool's counters
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+        seen = set()
+
+        def header(name, kind, text):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f'# HELP {name} {text}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in counters:
+            header(name, *METRICS[name])
+            lines.append(f'{name}{_labels(labels)} {_number(value)}')
+        for (name, labels), histogram in histograms:
+            header(name, *METRICS[name])
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels + (("le", _number(bound)),))} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(histogram.sum)}')
+            lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+        for name, kind, text, value in gauges:
+            header(name, kind, text)
+            lines.append(f'{name} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def stats_gauges(prefix, stats, counters=()):
+    # (name, type, help, value) for a stats() dict, e.g. the pool's; keys
+    # in `counters` only ever grow
+    gauges = []
+    for key, value in sorted(stats.items()):
+        if key in counters:
+            gauges.append((f'{prefix}_{key}_total', 'counter', key.replace('_', ' ').capitalize(), value))
+        else:
+            gauges.append((f'{prefix}_{key}', 'gauge', key.replace('_', ' ').capitalize(), value))
+    return gauges
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# the SQL a request has run so far, for the thread serving it
+_request = threading.local()
+
+
+def begin_request():
+    _request.statements = 0
+    _request.seconds = 0.0
+
+
+def end_request():
+    # (statements, seconds) of SQL since begin_request
+    statements, seconds = getattr(_request, 'statements', 0), getattr(_request, 'seconds', 0.0)
+    _request.statements = 0
+    _request.seconds = 0.0
+    return statements, seconds
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    # times every statement and reports it to the connection
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection.record(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            self.connection.record(sql, time.perf_counter() - started)
+
+    def executescript(self, script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            self.connection.record(script, time.perf_counter() - started)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    # a connection whose statements are counted and timed, per request and
+    # in `registry` once it is set; the connection's own execute* helpers
+    # don't go through cursor(), so they are routed there by hand
+
+    registry = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+    def record(self, sql, seconds):
+        _request.statements = getattr(_request, 'statements', 0) + 1
+        _request.seconds = getattr(_request, 'seconds', 0.0) + seconds
+        registry = self.registry
+        if registry is None:
+            return
+        keyword = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+        registry.count('calendar_sql_statements_total', (('statement', keyword),))
+        registry.observe('calendar_sql_seconds', seconds, SQL_BUCKETS)
+        if seconds >= registry.slow_statement_seconds:
+            registry.count('calendar_sql_slow_statements_total')
+            logger.warning('Slow SQL (%.1f ms): %s', seconds * 1000, normalize(sql))
+
+
+def start_profile():
+    profile = cProfile.Profile()
+    profile.enable()
+    return profile
+
+
+def finish_profile(profile, directory, name):
+    # stop the profiler and write its stats where `pstats` or snakeviz can
+    # read them; returns the file's path
+    profile.disable()
+    os.makedirs(directory, exist_ok=True)
+    safe = re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_') or 'request'
+    path = os.path.join(directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{threading.get_ident()}-{safe}.prof')
+    profile.dump_stats(path)
+    return path
@@ -0,0 +1,447 @@
+import os
+import sqlite3
+
+import archive
+import freebusy
+import timecodec
+
+
+# SQLite can't change a column's type in place: each table is copied into a
+# new one with the times converted, the old one dropped and the copy renamed
+EPOCH_TIMES = '''
+CREATE TABLE meetings_new (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT,
+    start_ts INTEGER NOT NULL,
+    end_ts INTEGER NOT NULL,
+    location TEXT NOT NULL,
+    organizer_id INTEGER NOT NULL,
+    invited_users TEXT NOT NULL,
+    FOREIGN KEY (organizer_id) REFERENCES users(id)
+);
+INSERT INTO meetings_new
+SELECT id, title, description, epoch(start_time), epoch(end_time), location, organizer_id, invited_users FROM meetings;
+DROP TABLE meetings;
+ALTER TABLE meetings_new RENAME TO meetings;
+
+CREATE TABLE meeting_series_new (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT,
+    start_ts INTEGER NOT NULL,
+    end_ts INTEGER NOT NULL,
+    location TEXT NOT NULL,
+    organizer_id INTEGER NOT NULL,
+    invited_users TEXT NOT NULL,
+    repeat TEXT NOT NULL,
+    num_of_repeats INTEGER,
+    until_ts INTEGER,
+    span_start_ts INTEGER NOT NULL,
+    span_end_ts INTEGER NOT NULL,
+    FOREIGN KEY (organizer_id) REFERENCES users(id)
+);
+INSERT INTO meeting_series_new
+SELECT id, title, description, epoch(start_time), epoch(end_time), location, organizer_id, invited_users,
+       repeat, num_of_repeats, epoch(until), epoch(span_start), epoch(span_end) FROM meeting_series;
+DROP TABLE meeting_series;
+ALTER TABLE meeting_series_new RENAME TO meeting_series;
+
+CREATE TABLE series_exceptions_new (
+    id INTEGER PRIMARY KEY,
+    series_id INTEGER NOT NULL,
+    occurrence_ts INTEGER NOT NULL,
+    start_ts INTEGER,
+    end_ts INTEGER,
+    UNIQUE (series_id, occurrence_ts),
+    FOREIGN KEY (series_id) REFERENCES meeting_series(id)
+);
+INSERT INTO series_exceptions_new
+SELECT id, series_id, epoch(occurrence_start), epoch(start_time), epoch(end_time) FROM series_exceptions;
+DROP TABLE series_exceptions;
+ALTER TABLE series_exceptions_new RENAME TO series_exceptions;
+
+CREATE INDEX idx_meetings_organizer_start ON meetings (organizer_id, start_ts, end_ts);
+CREATE INDEX idx_meetings_start_end ON meetings (start_ts, end_ts);
+CREATE INDEX idx_series_organizer_span ON meeting_series (organizer_id, span_start_ts, span_end_ts);
+CREATE INDEX idx_series_span ON meeting_series (span_start_ts, span_end_ts);
+'''
+
+
+def epoch_times(db):
+    # the text times are converted by the same codec the API parses with,
+    # so rows written in any of the formats it accepted come out alike;
+    # legacy rows were never range checked, so their clock fields clamp
+    db.create_function('epoch', 1, lambda value: timecodec.parse_or_none(value, clamp=True), deterministic=True)
+    for statement in split_script(EPOCH_TIMES):
+        db.execute(statement)
+
+
+def freebusy_bitmaps(db):
+    # the table is filled from the meetings already there
+    db.execute('''
+    CREATE TABLE freebusy (
+        user_id INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        busy BLOB NOT NULL,
+        PRIMARY KEY (user_id, day),
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    ) WITHOUT ROWID
+    ''')
+    freebusy.rebuild(db)
+
+
+def archived_invitation_ids(db):
+    # the months archived already learn their highest invitation id from
+    # their files, so new invitations are numbered past them
+    db.execute('ALTER TABLE archive_partitions ADD COLUMN max_invitation_id INTEGER NOT NULL DEFAULT 0')
+    database = archive.database_file(db)
+    for partition in archive.partitions(db):
+        file = archive.path(database, partition.month)
+        if not os.path.exists(file):
+            continue
+        archived = sqlite3.connect(file)
+        try:
+            max_invitation_id, = archived.execute('SELECT COALESCE(MAX(id), 0) FROM invitations').fetchone()
+        finally:
+            archived.close()
+        db.execute('UPDATE archive_partitions SET max_invitation_id = ? WHERE month = ?',
+                   (max_invitation_id, partition.month))
+
+
+# schema changes for databases created before schema.sql had them.
+# a fresh database is built straight from schema.sql and stamped with the
+# latest version; an existing one runs every migration past the version
+# kept in PRAGMA user_version. each entry is a SQL script or a function
+# taking the connection, and entry n (counting from 1) brings the schema
+# to version n. schema.sql has to match the result of running them all.
+MIGRATIONS = [
+    # 1: indexes for user meetings, meeting details and RSVP lookups
+    '''
+    CREATE INDEX IF NOT EXISTS idx_invitations_user_status ON invitations (user_id, status, meeting_id);
+    CREATE INDEX IF NOT EXISTS idx_invitations_meeting ON invitations (meeting_id, user_id, status);
+    CREATE INDEX IF NOT EXISTS idx_meetings_organizer_start ON meetings (organizer_id, start_time, end_time);
+    CREATE INDEX IF NOT EXISTS idx_meetings_start_end ON meetings (start_time, end_time);
+    ''',
+    # 2: recurring meetings stored as a rule, expanded when they are read
+    '''
+    CREATE TABLE IF NOT EXISTS meeting_series (
+        id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL,
+        description TEXT,
+        start_time TEXT NOT NULL,
+        end_time TEXT NOT NULL,
+        location TEXT NOT NULL,
+        organizer_id INTEGER NOT NULL,
+        invited_users TEXT NOT NULL,
+        repeat TEXT NOT NULL,
+        num_of_repeats INTEGER,
+        until TEXT,
+        span_start TEXT NOT NULL,
+        span_end TEXT NOT NULL,
+        FOREIGN KEY (organizer_id) REFERENCES users(id)
+    );
+
+    CREATE TABLE IF NOT EXISTS series_invitations (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        series_id INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (series_id) REFERENCES meeting_series(id)
+    );
+
+    CREATE TABLE IF NOT EXISTS series_exceptions (
+        id INTEGER PRIMARY KEY,
+        series_id INTEGER NOT NULL,
+        occurrence_start TEXT NOT NULL,
+        start_time TEXT,
+        end_time TEXT,
+        UNIQUE (series_id, occurrence_start),
+        FOREIGN KEY (series_id) REFERENCES meeting_series(id)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_series_organizer_span ON meeting_series (organizer_id, span_start, span_end);
+    CREATE INDEX IF NOT EXISTS idx_series_span ON meeting_series (span_start, span_end);
+    CREATE INDEX IF NOT EXISTS idx_series_invitations_user_status ON series_invitations (user_id, status, series_id);
+    CREATE INDEX IF NOT EXISTS idx_series_invitations_series ON series_invitations (series_id, user_id, status);
+    ''',
+    # 3: per-user timezone and working hours for the free slot search
+    '''
+    ALTER TABLE users ADD COLUMN timezone TEXT;
+    ALTER TABLE users ADD COLUMN work_start TEXT;
+    ALTER TABLE users ADD COLUMN work_end TEXT;
+    ALTER TABLE users ADD COLUMN work_days TEXT;
+    ''',
+    # 4: times stored as integer UTC epoch seconds instead of text
+    epoch_times,
+    # 5: a version per meeting, bumped on every change, for cached details and ETags
+    '''
+    ALTER TABLE meetings ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+    ''',
+    # 6: per-user, per-day busy bitmaps for availability searches
+    freebusy_bitmaps,
+    # 7: a change log kept by triggers, for incremental sync
+    '''
+    CREATE TABLE IF NOT EXISTS changes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        item_id INTEGER NOT NULL,
+        deleted INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (kind, item_id)
+    );
+
+    CREATE TRIGGER IF NOT EXISTS meetings_inserted AFTER INSERT ON meetings BEGIN
+        INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('meeting', NEW.id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS meetings_updated AFTER UPDATE ON meetings BEGIN
+        INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('meeting', NEW.id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS meetings_deleted AFTER DELETE ON meetings BEGIN
+        INSERT OR REPLACE INTO changes (kind, item_id, deleted) VALUES ('meeting', OLD.id, 1);
+    END;
+    CREATE TRIGGER IF NOT EXISTS invitations_inserted AFTER INSERT ON invitations BEGIN
+        INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('invitation', NEW.id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS invitations_updated AFTER UPDATE ON invitations BEGIN
+        INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('invitation', NEW.id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS invitations_deleted AFTER DELETE ON invitations BEGIN
+        INSERT OR REPLACE INTO changes (kind, item_id, deleted) VALUES ('invitation', OLD.id, 1);
+    END;
+    CREATE TRIGGER IF NOT EXISTS meeting_series_inserted AFTER INSERT ON meeting_series BEGIN
+        INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('series', NEW.id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS meeting_series_updated AFTER UPDATE ON meeting_series BEGIN
+        INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('series', NEW.id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS meeting_series_deleted AFTER DELETE ON meeting_series BEGIN
+        INSERT OR REPLACE INTO changes (kind, item_id, deleted) VALUES ('series', OLD.id, 1);
+    END;
+    CREATE TRIGGER IF NOT EXISTS series_invitations_inserted AFTER INSERT ON series_invitations BEGIN
+        INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('series_invitation', NEW.id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS series_invitations_updated AFTER UPDATE ON series_invitations BEGIN
+        INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('series_invitation', NEW.id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS series_invitations_deleted AFTER DELETE ON series_invitations BEGIN
+        INSERT OR REPLACE INTO changes (kind, item_id, deleted) VALUES ('series_invitation', OLD.id, 1);
+    END;
+    -- moving or cancelling an occurrence changes its series
+    CREATE TRIGGER IF NOT EXISTS series_exceptions_inserted AFTER INSERT ON series_exceptions BEGIN
+        INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('series', NEW.series_id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS series_exceptions_deleted AFTER DELETE ON series_exceptions BEGIN
+        INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('series', OLD.series_id);
+    END;
+
+    -- what is already there counts as changed once
+    INSERT INTO changes (kind, item_id) SELECT 'meeting', id FROM meetings;
+    INSERT INTO changes (kind, item_id) SELECT 'invitation', id FROM invitations;
+    INSERT INTO changes (kind, item_id) SELECT 'series', id FROM meeting_series;
+    INSERT INTO changes (kind, item_id) SELECT 'series_invitation', id FROM series_invitations;
+    ''',
+    # 8: who is invited is kept only as invitations; users named in the old
+    # invited_users text without an invitation row get a pending one first
+    '''
+    INSERT INTO invitations (user_id, meeting_id, status)
+    SELECT DISTINCT invited.value, m.id, 'pending' FROM meetings AS m,
+        json_each(CASE WHEN json_valid(m.invited_users) AND json_type(m.invited_users) = 'array' THEN m.invited_users ELSE '[]' END) AS invited
+    WHERE NOT EXISTS (SELECT 1 FROM invitations AS i WHERE i.meeting_id = m.id AND i.user_id = invited.value);
+    INSERT INTO series_invitations (user_id, series_id, status)
+    SELECT DISTINCT invited.value, s.id, 'pending' FROM meeting_series AS s,
+        json_each(CASE WHEN json_valid(s.invited_users) AND json_type(s.invited_users) = 'array' THEN s.invited_users ELSE '[]' END) AS invited
+    WHERE NOT EXISTS (SELECT 1 FROM series_invitations AS si WHERE si.series_id = s.id AND si.user_id = invited.value);
+    ALTER TABLE meetings DROP COLUMN invited_users;
+    ALTER TABLE meeting_series DROP COLUMN invited_users;
+    ''',
+    # 9: the months of meetings moved to archive files
+    '''
+    CREATE TABLE IF NOT EXISTS archive_partitions (
+        month TEXT PRIMARY KEY,
+        meetings INTEGER NOT NULL,
+        first_start_ts INTEGER NOT NULL,
+        last_end_ts INTEGER NOT NULL,
+        min_id INTEGER NOT NULL,
+        max_id INTEGER NOT NULL
+    );
+    ''',
+    # 10: a per-user counter of calendar feed changes, for conditional GETs
+    # of the .ics feeds; every feed counts as changed at the upgrade
+    '''
+    ALTER TABLE users ADD COLUMN feed_version INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE users ADD COLUMN feed_changed_ts INTEGER;
+    UPDATE users SET feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER);
+    -- every change to what a user's calendar feed shows (meetings and series
+    -- they organize or accepted) moves their feed_version on, so polls of an
+    -- unchanged feed are answered from the users row alone
+    CREATE TRIGGER IF NOT EXISTS feed_meetings_inserted AFTER INSERT ON meetings BEGIN
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id = NEW.organizer_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS feed_meetings_updated
+    AFTER UPDATE OF title, description, start_ts, end_ts, location, organizer_id ON meetings BEGIN
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id IN (OLD.organizer_id, NEW.organizer_id);
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id IN (SELECT user_id FROM invitations WHERE meeting_id = NEW.id AND status = 'accepted');
+    END;
+    CREATE TRIGGER IF NOT EXISTS feed_meetings_deleted AFTER DELETE ON meetings BEGIN
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id = OLD.organizer_id;
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id IN (SELECT user_id FROM invitations WHERE meeting_id = OLD.id AND status = 'accepted');
+    END;
+    CREATE TRIGGER IF NOT EXISTS feed_invitations_inserted AFTER INSERT ON invitations WHEN NEW.status = 'accepted' BEGIN
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id = NEW.user_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS feed_invitations_updated AFTER UPDATE ON invitations
+    WHEN 'accepted' IN (OLD.status, NEW.status) BEGIN
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id IN (OLD.user_id, NEW.user_id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS feed_invitations_deleted AFTER DELETE ON invitations WHEN OLD.status = 'accepted' BEGIN
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id = OLD.user_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS feed_meeting_series_inserted AFTER INSERT ON meeting_series BEGIN
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id = NEW.organizer_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS feed_meeting_series_updated
+    AFTER UPDATE OF title, description, start_ts, end_ts, location, organizer_id, repeat, num_of_repeats, until_ts ON meeting_series BEGIN
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id IN (OLD.organizer_id, NEW.organizer_id);
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id IN (SELECT user_id FROM series_invitations WHERE series_id = NEW.id AND status = 'accepted');
+    END;
+    CREATE TRIGGER IF NOT EXISTS feed_meeting_series_deleted AFTER DELETE ON meeting_series BEGIN
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id = OLD.organizer_id;
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id IN (SELECT user_id FROM series_invitations WHERE series_id = OLD.id AND status = 'accepted');
+    END;
+    CREATE TRIGGER IF NOT EXISTS feed_series_invitations_inserted AFTER INSERT ON series_invitations WHEN NEW.status = 'accepted' BEGIN
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id = NEW.user_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS feed_series_invitations_updated AFTER UPDATE ON series_invitations
+    WHEN 'accepted' IN (OLD.status, NEW.status) BEGIN
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id IN (OLD.user_id, NEW.user_id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS feed_series_invitations_deleted AFTER DELETE ON series_invitations WHEN OLD.status = 'accepted' BEGIN
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id = OLD.user_id;
+    END;
+    -- moving or cancelling an occurrence changes the feeds of everyone in the series
+    CREATE TRIGGER IF NOT EXISTS feed_series_exceptions_inserted AFTER INSERT ON series_exceptions BEGIN
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id IN (SELECT organizer_id FROM meeting_series WHERE id = NEW.series_id)
+           OR id IN (SELECT user_id FROM series_invitations WHERE series_id = NEW.series_id AND status = 'accepted');
+    END;
+    CREATE TRIGGER IF NOT EXISTS feed_series_exceptions_deleted AFTER DELETE ON series_exceptions BEGIN
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id IN (SELECT organizer_id FROM meeting_series WHERE id = OLD.series_id)
+           OR id IN (SELECT user_id FROM series_invitations WHERE series_id = OLD.series_id AND status = 'accepted');
+    END;
+    ''',
+    # 11: when each change was logged, and how far deletions were pruned
+    # from the log, so sync tokens can expire
+    '''
+    ALTER TABLE changes ADD COLUMN changed_ts INTEGER;
+    UPDATE changes SET changed_ts = CAST(strftime('%s', 'now') AS INTEGER);
+    CREATE TRIGGER IF NOT EXISTS changes_stamped AFTER INSERT ON changes BEGIN
+        UPDATE changes SET changed_ts = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = NEW.id;
+    END;
+    CREATE TABLE IF NOT EXISTS changes_pruned (
+        position INTEGER NOT NULL,
+        pruned_ts INTEGER NOT NULL
+    );
+    INSERT INTO changes_pruned (position, pruned_ts) VALUES (0, CAST(strftime('%s', 'now') AS INTEGER));
+    ''',
+    # 12: the highest invitation id of each archived month
+    archived_invitation_ids,
+    # 13: moving meetings into the archive is no deletion: while a move
+    # has a row in `archiving` the delete triggers leave the change log and
+    # the feed versions alone
+    '''
+    CREATE TABLE IF NOT EXISTS archiving (
+        month TEXT NOT NULL
+    );
+    DROP TRIGGER IF EXISTS meetings_deleted;
+    CREATE TRIGGER meetings_deleted AFTER DELETE ON meetings
+    WHEN NOT EXISTS (SELECT 1 FROM archiving) BEGIN
+        INSERT OR REPLACE INTO changes (kind, item_id, deleted) VALUES ('meeting', OLD.id, 1);
+    END;
+    DROP TRIGGER IF EXISTS invitations_deleted;
+    CREATE TRIGGER invitations_deleted AFTER DELETE ON invitations
+    WHEN NOT EXISTS (SELECT 1 FROM archiving) BEGIN
+        INSERT OR REPLACE INTO changes (kind, item_id, deleted) VALUES ('invitation', OLD.id, 1);
+    END;
+    DROP TRIGGER IF EXISTS feed_meetings_deleted;
+    CREATE TRIGGER feed_meetings_deleted AFTER DELETE ON meetings
+    WHEN NOT EXISTS (SELECT 1 FROM archiving) BEGIN
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id = OLD.organizer_id;
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id IN (SELECT user_id FROM invitations WHERE meeting_id = OLD.id AND status = 'accepted');
+    END;
+    DROP TRIGGER IF EXISTS feed_invitations_deleted;
+    CREATE TRIGGER feed_invitations_deleted AFTER DELETE ON invitations
+    WHEN OLD.status = 'accepted' AND NOT EXISTS (SELECT 1 FROM archiving) BEGIN
+        UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id = OLD.user_id;
+    END;
+    ''',
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def get_version(db):
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def is_empty(db):
+    return db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'").fetchone() is None
+
+
+def stamp(db, version=LATEST_VERSION):
+    db.execute(f'PRAGMA user_version = {int(version)}')
+
+
+def migrate(db):
+    # apply the pending migrations one transaction each, so a failure
+    # leaves the database at the last version that went through
+    version = get_version(db)
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        db.commit()
+        db.execute('BEGIN')
+        try:
+            if callable(migration):
+                migration(db)
+            else:
+                for statement in split_script(migration):
+                    db.execute(statement)
+            stamp(db, number)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    return get_version(db)
+
+
+def split_script(script):
+    # executescript() would commit on its own, so run the statements one by one
+    statements = []
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            statements.append(statement.strip())
+            statement = ''
+    if statement.strip():
+        statements.append(statement.strip())
+    return statements
@@ -0,0 +1,103 @@
+# compact rows for the list endpoints. a row_factory turns each row tuple
+# from SQLite straight into one of these tuple-backed records, without a
+# sqlite3.Row or a dict in between, and every record writes its own JSON
+# from fragments laid out once, keys in the sorted order jsonify uses
+import json
+from collections import namedtuple
+from json.encoder import encode_basestring_ascii
+
+from flask.json.provider import DefaultJSONProvider
+
+import timecodec
+
+# orjson encodes whatever the records don't when it is installed, and the
+# standard library does otherwise
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _text(value):
+    # a TEXT column as JSON; SQLite hands back whatever was stored, which
+    # is almost always a string
+    if type(value) is str:
+        return encode_basestring_ascii(value)
+    return json.dumps(value)
+
+
+def _integer(value):
+    if type(value) is int:
+        return str(value)
+    return _text(value)
+
+
+class Meeting(namedtuple('Meeting', 'id title description start_ts end_ts location organizer_id')):
+    __slots__ = ()
+
+    def json(self):
+        return (f'{{"description":{_text(self.description)},"end_time":"{timecodec.format(self.end_ts)}",'
+                f'"id":{self.id},"location":{_text(self.location)},'
+                f'"organizer_id":{_integer(self.organizer_id)},"start_time":"{timecodec.format(self.start_ts)}",'
+                f'"title":{_text(self.title)}}}')
+
+
+class Attendee(namedtuple('Attendee', 'user_id name email status')):
+    # an invited user with their answer; name and email are None for ids
+    # that aren't users
+    __slots__ = ()
+
+    def json(self):
+        return (f'{{"email":{_text(self.email)},"name":{_text(self.name)},"status":{_text(self.status)},'
+                f'"user_id":{_integer(self.user_id)}}}')
+
+
+class Attending(namedtuple('Attending', 'meeting attendees')):
+    # a meeting listed with its attendees, which sort first
+    __slots__ = ()
+
+    def json(self):
+        return '{"attendees":[' + ','.join(attendee.json() for attendee in self.attendees) + '],' + self.meeting.json()[1:]
+
+
+class User(namedtuple('User', 'id name email')):
+    __slots__ = ()
+
+    def json(self):
+        return f'{{"email":{_text(self.email)},"name":{_text(self.name)}}}'
+
+
+class Invitation(namedtuple('Invitation', 'id user_id meeting_id status')):
+    __slots__ = ()
+
+    def json(self):
+        return (f'{{"id":{self.id},"meeting_id":{_integer(self.meeting_id)},"status":{_text(self.status)},'
+                f'"user_id":{_integer(self.user_id)}}}')
+
+
+MODELS = (Meeting, User, Invitation, Attendee, Attending)
+
+
+def columns(model, alias=None):
+    # the select list a model's row_factory expects, in field order
+    return ', '.join(f'{alias}.{name}' if alias else name for name in model._fields)
+
+
+def row_factory(model):
+    # for cursor.row_factory: rows become `model` records as they are read
+    new = tuple.__new__
+    return lambda cursor, row: new(model, row)
+
+
+class JSONProvider(DefaultJSONProvider):
+    # Flask's provider, with the encoding done by orjson when it is
+    # installed and the call asks for nothing it can't do (indented output
+    # in debug mode, a custom encoder class, numbers past 64 bits)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs.get('indent') or kwargs.get('cls'):
+            return super().dumps(obj, **kwargs)
+        try:
+            return orjson.dumps(obj, default=self.default, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            return super().dumps(obj, **kwargs)
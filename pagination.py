@@ -0,0 +1,95 @@
+import base64
+import binascii
+import json
+from itertools import islice
+
+# list endpoints hand out at most this many items per page
+MAX_PAGE_SIZE = 1000
+
+# rows fetched from the cursor at a time while streaming
+FETCH_SIZE = 500
+
+# streamed output is written in chunks of about this many bytes
+CHUNK_SIZE = 64 * 1024
+
+STREAM_FORMATS = {'json': 'application/json', 'ndjson': 'application/x-ndjson'}
+
+
+def encode_cursor(key):
+    # cursors are opaque to clients: the sort key of the last item sent
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, binascii.Error):
+        raise ValueError('Invalid cursor')
+    # every key this service hands out is a list of integers
+    if not isinstance(key, list) or not key or any(type(part) is not int for part in key):
+        raise ValueError('Invalid cursor')
+    return key
+
+
+def parse_args(args):
+    # the limit, `after` key and stream format of a list request
+    limit = args.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+
+    after = args.get('after')
+    if after is not None:
+        after = decode_cursor(after)
+
+    stream = args.get('stream')
+    if stream is not None and stream not in STREAM_FORMATS:
+        raise ValueError('stream must be one of ' + ', '.join(STREAM_FORMATS))
+
+    return limit, after, stream
+
+
+def fetch_rows(cursor, size=FETCH_SIZE):
+    # iterate an executed cursor a batch at a time
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield from rows
+
+
+def take_page(items, limit):
+    # the first `limit` (key, item) pairs and the cursor of the next page
+    page = list(islice(items, limit + 1))
+    if len(page) <= limit:
+        return page, None
+    del page[limit:]
+    return page, encode_cursor(page[-1][0])
+
+
+def encode_stream(items, stream, dumps):
+    # write the items as a JSON array or as NDJSON, a chunk at a time
+    if stream == 'json':
+        yield '['
+    buffer = []
+    size = 0
+    for index, (_, item) in enumerate(items):
+        encoded = dumps(item)
+        if stream == 'ndjson':
+            encoded += '\n'
+        elif index:
+            encoded = ',' + encoded
+        buffer.append(encoded)
+        size += len(encoded)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer.clear()
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+    if stream == 'json':
+        yield ']'
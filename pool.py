@@ -0,0 +1,151 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+# pragmas every pooled connection is opened with. WAL lets readers carry on
+# while the writer commits, and NORMAL sync is safe under WAL (a power loss
+# can only drop the last commits, never corrupt the file)
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -64 * 1024),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('temp_store', 'MEMORY'),
+)
+
+# prepared statements kept per connection
+CACHED_STATEMENTS = 512
+
+
+class ConnectionPool:
+    # long-lived connections to one database file for one process: a
+    # bounded set of read-only connections and a single writer, handed to
+    # one user at a time
+
+    def __init__(self, path, size=8, timeout=5.0, factory=sqlite3.Connection, synchronous='NORMAL'):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.factory = factory
+        # FULL syncs the WAL at every commit, for when the last commits
+        # must survive a power loss as well
+        self.synchronous = synchronous
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'connections_opened': 0,
+            'reader_acquisitions': 0,
+            'reader_reuses': 0,
+            'reader_waits': 0,
+            'writer_acquisitions': 0,
+            'writer_waits': 0,
+            'wait_seconds': 0.0,
+            'timeouts': 0,
+        }
+        self._readers_in_use = 0
+        self._writer_in_use = False
+        # called with every new connection once its pragmas are set, e.g.
+        # to install a trace callback
+        self.on_connect = []
+
+    def _count(self, **changes):
+        with self._stats_lock:
+            for name, change in changes.items():
+                self._stats[name] += change
+
+    def _connect(self, readonly):
+        db = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                             cached_statements=CACHED_STATEMENTS, factory=self.factory)
+        db.row_factory = sqlite3.Row
+        for name, value in PRAGMAS:
+            db.execute(f'PRAGMA {name} = {self.synchronous if name == "synchronous" else value}')
+        db.execute(f'PRAGMA busy_timeout = {int(self.timeout * 1000)}')
+        if readonly:
+            db.execute('PRAGMA query_only = 1')
+        for callback in self.on_connect:
+            callback(db)
+        self._count(connections_opened=1)
+        return db
+
+    def _wait(self, acquire, kind):
+        # take a slot, counting how often and how long callers had to wait
+        if acquire(blocking=False):
+            return
+        started = time.perf_counter()
+        acquired = acquire(timeout=self.timeout)
+        self._count(**{f'{kind}_waits': 1, 'wait_seconds': time.perf_counter() - started})
+        if not acquired:
+            self._count(timeouts=1)
+            raise TimeoutError(f'No {kind} database connection free after {self.timeout} seconds')
+
+    def acquire_reader(self):
+        self._wait(self._slots.acquire, 'reader')
+        try:
+            db = self._idle.get_nowait()
+            self._count(reader_reuses=1)
+        except queue.Empty:
+            try:
+                db = self._connect(readonly=True)
+            except Exception:
+                self._slots.release()
+                raise
+        with self._stats_lock:
+            self._stats['reader_acquisitions'] += 1
+            self._readers_in_use += 1
+        return db
+
+    def acquire_writer(self):
+        self._wait(self._writer_lock.acquire, 'writer')
+        try:
+            if self._writer is None:
+                self._writer = self._connect(readonly=False)
+        except Exception:
+            self._writer_lock.release()
+            raise
+        with self._stats_lock:
+            self._stats['writer_acquisitions'] += 1
+            self._writer_in_use = True
+        return self._writer
+
+    def release(self, db):
+        # whatever the user left uncommitted is rolled back
+        if db.in_transaction:
+            db.rollback()
+        if db is self._writer:
+            with self._stats_lock:
+                self._writer_in_use = False
+            self._writer_lock.release()
+            return
+        with self._stats_lock:
+            self._readers_in_use -= 1
+        self._idle.put(db)
+        self._slots.release()
+
+    def close(self):
+        # close the idle connections; ones in use are closed by their owner
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        if self._writer is not None and self._writer_lock.acquire(blocking=False):
+            self._writer.close()
+            self._writer = None
+            self._writer_lock.release()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats.update({
+                'size': self.size,
+                'readers_in_use': self._readers_in_use,
+                'readers_idle': self._idle.qsize(),
+                'writer_in_use': self._writer_in_use,
+            })
+        return stats
@@ -0,0 +1,124 @@
+import heapq
+from datetime import MAXYEAR, datetime, timedelta
+from itertools import count as counter
+
+REPEATS = ('daily', 'weekly', 'monthly', 'yearly', 'every weekday')
+
+# rules whose n-th occurrence can be computed directly
+FIXED_STEPS = {'daily': timedelta(days=1), 'weekly': timedelta(weeks=1)}
+
+
+def first_weekday(start):
+    # an 'every weekday' series starts on the first weekday on or after its start
+    return start + timedelta(days=7 - start.weekday() if start.weekday() >= 5 else 0)
+
+
+def first_index(start, repeat, moment):
+    # the index of an occurrence starting at or before `moment`, as close to
+    # it as can be computed without walking the rule; 0 when it can't be
+    if moment <= start:
+        return 0
+    if repeat in FIXED_STEPS:
+        return (moment - start) // FIXED_STEPS[repeat]
+    if repeat == 'every weekday':
+        # every full week after the first occurrence holds five of them
+        return max(0, (moment - first_weekday(start)).days // 7 * 5)
+    return 0
+
+
+def occurrence_starts(start, repeat, first=0):
+    # (index, start) of the occurrences of the rule, from occurrence `first`
+    # on; the rule ends with the last one datetime can hold
+    if repeat in FIXED_STEPS:
+        step = FIXED_STEPS[repeat]
+        for n in counter(first):
+            try:
+                occurrence = start + n * step
+            except OverflowError:
+                return
+            yield n, occurrence
+    elif repeat == 'every weekday':
+        base = first_weekday(start)
+        weekday = base.weekday()
+        for n in counter(first):
+            weeks, day = divmod(weekday + n, 5)
+            try:
+                occurrence = base + timedelta(days=weeks * 7 + day - weekday)
+            except OverflowError:
+                return
+            yield n, occurrence
+    else:
+        # monthly and yearly series skip the months (years) that have no
+        # such day, e.g. the 31st or February 29th, like RFC 5545 does
+        n = 0
+        for step in counter(0):
+            if repeat == 'monthly':
+                years, month = divmod(start.month - 1 + step, 12)
+                month += 1
+            else:
+                years, month = step, start.month
+            if start.year + years > MAXYEAR:
+                return
+            try:
+                occurrence = start.replace(year=start.year + years, month=month)
+            except ValueError:
+                continue
+            if n >= first:
+                yield n, occurrence
+            n += 1
+
+
+def walk(start, end, repeat, num_of_repeats=None, until=None, first=0):
+    # (start, end) of the occurrences from `first` on, up to the series' bound
+    duration = end - start
+    for n, occurrence in occurrence_starts(start, repeat, first):
+        if num_of_repeats is not None and n >= num_of_repeats:
+            return
+        if until is not None and occurrence > until or occurrence > datetime.max - duration:
+            return
+        yield occurrence, occurrence + duration
+
+
+def last_occurrence(start, end, repeat, num_of_repeats=None, until=None):
+    # the last occurrence of a bounded series, or None if it has none
+    first = []
+    if num_of_repeats is not None:
+        first.append(max(0, num_of_repeats - 1))
+    if until is not None:
+        first.append(first_index(start, repeat, until))
+    last = None
+    for last in walk(start, end, repeat, num_of_repeats, until, min(first)):
+        pass
+    return last
+
+
+def expand(start, end, repeat, window_start, window_end, num_of_repeats=None, until=None, exceptions=()):
+    # lazily yield (start, end, original_start) of the occurrences that
+    # overlap [window_start, window_end), in order. `exceptions` holds
+    # (original_start, start, end) rows for moved occurrences and
+    # (original_start, None, None) for cancelled ones
+    overridden = set()
+    moved = []
+    for original_start, moved_start, moved_end in exceptions:
+        overridden.add(original_start)
+        if moved_start is not None and moved_start < window_end and moved_end > window_start:
+            moved.append((moved_start, moved_end, original_start))
+    moved.sort()
+
+    def from_rule():
+        first = first_index(start, repeat, window_start - (end - start))
+        for occurrence_start, occurrence_end in walk(start, end, repeat, num_of_repeats, until, first):
+            if occurrence_start >= window_end:
+                return
+            if occurrence_end > window_start and occurrence_start not in overridden:
+                yield occurrence_start, occurrence_end, occurrence_start
+
+    return heapq.merge(from_rule(), moved)
+
+
+def is_occurrence(start, end, repeat, moment, num_of_repeats=None, until=None):
+    # whether the rule puts an occurrence at exactly `moment`
+    for occurrence_start, _ in walk(start, end, repeat, num_of_repeats, until, first_index(start, repeat, moment)):
+        if occurrence_start >= moment:
+            return occurrence_start == moment
+    return False
@@ -0,0 +1,110 @@
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+# the sweep runs over int64 arrays with NumPy when it is installed, and
+# falls back to plain lists otherwise
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+WORK_DAYS = (0, 1, 2, 3, 4)
+
+
+def parse_clock(value):
+    # 'HH:MM' working hour boundaries
+    hour, minute = value.split(':')
+    return time(int(hour), int(minute))
+
+
+def working_hours(window_start, window_end, timezone, work_start, work_end, work_days=WORK_DAYS):
+    # [start, end) epoch seconds of the user's working hours that touch the
+    # window; hours ending at or before they start run past midnight
+    zone = ZoneInfo(timezone)
+    first_day = datetime.fromtimestamp(window_start, zone).date() - timedelta(days=1)
+    last_day = datetime.fromtimestamp(window_end, zone).date()
+    start_clock, end_clock = parse_clock(work_start), parse_clock(work_end)
+    overnight = end_clock <= start_clock
+
+    intervals = []
+    day = first_day
+    while day <= last_day:
+        if day.weekday() in work_days:
+            start = datetime.combine(day, start_clock, zone).timestamp()
+            end = datetime.combine(day + timedelta(days=1) if overnight else day, end_clock, zone).timestamp()
+            if end > window_start and start < window_end:
+                intervals.append((int(start), int(end)))
+        day += timedelta(days=1)
+    return intervals
+
+
+def off_hours(window_start, window_end, hours):
+    # the complement of sorted working hours inside the window
+    intervals = []
+    moment = window_start
+    for start, end in hours:
+        if start > moment:
+            intervals.append((moment, min(start, window_end)))
+        moment = max(moment, end)
+    if moment < window_end:
+        intervals.append((moment, window_end))
+    return intervals
+
+
+def find_slots(starts, ends, window_start, window_end, duration, k, granularity=None):
+    # the k earliest starts (epoch seconds) of a `duration` long slot inside
+    # the window that overlaps none of the busy [starts, ends) intervals.
+    # without a granularity every free gap gives one slot at its start,
+    # with one every aligned start that fits is a candidate
+    if np is not None:
+        return _find_slots_numpy(starts, ends, window_start, window_end, duration, k, granularity)
+    return _find_slots_python(starts, ends, window_start, window_end, duration, k, granularity)
+
+
+def _find_slots_numpy(starts, ends, window_start, window_end, duration, k, granularity):
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    order = np.argsort(starts, kind='stable')
+    starts, ends = starts[order], ends[order]
+
+    # the running maximum of the ends is where the busy block reaching each
+    # interval stops, so the gaps are (reach before i, start of i)
+    reach = np.maximum.accumulate(ends) if len(ends) else ends
+    gap_starts = np.maximum(np.concatenate(([window_start], reach)), window_start)
+    gap_ends = np.minimum(np.concatenate((starts, [window_end])), window_end)
+
+    first = gap_starts
+    if granularity:
+        first = -(-gap_starts // granularity) * granularity
+    last = gap_ends - duration
+    fits = last >= first
+    if granularity:
+        counts = np.where(fits, (last - first) // granularity + 1, 0)
+    else:
+        counts = fits.astype(np.int64)
+    counts = np.minimum(counts, k)
+
+    # only expand the gaps needed to reach k slots
+    total = np.cumsum(counts)
+    needed = int(np.searchsorted(total, k)) + 1
+    first, counts = first[:needed], counts[:needed]
+    offsets = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+    slots = np.repeat(first, counts) + offsets * (granularity or 0)
+    return [int(slot) for slot in slots[:k]]
+
+
+def _find_slots_python(starts, ends, window_start, window_end, duration, k, granularity):
+    slots = []
+    reach = window_start
+    for start, end in sorted(zip(starts, ends)) + [(window_end, window_end)]:
+        gap_start, gap_end = max(reach, window_start), min(start, window_end)
+        first = -(-gap_start // granularity) * granularity if granularity else gap_start
+        while first + duration <= gap_end and len(slots) < k:
+            slots.append(first)
+            if not granularity:
+                break
+            first += granularity
+        if len(slots) >= k:
+            break
+        reach = max(reach, end)
+    return slots
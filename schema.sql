@@ -2,18 +2,24 @@ CREATE TABLE IF NOT EXISTS users (
     id INTEGER PRIMARY KEY,
     name TEXT NOT NULL,
     email TEXT UNIQUE NOT NULL,
-    password TEXT NOT NULL
+    password TEXT NOT NULL,
+    timezone TEXT,
+    work_start TEXT,
+    work_end TEXT,
+    work_days TEXT,
+    feed_version INTEGER NOT NULL DEFAULT 0,
+    feed_changed_ts INTEGER
 );
 
 CREATE TABLE IF NOT EXISTS meetings (
     id INTEGER PRIMARY KEY,
     title TEXT NOT NULL,
     description TEXT,
-    start_time TEXT NOT NULL,
-    end_time TEXT NOT NULL,
+    start_ts INTEGER NOT NULL,
+    end_ts INTEGER NOT NULL,
     location TEXT NOT NULL,
     organizer_id INTEGER NOT NULL,
-    invited_users TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
     FOREIGN KEY (organizer_id) REFERENCES users(id)
 );
 
@@ -24,4 +30,221 @@ CREATE TABLE IF NOT EXISTS invitations (
     status TEXT NOT NULL,
     FOREIGN KEY (user_id) REFERENCES users(id),
     FOREIGN KEY (meeting_id) REFERENCES meetings(id)
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS meeting_series (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT,
+    start_ts INTEGER NOT NULL,
+    end_ts INTEGER NOT NULL,
+    location TEXT NOT NULL,
+    organizer_id INTEGER NOT NULL,
+    repeat TEXT NOT NULL,
+    num_of_repeats INTEGER,
+    until_ts INTEGER,
+    span_start_ts INTEGER NOT NULL,
+    span_end_ts INTEGER NOT NULL,
+    FOREIGN KEY (organizer_id) REFERENCES users(id)
+);
+
+CREATE TABLE IF NOT EXISTS series_invitations (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    series_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    FOREIGN KEY (series_id) REFERENCES meeting_series(id)
+);
+
+CREATE TABLE IF NOT EXISTS series_exceptions (
+    id INTEGER PRIMARY KEY,
+    series_id INTEGER NOT NULL,
+    occurrence_ts INTEGER NOT NULL,
+    start_ts INTEGER,
+    end_ts INTEGER,
+    UNIQUE (series_id, occurrence_ts),
+    FOREIGN KEY (series_id) REFERENCES meeting_series(id)
+);
+
+CREATE TABLE IF NOT EXISTS freebusy (
+    user_id INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    busy BLOB NOT NULL,
+    PRIMARY KEY (user_id, day),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+) WITHOUT ROWID;
+
+-- months of past meetings moved to archive files by archive.py, with the
+-- times and ids their meetings span, which reads are routed by
+CREATE TABLE IF NOT EXISTS archive_partitions (
+    month TEXT PRIMARY KEY,
+    meetings INTEGER NOT NULL,
+    first_start_ts INTEGER NOT NULL,
+    last_end_ts INTEGER NOT NULL,
+    min_id INTEGER NOT NULL,
+    max_id INTEGER NOT NULL,
+    max_invitation_id INTEGER NOT NULL DEFAULT 0
+);
+
+-- holds the month being archived while its meetings are deleted from the
+-- live tables, inside the mover's transaction only: the delete triggers
+-- below skip those deletes, since the meetings still exist, in the archive
+CREATE TABLE IF NOT EXISTS archiving (
+    month TEXT NOT NULL
+);
+
+-- every insert, update and delete of meetings, series and their
+-- invitations leaves the latest change per item here, for GET /sync
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    item_id INTEGER NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    changed_ts INTEGER,
+    UNIQUE (kind, item_id)
+);
+
+-- deletions logged before position are pruned from changes, so tokens
+-- older than that get 410; pruned_ts is when GET /sync last pruned
+CREATE TABLE IF NOT EXISTS changes_pruned (
+    position INTEGER NOT NULL,
+    pruned_ts INTEGER NOT NULL
+);
+INSERT INTO changes_pruned (position, pruned_ts)
+SELECT 0, CAST(strftime('%s', 'now') AS INTEGER) WHERE NOT EXISTS (SELECT 1 FROM changes_pruned);
+
+CREATE TRIGGER IF NOT EXISTS changes_stamped AFTER INSERT ON changes BEGIN
+    UPDATE changes SET changed_ts = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS meetings_inserted AFTER INSERT ON meetings BEGIN
+    INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('meeting', NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS meetings_updated AFTER UPDATE ON meetings BEGIN
+    INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('meeting', NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS meetings_deleted AFTER DELETE ON meetings
+WHEN NOT EXISTS (SELECT 1 FROM archiving) BEGIN
+    INSERT OR REPLACE INTO changes (kind, item_id, deleted) VALUES ('meeting', OLD.id, 1);
+END;
+CREATE TRIGGER IF NOT EXISTS invitations_inserted AFTER INSERT ON invitations BEGIN
+    INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('invitation', NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS invitations_updated AFTER UPDATE ON invitations BEGIN
+    INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('invitation', NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS invitations_deleted AFTER DELETE ON invitations
+WHEN NOT EXISTS (SELECT 1 FROM archiving) BEGIN
+    INSERT OR REPLACE INTO changes (kind, item_id, deleted) VALUES ('invitation', OLD.id, 1);
+END;
+CREATE TRIGGER IF NOT EXISTS meeting_series_inserted AFTER INSERT ON meeting_series BEGIN
+    INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('series', NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS meeting_series_updated AFTER UPDATE ON meeting_series BEGIN
+    INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('series', NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS meeting_series_deleted AFTER DELETE ON meeting_series BEGIN
+    INSERT OR REPLACE INTO changes (kind, item_id, deleted) VALUES ('series', OLD.id, 1);
+END;
+CREATE TRIGGER IF NOT EXISTS series_invitations_inserted AFTER INSERT ON series_invitations BEGIN
+    INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('series_invitation', NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS series_invitations_updated AFTER UPDATE ON series_invitations BEGIN
+    INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('series_invitation', NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS series_invitations_deleted AFTER DELETE ON series_invitations BEGIN
+    INSERT OR REPLACE INTO changes (kind, item_id, deleted) VALUES ('series_invitation', OLD.id, 1);
+END;
+-- moving or cancelling an occurrence changes its series
+CREATE TRIGGER IF NOT EXISTS series_exceptions_inserted AFTER INSERT ON series_exceptions BEGIN
+    INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('series', NEW.series_id);
+END;
+CREATE TRIGGER IF NOT EXISTS series_exceptions_deleted AFTER DELETE ON series_exceptions BEGIN
+    INSERT OR REPLACE INTO changes (kind, item_id) VALUES ('series', OLD.series_id);
+END;
+-- every change to what a user's calendar feed shows (meetings and series
+-- they organize or accepted) moves their feed_version on, so polls of an
+-- unchanged feed are answered from the users row alone
+CREATE TRIGGER IF NOT EXISTS feed_meetings_inserted AFTER INSERT ON meetings BEGIN
+    UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id = NEW.organizer_id;
+END;
+CREATE TRIGGER IF NOT EXISTS feed_meetings_updated
+AFTER UPDATE OF title, description, start_ts, end_ts, location, organizer_id ON meetings BEGIN
+    UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id IN (OLD.organizer_id, NEW.organizer_id);
+    UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id IN (SELECT user_id FROM invitations WHERE meeting_id = NEW.id AND status = 'accepted');
+END;
+CREATE TRIGGER IF NOT EXISTS feed_meetings_deleted AFTER DELETE ON meetings
+WHEN NOT EXISTS (SELECT 1 FROM archiving) BEGIN
+    UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id = OLD.organizer_id;
+    UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id IN (SELECT user_id FROM invitations WHERE meeting_id = OLD.id AND status = 'accepted');
+END;
+CREATE TRIGGER IF NOT EXISTS feed_invitations_inserted AFTER INSERT ON invitations WHEN NEW.status = 'accepted' BEGIN
+    UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id = NEW.user_id;
+END;
+CREATE TRIGGER IF NOT EXISTS feed_invitations_updated AFTER UPDATE ON invitations
+WHEN 'accepted' IN (OLD.status, NEW.status) BEGIN
+    UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id IN (OLD.user_id, NEW.user_id);
+END;
+CREATE TRIGGER IF NOT EXISTS feed_invitations_deleted AFTER DELETE ON invitations
+WHEN OLD.status = 'accepted' AND NOT EXISTS (SELECT 1 FROM archiving) BEGIN
+    UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id = OLD.user_id;
+END;
+CREATE TRIGGER IF NOT EXISTS feed_meeting_series_inserted AFTER INSERT ON meeting_series BEGIN
+    UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id = NEW.organizer_id;
+END;
+CREATE TRIGGER IF NOT EXISTS feed_meeting_series_updated
+AFTER UPDATE OF title, description, start_ts, end_ts, location, organizer_id, repeat, num_of_repeats, until_ts ON meeting_series BEGIN
+    UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id IN (OLD.organizer_id, NEW.organizer_id);
+    UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id IN (SELECT user_id FROM series_invitations WHERE series_id = NEW.id AND status = 'accepted');
+END;
+CREATE TRIGGER IF NOT EXISTS feed_meeting_series_deleted AFTER DELETE ON meeting_series BEGIN
+    UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id = OLD.organizer_id;
+    UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id IN (SELECT user_id FROM series_invitations WHERE series_id = OLD.id AND status = 'accepted');
+END;
+CREATE TRIGGER IF NOT EXISTS feed_series_invitations_inserted AFTER INSERT ON series_invitations WHEN NEW.status = 'accepted' BEGIN
+    UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id = NEW.user_id;
+END;
+CREATE TRIGGER IF NOT EXISTS feed_series_invitations_updated AFTER UPDATE ON series_invitations
+WHEN 'accepted' IN (OLD.status, NEW.status) BEGIN
+    UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id IN (OLD.user_id, NEW.user_id);
+END;
+CREATE TRIGGER IF NOT EXISTS feed_series_invitations_deleted AFTER DELETE ON series_invitations WHEN OLD.status = 'accepted' BEGIN
+    UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id = OLD.user_id;
+END;
+-- moving or cancelling an occurrence changes the feeds of everyone in the series
+CREATE TRIGGER IF NOT EXISTS feed_series_exceptions_inserted AFTER INSERT ON series_exceptions BEGIN
+    UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id IN (SELECT organizer_id FROM meeting_series WHERE id = NEW.series_id)
+       OR id IN (SELECT user_id FROM series_invitations WHERE series_id = NEW.series_id AND status = 'accepted');
+END;
+CREATE TRIGGER IF NOT EXISTS feed_series_exceptions_deleted AFTER DELETE ON series_exceptions BEGIN
+    UPDATE users SET feed_version = feed_version + 1, feed_changed_ts = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id IN (SELECT organizer_id FROM meeting_series WHERE id = OLD.series_id)
+       OR id IN (SELECT user_id FROM series_invitations WHERE series_id = OLD.series_id AND status = 'accepted');
+END;
+
+CREATE INDEX IF NOT EXISTS idx_invitations_user_status ON invitations (user_id, status, meeting_id);
+CREATE INDEX IF NOT EXISTS idx_invitations_meeting ON invitations (meeting_id, user_id, status);
+CREATE INDEX IF NOT EXISTS idx_meetings_organizer_start ON meetings (organizer_id, start_ts, end_ts);
+CREATE INDEX IF NOT EXISTS idx_meetings_start_end ON meetings (start_ts, end_ts);
+CREATE INDEX IF NOT EXISTS idx_series_organizer_span ON meeting_series (organizer_id, span_start_ts, span_end_ts);
+CREATE INDEX IF NOT EXISTS idx_series_span ON meeting_series (span_start_ts, span_end_ts);
+CREATE INDEX IF NOT EXISTS idx_series_invitations_user_status ON series_invitations (user_id, status, series_id);
+CREATE INDEX IF NOT EXISTS idx_series_invitations_series ON series_invitations (series_id, user_id, status);
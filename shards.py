@@ -0,0 +1,499 @@
+# user sharded storage: users, the meetings they organize and the answers
+# they give are spread over N SQLite files, each a calendar database of its
+# own with its own write lock, so writes for different users no longer
+# queue behind one another
+#
+#     calendar.db  ->  calendar-shard-0-of-4.db, ..., calendar-shard-3-of-4.db
+#
+# a user lives on the shard their email hashes to and is given an id that
+# is that shard's index modulo N, so an id alone says where its user is.
+# meetings live with their organizer and get ids the same way; invitations
+# live with the invitee, so an RSVP only takes the invitee's shard's lock.
+# invitations to users on other shards go into an outbox on the organizer's
+# shard in the meeting's own transaction and are copied over from there.
+# reads that span users (a meeting's answers, a group's free time, the
+# meeting list) ask every shard they need at once and merge. the app runs
+# on the shards with SHARDS set; this module only stores and reads them,
+# the app shapes what it sends as it does for the single file
+#
+#     python shards.py calendar.db 4
+#     python shards.py calendar.db 8 --from 4
+#
+# split the app's calendar.db into 4 shards, then the 4 shards into 8.
+# series, exceptions and archived months are not sharded and are not copied
+import argparse
+import heapq
+import json
+import operator
+import os
+import sqlite3
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import freebusy
+import migrations
+import models
+import timecodec
+from pool import ConnectionPool
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+# which shard a file is, and the ids below which this shard must not hand
+# out new ones: after resharding it is past every id of the old shards
+SHARD_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS shard ('
+    'shard_index INTEGER NOT NULL, shard_count INTEGER NOT NULL, id_floor INTEGER NOT NULL)'
+)
+
+# an invitation keeps the times of its meeting, which lives on the
+# organizer's shard, so the invitee's shard alone can tell what they
+# accepted in a window and recompute their busy days
+INVITATION_TIMES = (
+    'ALTER TABLE invitations ADD COLUMN meeting_start_ts INTEGER',
+    'ALTER TABLE invitations ADD COLUMN meeting_end_ts INTEGER',
+)
+INVITATION_TIMES_INDEX = (
+    'CREATE INDEX IF NOT EXISTS idx_invitations_user_times ON invitations (user_id, status, meeting_start_ts, meeting_end_ts)'
+)
+
+# invitations to users on other shards, written on the organizer's shard in
+# the meeting's own transaction and waiting there to be delivered
+OUTBOX_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS outbox ('
+    'id INTEGER PRIMARY KEY, shard_index INTEGER NOT NULL, user_id INTEGER NOT NULL, meeting_id INTEGER NOT NULL, '
+    'meeting_start_ts INTEGER NOT NULL, meeting_end_ts INTEGER NOT NULL)'
+)
+OUTBOX_SQL = 'SELECT id, shard_index, user_id, meeting_id, meeting_start_ts, meeting_end_ts FROM outbox ORDER BY id'
+INSERT_OUTBOX_SQL = (
+    'INSERT INTO outbox (shard_index, user_id, meeting_id, meeting_start_ts, meeting_end_ts) VALUES (?, ?, ?, ?, ?)'
+)
+# a delivered invitation that is there already is left as it is, answered
+# or not, so delivering twice does no harm
+DELIVER_INVITATION_SQL = (
+    'INSERT INTO invitations (user_id, meeting_id, status, meeting_start_ts, meeting_end_ts) '
+    "SELECT ?, ?, 'pending', ?, ? WHERE NOT EXISTS (SELECT 1 FROM invitations WHERE meeting_id = ? AND user_id = ?)"
+)
+
+# rows copied per statement when resharding
+RESHARD_BATCH = 5000
+
+MEETING_COLUMNS = 'id, title, description, start_ts, end_ts, location, organizer_id, version'
+USER_COLUMNS = 'id, name, email, password, timezone, work_start, work_end, work_days'
+
+MEETINGS_BY_ID_SQL = (
+    f'SELECT {models.columns(models.Meeting)} FROM meetings WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id'
+)
+
+# the answers to a meeting given on one shard, with who gave them
+ANSWERS_SQL = (
+    'SELECT i.user_id, i.status, u.email, u.name FROM invitations AS i LEFT JOIN users AS u ON u.id = i.user_id '
+    'WHERE i.meeting_id = ? ORDER BY i.user_id'
+)
+
+INSERT_INVITATION_SQL = (
+    'INSERT INTO invitations (user_id, meeting_id, status, meeting_start_ts, meeting_end_ts) VALUES (?, ?, ?, ?, ?)'
+)
+
+# what a user organized or accepted inside a window, as GET
+# /users/<id>/meetings lists it
+ORGANIZED_SQL = (
+    f'SELECT {models.columns(models.Meeting)} FROM meetings WHERE organizer_id = ? AND start_ts >= ? AND end_ts <= ?'
+)
+ACCEPTED_SQL = (
+    "SELECT meeting_id FROM invitations WHERE user_id = ? AND status = 'accepted' "
+    'AND meeting_start_ts >= ? AND meeting_end_ts <= ?'
+)
+
+# (start, end) of what a user organized or accepted that overlaps a window,
+# all of it on the user's own shard
+USER_BUSY_SQL = (
+    'SELECT start_ts, end_ts FROM meetings WHERE organizer_id = ? AND start_ts < ? AND end_ts > ? '
+    'UNION '
+    "SELECT meeting_start_ts, meeting_end_ts FROM invitations WHERE user_id = ? AND status = 'accepted' "
+    'AND meeting_start_ts < ? AND meeting_end_ts > ?'
+)
+
+# the orders rows from several shards are merged in
+MEETING_ID = USER_ORDER = operator.attrgetter('id')
+MEETING_ORDER = operator.attrgetter('start_ts', 'id')
+
+
+def path(database, index, count):
+    # the file of shard `index` of `count` of a database
+    stem, extension = os.path.splitext(database)
+    return f'{stem}-shard-{index}-of-{count}{extension or ".db"}'
+
+
+def shard_of(item_id, count):
+    # the shard that handed out a user or meeting id
+    return item_id % count
+
+
+def home_shard(email, count):
+    # the shard a new user is placed on
+    return zlib.crc32(email.strip().lower().encode()) % count
+
+
+def next_id(db, table, index, count):
+    # the first id past everything `table` holds and the shard's floor that
+    # is `index` modulo `count`; call it holding the write lock
+    floor, = db.execute('SELECT id_floor FROM shard').fetchone()
+    largest, = db.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()
+    base = max(largest + 1, floor)
+    return base + (index - base) % count
+
+
+def init(db, index, count, floor=1):
+    # give a shard file the calendar schema and say which shard it is
+    if migrations.is_empty(db):
+        with open(SCHEMA_PATH) as f:
+            db.executescript(f.read())
+        migrations.stamp(db)
+    else:
+        migrations.migrate(db)
+    db.execute(SHARD_SCHEMA)
+    db.execute(OUTBOX_SCHEMA)
+    if 'meeting_start_ts' not in [column[1] for column in db.execute('PRAGMA table_info(invitations)')]:
+        for statement in INVITATION_TIMES:
+            db.execute(statement)
+    db.execute(INVITATION_TIMES_INDEX)
+    row = db.execute('SELECT shard_index, shard_count FROM shard').fetchone()
+    if row is None:
+        db.execute('INSERT INTO shard (shard_index, shard_count, id_floor) VALUES (?, ?, ?)', (index, count, floor))
+    elif tuple(row) != (index, count):
+        raise ValueError(f'The file is shard {row[0]} of {row[1]}, not {index} of {count}')
+    db.commit()
+
+
+class ShardedCalendar:
+    # the shards of one database for one process: a connection pool per
+    # shard, and threads to ask several shards at once. `on_connect` is
+    # called with every new connection, as the pools' own callbacks are
+
+    def __init__(self, database, count, pool_size=4, timeout=5.0, synchronous='NORMAL',
+                 factory=sqlite3.Connection, on_connect=()):
+        self.database = database
+        self.count = count
+        self.pid = os.getpid()
+        self.pools = [ConnectionPool(path(database, index, count), pool_size, timeout, factory, synchronous)
+                      for index in range(count)]
+        for pool in self.pools:
+            pool.on_connect.extend(on_connect)
+        self._fan_out = ThreadPoolExecutor(count, thread_name_prefix='shard')
+        for index in range(count):
+            self._write(index, init, index, count)
+        # whatever a process that stopped halfway left undelivered
+        self.deliver()
+
+    def close(self):
+        self._fan_out.shutdown()
+        for pool in self.pools:
+            pool.close()
+
+    def stats(self):
+        # the pools' stats() added up
+        totals = {}
+        for pool in self.pools:
+            for key, value in pool.stats().items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def _read(self, index, read, *args):
+        db = self.pools[index].acquire_reader()
+        try:
+            return read(db, *args)
+        finally:
+            self.pools[index].release(db)
+
+    def _write(self, index, write, *args):
+        # run `write` in one transaction on a shard's writer
+        db = self.pools[index].acquire_writer()
+        try:
+            if not db.in_transaction:
+                db.execute('BEGIN IMMEDIATE')
+            result = write(db, *args)
+            db.commit()
+            return result
+        finally:
+            self.pools[index].release(db)
+
+    def _each(self, indexes, call, *args):
+        # {index: call(index, *args)} of some shards, asked at once
+        indexes = list(indexes)
+        if len(indexes) == 1:
+            return {indexes[0]: call(indexes[0], *args)}
+        return dict(zip(indexes, self._fan_out.map(lambda index: call(index, *args), indexes)))
+
+    def select(self, sql, params, row_factory, key, indexes=None):
+        # the rows of a query sorted by `key` on each of some shards (all
+        # by default), asked at once and merged in `key` order
+        def read(db):
+            cursor = db.cursor()
+            cursor.row_factory = row_factory
+            return cursor.execute(sql, params).fetchall()
+
+        results = self._each(range(self.count) if indexes is None else indexes, lambda index: self._read(index, read))
+        return heapq.merge(*results.values(), key=key)
+
+    def meetings(self, ids):
+        # {id: models.Meeting} of some meetings, asked of the shards that
+        # handed their ids out, and of every other shard for the ones
+        # resharding moved away from there
+        row_factory = models.row_factory(models.Meeting)
+        found = {meeting.id: meeting for meeting in self.select(
+            MEETINGS_BY_ID_SQL, (json.dumps(list(ids)),), row_factory, MEETING_ID,
+            {shard_of(meeting_id, self.count) for meeting_id in ids})}
+        missing = [meeting_id for meeting_id in ids if meeting_id not in found]
+        if missing:
+            found.update((meeting.id, meeting) for meeting in self.select(
+                MEETINGS_BY_ID_SQL, (json.dumps(missing),), row_factory, MEETING_ID))
+        return found
+
+    def create_user(self, name, email, password, hours=(None, None, None, None)):
+        # the new user's id, or None when the email is taken. the email is
+        # looked up on every shard, since resharding places users by id
+        # while new ones are placed by email
+        taken = self._each(range(self.count), lambda index: self._read(
+            index, lambda db: db.execute('SELECT 1 FROM users WHERE email = ?', (email,)).fetchone()))
+        if any(taken.values()):
+            return None
+        index = home_shard(email, self.count)
+
+        def insert(db):
+            if db.execute('SELECT 1 FROM users WHERE email = ?', (email,)).fetchone():
+                return None
+            user_id = next_id(db, 'users', index, self.count)
+            db.execute(f'INSERT INTO users ({USER_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       (user_id, name, email, password, *hours))
+            return user_id
+
+        return self._write(index, insert)
+
+    def create_meetings(self, meetings):
+        # store parsed one-off meetings (as parse_meeting_ makes them) and
+        # return their ids: one transaction per organizers' shard, written
+        # at once, which takes the invitations of invitees on that shard
+        # along and puts the others in its outbox. those are delivered
+        # right after, and by the next process to open the shards when
+        # this one stops before that
+        if any(meeting['repeat'] is not None for meeting in meetings):
+            raise ValueError('Series are not sharded')
+        by_shard = {}
+        for position, meeting in enumerate(meetings):
+            by_shard.setdefault(shard_of(meeting['organizer_id'], self.count), []).append(position)
+
+        def insert_meetings(index):
+            def write(db):
+                first = next_id(db, 'meetings', index, self.count)
+                ids = [first + offset * self.count for offset in range(len(by_shard[index]))]
+                own = [meetings[position] for position in by_shard[index]]
+                db.executemany(
+                    'INSERT INTO meetings (id, title, description, start_ts, end_ts, location, organizer_id) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(meeting_id, meeting['title'], meeting['description'], meeting['start_ts'], meeting['end_ts'],
+                      meeting['location'], meeting['organizer_id']) for meeting_id, meeting in zip(ids, own)])
+                invitations = [(shard_of(user_id, self.count), user_id, meeting_id, meeting['start_ts'], meeting['end_ts'])
+                               for meeting_id, meeting in zip(ids, own) for user_id in meeting['invitees']]
+                db.executemany(INSERT_INVITATION_SQL, [
+                    (user_id, meeting_id, 'pending', start, end)
+                    for shard, user_id, meeting_id, start, end in invitations if shard == index])
+                db.executemany(INSERT_OUTBOX_SQL, [invitation for invitation in invitations if invitation[0] != index])
+                freebusy.add(db, [(meeting['organizer_id'], meeting['start_ts'], meeting['end_ts']) for meeting in own])
+                return ids
+            return self._write(index, write)
+
+        ids = [None] * len(meetings)
+        for index, shard_ids in self._each(by_shard, insert_meetings).items():
+            for position, meeting_id in zip(by_shard[index], shard_ids):
+                ids[position] = meeting_id
+        self.deliver(by_shard)
+        return ids
+
+    def deliver(self, indexes=None):
+        # copy the invitations waiting in the outboxes of some shards (all
+        # by default) to the invitees' shards, a transaction per shard, and
+        # then drop them from the outbox; a crash anywhere in between leaves
+        # them to be copied again. returns how many were delivered
+        def from_shard(index):
+            rows = self._read(index, lambda db: db.execute(OUTBOX_SQL).fetchall())
+            by_shard = {}
+            for row in rows:
+                by_shard.setdefault(row['shard_index'], []).append(
+                    (row['user_id'], row['meeting_id'], row['meeting_start_ts'], row['meeting_end_ts'],
+                     row['meeting_id'], row['user_id']))
+            for target, invitations in by_shard.items():
+                self._write(target, lambda db: db.executemany(DELIVER_INVITATION_SQL, invitations))
+            if rows:
+                self._write(index, lambda db: db.execute('DELETE FROM outbox WHERE id <= ?', (rows[-1]['id'],)))
+            return len(rows)
+
+        return sum(self._each(range(self.count) if indexes is None else indexes, from_shard).values())
+
+    def rsvp(self, meeting_id, user_id, status):
+        # answer an invitation on the invitee's shard alone, which has the
+        # meeting's times with it; False when there is no such invitation
+        index = shard_of(user_id, self.count)
+
+        def answer(db):
+            invitation = db.execute(
+                'SELECT status, meeting_start_ts, meeting_end_ts FROM invitations WHERE meeting_id = ? AND user_id = ?',
+                (meeting_id, user_id)).fetchone()
+            if invitation is None:
+                return False
+            previous, start, end = invitation
+            db.execute('UPDATE invitations SET status = ? WHERE meeting_id = ? AND user_id = ?', (status, meeting_id, user_id))
+            if status == 'accepted':
+                freebusy.add(db, [(user_id, start, end)])
+            elif previous == 'accepted':
+                # the days of the meeting are recomputed from what the user
+                # still organizes or accepted
+                first_day, last_day = freebusy.days(start, end)
+                window = ((last_day + 1) * timecodec.DAY, first_day * timecodec.DAY)
+                freebusy.replace(db, user_id, first_day, last_day, db.execute(USER_BUSY_SQL, (user_id, *window) * 2).fetchall())
+            return True
+
+        return self._write(index, answer)
+
+    def get_meeting(self, meeting_id):
+        # (models.Meeting, [(status, email, name)] of its invitations by
+        # user id), the answers read from every shard at once; None when
+        # the meeting doesn't exist
+        meeting = self.meetings([meeting_id]).get(meeting_id)
+        if meeting is None:
+            return None
+        answers = self.select(ANSWERS_SQL, (meeting_id,), None, lambda row: row[0])
+        return meeting, [answer[1:] for answer in answers]
+
+    def user_meetings(self, user_id, start, end):
+        # the meetings (models.Meeting) the user organized or accepted
+        # inside [start, end], by start; None when the user doesn't exist
+        index = shard_of(user_id, self.count)
+
+        def read(db):
+            if db.execute('SELECT 1 FROM users WHERE id = ?', (user_id,)).fetchone() is None:
+                return None, None
+            cursor = db.cursor()
+            cursor.row_factory = models.row_factory(models.Meeting)
+            return (cursor.execute(ORGANIZED_SQL, (user_id, start, end)).fetchall(),
+                    [row['meeting_id'] for row in db.execute(ACCEPTED_SQL, (user_id, start, end))])
+
+        organized, accepted = self._read(index, read)
+        if organized is None:
+            return None
+        return sorted(organized + list(self.meetings(accepted).values()), key=MEETING_ORDER)
+
+    def _by_shard(self, users):
+        by_shard = {}
+        for user_id in users:
+            by_shard.setdefault(shard_of(user_id, self.count), []).append(user_id)
+        return by_shard
+
+    def busy(self, users, start, end):
+        # freebusy.busy of some users, each shard reading the bitmaps of its
+        # own users at once
+        by_shard = self._by_shard(users)
+        busy = self._each(by_shard, lambda index: self._read(index, freebusy.busy, by_shard[index], start, end))
+        return [interval for intervals in busy.values() for interval in intervals]
+
+    def busy_by_user(self, users, day_numbers):
+        # freebusy.busy_by_user of some users, the same way
+        by_shard = self._by_shard(users)
+        busy = {}
+        for found in self._each(by_shard, lambda index: self._read(
+                index, freebusy.busy_by_user, by_shard[index], day_numbers)).values():
+            busy.update(found)
+        return busy
+
+# the invitations of a database being resharded, with their meetings'
+# times: the app's file has them in its meetings, a shard with each invitation
+APP_INVITATIONS_SQL = (
+    'SELECT i.user_id, i.meeting_id, i.status, m.start_ts, m.end_ts FROM invitations AS i '
+    'JOIN meetings AS m ON m.id = i.meeting_id'
+)
+SHARD_INVITATIONS_SQL = 'SELECT user_id, meeting_id, status, meeting_start_ts, meeting_end_ts FROM invitations'
+
+
+def _source_paths(database, count):
+    # the files of a database split `count` ways; 0 is the app's own file
+    return [database] if not count else [path(database, index, count) for index in range(count)]
+
+
+def reshard(database, target_count, source_count=0, batch_size=RESHARD_BATCH):
+    # copy the users, meetings, invitations and busy bitmaps of a database
+    # split `source_count` ways (0 for the app's single file) into
+    # `target_count` new shards, each row to the shard of the user it
+    # belongs to. returns the rows copied per table. the source is only
+    # read, so writes have to be stopped while this runs
+    if target_count == source_count:
+        raise ValueError('The database is split that way already')
+    for index in range(target_count):
+        if os.path.exists(path(database, index, target_count)):
+            raise FileExistsError(f'{path(database, index, target_count)} exists already')
+    if source_count:
+        # no invitation is left behind in an outbox, which isn't copied
+        ShardedCalendar(database, source_count).close()
+    sources = [ConnectionPool(file, size=1) for file in _source_paths(database, source_count)]
+    targets = [ConnectionPool(path(database, index, target_count), size=1) for index in range(target_count)]
+    copied = {'users': 0, 'meetings': 0, 'invitations': 0, 'freebusy': 0}
+    writers = [pool.acquire_writer() for pool in targets]
+    try:
+        # new ids start past every id the old shards handed out
+        floor = 1
+        for source in sources:
+            db = source.acquire_reader()
+            try:
+                for table in ('users', 'meetings'):
+                    floor = max(floor, db.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {table}').fetchone()[0])
+            finally:
+                source.release(db)
+        for index, db in enumerate(writers):
+            init(db, index, target_count, floor)
+            db.execute('BEGIN IMMEDIATE')
+
+        copies = (
+            ('users', f'SELECT {USER_COLUMNS} FROM users', 0,
+             f'INSERT INTO users ({USER_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)'),
+            ('meetings', f'SELECT {MEETING_COLUMNS} FROM meetings', 6,
+             f'INSERT INTO meetings ({MEETING_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)'),
+            ('invitations', SHARD_INVITATIONS_SQL if source_count else APP_INVITATIONS_SQL, 0, INSERT_INVITATION_SQL),
+            ('freebusy', 'SELECT user_id, day, busy FROM freebusy', 0,
+             'INSERT INTO freebusy (user_id, day, busy) VALUES (?, ?, ?)'),
+        )
+        for source in sources:
+            db = source.acquire_reader()
+            try:
+                for table, select, user_column, insert in copies:
+                    cursor = db.cursor()
+                    cursor.row_factory = None
+                    cursor.execute(select)
+                    while True:
+                        rows = cursor.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        by_shard = {}
+                        for row in rows:
+                            by_shard.setdefault(shard_of(row[user_column], target_count), []).append(row)
+                        for index, shard_rows in by_shard.items():
+                            writers[index].executemany(insert, shard_rows)
+                        copied[table] += len(rows)
+            finally:
+                source.release(db)
+        for db in writers:
+            db.commit()
+    finally:
+        for pool, db in zip(targets, writers):
+            pool.release(db)
+        for pool in sources + targets:
+            pool.close()
+    return copied
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Split a calendar database into user shards')
+    parser.add_argument('database')
+    parser.add_argument('shards', type=int)
+    parser.add_argument('--from', dest='source', type=int, default=0,
+                        help='the number of shards it is split into now, 0 (the default) for the app database')
+    args = parser.parse_args()
+    copied = reshard(args.database, args.shards, args.source)
+    print('Copied', ', '.join(f'{rows} {table}' for table, rows in copied.items()), 'into', args.shards, 'shards')
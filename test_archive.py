@@ -0,0 +1,163 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import archive
+import timecodec
+from app import app, init_db, get_pool, get_compactor
+
+# two meetings in March 2022 and one in April, all long over, and one far
+# in the future
+MEETINGS = (
+    ('Kickoff', '2022-03-01 10:00:00', '2022-03-01 11:00:00', 1, [2, 3]),
+    ('Review', '2022-03-15 09:00:00', '2022-03-15 10:00:00', 2, [1]),
+    ('Retro', '2022-04-02 14:00:00', '2022-04-02 15:00:00', 1, [2]),
+    ('Planning', '2099-01-05 10:00:00', '2099-01-05 11:00:00', 1, [2]),
+)
+CUTOFF = timecodec.parse('2023-01-01 00:00:00')
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        database = app.config['DATABASE']
+        self.addCleanup(app.config.__setitem__, 'DATABASE', database)
+        self.database = app.config['DATABASE'] = os.path.join(self.dir.name, 'calendar.db')
+        app.testing = True
+        init_db()
+        self.app = app.test_client()
+
+        for name in ('Alice', 'Bob', 'Nick'):
+            self.app.post('/users', json={'name': name, 'email': f'{name.lower()}@example.com', 'password': 'password'})
+        for title, start, end, organizer, invited in MEETINGS:
+            response = self.app.post('/meetings', json={
+                'title': title, 'start_time': start, 'end_time': end, 'location': 'Office',
+                'organizer_id': organizer, 'invited_users': json.dumps(invited)})
+            self.assertEqual(response.status_code, 200, response.data.decode())
+        self.app.post('/meeting/1/invite/2/accept')
+
+    def live(self, sql):
+        db = sqlite3.connect(self.database)
+        try:
+            return db.execute(sql).fetchall()
+        finally:
+            db.close()
+
+    def test_past_meetings_move_to_monthly_files(self):
+        self.assertEqual(archive.compact(get_pool(), self.database, CUTOFF, batch_size=2), (3, 4))
+        self.assertEqual(self.live('SELECT id FROM meetings'), [(4,)])
+        self.assertEqual(self.live('SELECT meeting_id FROM invitations'), [(4,)])
+        self.assertEqual(self.live('SELECT month, meetings, min_id, max_id FROM archive_partitions'),
+                         [('2022-03', 2, 1, 2), ('2022-04', 1, 3, 3)])
+        self.assertTrue(os.path.exists(os.path.join(self.dir.name, 'calendar-archive-2022-03.db')))
+        # nothing is left to move the next time
+        self.assertEqual(archive.compact(get_pool(), self.database, CUTOFF), (0, 0))
+
+        # an archived meeting still reads the same, with its invitations
+        response = self.app.get('/meetings/1')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertEqual(response.json['accepted_users'], [{'email': 'bob@example.com', 'name': 'Bob'}])
+        self.assertEqual(response.json['pending_users'], [{'email': 'nick@example.com', 'name': 'Nick'}])
+        self.assertEqual(self.app.get('/meetings/9').status_code, 404)
+        # but can't be answered any more
+        self.assertEqual(self.app.post('/meeting/1/invite/3/accept').status_code, 404)
+
+        window = 'start_time=2022-03-01 00:00:00&end_time=2022-04-30 23:59:59'
+        response = self.app.get(f'/users/1/meetings?{window}&include=attendees')
+        self.assertEqual([meeting['title'] for meeting in response.json], ['Kickoff', 'Retro'])
+        self.assertEqual([attendee['user_id'] for attendee in response.json[0]['attendees']], [2, 3])
+        response = self.app.get(f'/users/2/meetings?{window}')
+        self.assertEqual([meeting['title'] for meeting in response.json], ['Kickoff', 'Review'])
+
+        response = self.app.get(f'/meetings?{window}&limit=2')
+        self.assertEqual([meeting['title'] for meeting in response.json], ['Kickoff', 'Review'])
+        response = self.app.get(f'/meetings?{window}&after={response.headers["X-Next-Cursor"]}&include=attendees')
+        self.assertEqual([(meeting['title'], len(meeting['attendees'])) for meeting in response.json], [('Retro', 1)])
+        # without a window only the live meetings are listed
+        self.assertEqual([meeting['title'] for meeting in self.app.get('/meetings').json], ['Planning'])
+
+    def test_moves_are_not_deletions(self):
+        token = self.app.get('/sync').json['token']
+        feed_versions = self.live('SELECT id, feed_version FROM users ORDER BY id')
+        archive.compact(get_pool(), self.database, CUTOFF)
+
+        # clients keep the archived meetings they have, and the feeds still show them
+        response = self.app.get(f'/sync?token={token}')
+        self.assertEqual(response.json['deleted'], {'meetings': [], 'invitations': [], 'series': [], 'series_invitations': []})
+        self.assertEqual(self.live('SELECT id, feed_version FROM users ORDER BY id'), feed_versions)
+        self.assertEqual(self.live('SELECT COUNT(*) FROM archiving'), [(0,)])
+
+    def test_feeds_include_archived_meetings(self):
+        archive.compact(get_pool(), self.database, CUTOFF)
+        feed = self.app.get('/users/1/calendar.ics').data.decode()
+        self.assertEqual([line for line in feed.splitlines() if line.startswith('SUMMARY')],
+                         ['SUMMARY:Planning', 'SUMMARY:Kickoff', 'SUMMARY:Retro'])
+        feed = self.app.get('/users/2/calendar.ics').data.decode()
+        self.assertIn('SUMMARY:Kickoff', feed)
+
+    def test_ids_are_not_reused(self):
+        # with everything archived the live tables are empty, yet new
+        # meetings and invitations are numbered past the archived ones
+        archive.compact(get_pool(), self.database, timecodec.parse('2100-01-01 00:00:00'))
+        self.assertEqual(self.live('SELECT COUNT(*) FROM meetings'), [(0,)])
+        response = self.app.post('/meetings', json={
+            'title': 'Lunch', 'start_time': '2099-02-01 12:00:00', 'end_time': '2099-02-01 13:00:00',
+            'location': 'Canteen', 'organizer_id': 3, 'invited_users': '[2]'})
+        self.assertEqual(response.json['id'], 5)
+        self.assertEqual(self.live('SELECT id FROM invitations'), [(6,)])
+
+    def test_declines_keep_archived_busy_time(self):
+        archive.compact(get_pool(), self.database, CUTOFF)
+        # a meeting on the same day as the archived kickoff Bob accepted,
+        # accepted and declined again
+        response = self.app.post('/meetings', json={
+            'title': 'Lunch', 'start_time': '2022-03-01 12:00:00', 'end_time': '2022-03-01 13:00:00',
+            'location': 'Canteen', 'organizer_id': 3, 'invited_users': '[2]'})
+        meeting_id = response.json['id']
+        self.app.post(f'/meeting/{meeting_id}/invite/2/accept')
+        self.app.post(f'/meeting/{meeting_id}/invite/2/decline')
+
+        response = self.app.get('/users/2/freebusy?start_time=2022-03-01 00:00:00&end_time=2022-03-02 00:00:00')
+        self.assertEqual(response.json['busy'], [{'start_time': '2022-03-01 10:00:00', 'end_time': '2022-03-01 11:00:00'}])
+
+    def test_reads_only_open_the_months_they_reach(self):
+        archive.compact(get_pool(), self.database, CUTOFF)
+        # a window past the archive reads the list of months and nothing else;
+        # the first request also opens the pool's reader
+        for _ in range(2):
+            response = self.app.get('/users/1/meetings?start_time=2099-01-01 00:00:00&end_time=2099-01-31 00:00:00')
+        self.assertEqual([meeting['title'] for meeting in response.json], ['Planning'])
+        self.assertIn('desc="4 statements"', response.headers['Server-Timing'])
+        # one reaching into April opens that month's file alone: it attaches
+        # the live database and runs the query there
+        response = self.app.get('/users/1/meetings?start_time=2022-04-01 00:00:00&end_time=2022-04-30 00:00:00')
+        self.assertEqual([meeting['title'] for meeting in response.json], ['Retro'])
+        self.assertIn('desc="6 statements"', response.headers['Server-Timing'])
+
+        partitions = [archive.Partition('2022-03', 2, 100, 200, 1, 5), archive.Partition('2022-04', 1, 300, 400, 6, 6)]
+        self.assertEqual([partition.month for partition in archive.overlapping(partitions, 150, 350)], ['2022-03', '2022-04'])
+        self.assertEqual(archive.overlapping(partitions, 201, 299), [])
+        self.assertEqual(archive.holding(partitions, [3, 6, 7]), [(partitions[0], [3]), (partitions[1], [6])])
+
+    def test_compactor(self):
+        app.config['ARCHIVE_AFTER_DAYS'] = (timecodec.now() - CUTOFF) // timecodec.DAY
+        self.addCleanup(app.config.__setitem__, 'ARCHIVE_AFTER_DAYS', None)
+        compactor = get_compactor()
+        self.addCleanup(app.extensions.pop, 'compactor')
+        self.addCleanup(compactor.close)
+        self.assertIs(get_compactor(), compactor)
+
+        # the thread's first run may have taken them already
+        compactor.run()
+        self.assertEqual(self.live('SELECT id FROM meetings'), [(4,)])
+        stats = compactor.stats()
+        self.assertEqual((stats['meetings_moved'], stats['invitations_moved'], stats['failed_runs']), (3, 4, 0))
+        self.assertIn('calendar_archive_meetings_moved_total 3', self.app.get('/metrics').data.decode())
+
+
+if __name__ == '__main__':
+    unittest.main()
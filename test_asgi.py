@@ -0,0 +1,138 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import unittest
+
+import asgi
+from app import app, init_db, drop_db
+
+# a recursive query that only ends when it is interrupted
+ENDLESS_SQL = 'WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n'
+
+
+def slow_app(environ, start_response):
+    # /free_slots waits on the test's gate, /sql runs until it is
+    # interrupted, anything else answers right away
+    path = environ['PATH_INFO']
+    if path == '/free_slots':
+        environ['test.gate'].wait(5)
+    elif path == '/sql':
+        db = sqlite3.connect(':memory:', check_same_thread=False)
+        environ['calendar.cancellation'].watch(db)
+        try:
+            db.execute(ENDLESS_SQL).fetchone()
+        except sqlite3.OperationalError as e:
+            environ['test.errors'].append(str(e))
+            raise
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [path.encode()]
+
+
+class TestAsgi(unittest.TestCase):
+
+    def setUp(self):
+        app.testing = True
+        drop_db()
+        init_db()
+
+    def tearDown(self):
+        drop_db()
+
+    def test_routes(self):
+        async def scenario():
+            status, _, _ = await asgi.call(asgi.application, 'POST', '/users',
+                                           json_body={'name': 'Alice', 'email': 'alice@example.com', 'password': 'password'})
+            self.assertEqual(status, 200)
+            status, headers, body = await asgi.call(asgi.application, 'GET', '/users', b'limit=10')
+            self.assertEqual(status, 200)
+            self.assertEqual(headers[b'content-type'], b'application/json')
+            self.assertEqual(json.loads(body), [{'name': 'Alice', 'email': 'alice@example.com'}])
+
+            status, _, body = await asgi.call(asgi.application, 'GET', '/free_interval', json_body={'users': [1], 'meeting_duration': 30})
+            self.assertEqual(status, 200, body)
+            status, _, body = await asgi.call(asgi.application, 'GET', '/users', b'stream=ndjson')
+            self.assertEqual(body, b'{"email":"alice@example.com","name":"Alice"}\n')
+        asyncio.run(scenario())
+
+    def test_sweeps_in_processes(self):
+        client = app.test_client()
+        for name in ('Alice', 'Bob'):
+            client.post('/users', json={'name': name, 'email': f'{name}@example.com', 'password': 'password'})
+        client.post('/meetings', json={'title': 'Sync', 'description': '', 'start_time': '2022-03-07 10:00:00',
+                                       'end_time': '2022-03-07 11:00:00', 'location': '', 'organizer_id': 1,
+                                       'invited_users': '[2]'})
+        search = {'users': [1, 2], 'meeting_duration': 30, 'k': 5, 'granularity_minutes': 30,
+                  'start_time': '2022-03-07 09:00:00', 'end_time': '2022-03-08 00:00:00'}
+        queries = [{'users': users, 'meeting_duration': 30, 'start_time': '2022-03-07 10:00:00'} for users in ([1], [2], [1, 2])]
+        in_thread = client.post('/free_slots', json=search).get_json()
+        batch_in_thread = client.post('/free_interval/batch', json=queries).get_json()
+
+        app.config['SWEEP_PROCESSES'] = 2
+        self.addCleanup(app.config.__setitem__, 'SWEEP_PROCESSES', 0)
+        in_process = client.post('/free_slots', json=search).get_json()
+        batch_in_process = client.post('/free_interval/batch', json=queries).get_json()
+        app.extensions.pop('sweep_pool')[1].shutdown()
+        self.assertEqual(in_process, in_thread)
+        self.assertEqual(batch_in_process, batch_in_thread)
+        self.assertEqual([result['start_time'] for result in batch_in_process['results']],
+                         ['2022-03-07 11:00:00', '2022-03-07 10:00:00', '2022-03-07 11:00:00'])
+        self.assertNotIn({'start_time': '2022-03-07 10:00:00', 'end_time': '2022-03-07 10:30:00'}, in_process['slots'])
+
+    def test_searches_have_their_own_threads(self):
+        gate = threading.Event()
+        errors = []
+
+        def wrapped(environ, start_response):
+            environ.update({'test.gate': gate, 'test.errors': errors})
+            return slow_app(environ, start_response)
+
+        application = asgi.AsyncCalendar(wrapped, request_workers=2, search_workers=1, timeout=10)
+
+        async def scenario():
+            searches = [asyncio.ensure_future(asgi.call(application, 'POST', '/free_slots')) for _ in range(3)]
+            await asyncio.sleep(0.05)
+            started = time.perf_counter()
+            status, _, body = await asgi.call(application, 'GET', '/meetings/1')
+            self.assertLess(time.perf_counter() - started, 1)
+            self.assertEqual((status, body), (200, b'/meetings/1'))
+            self.assertFalse(any(search.done() for search in searches))
+            gate.set()
+            self.assertEqual([status for status, _, _ in await asyncio.gather(*searches)], [200] * 3)
+        asyncio.run(scenario())
+
+    def test_timeouts_interrupt_sql(self):
+        errors = []
+
+        def wrapped(environ, start_response):
+            environ.update({'test.gate': None, 'test.errors': errors})
+            return slow_app(environ, start_response)
+
+        application = asgi.AsyncCalendar(wrapped, request_workers=1, search_workers=0, timeout=0.2)
+
+        async def scenario():
+            status, _, body = await asgi.call(application, 'GET', '/sql')
+            self.assertEqual(status, 504)
+            self.assertIn('longer than 0.2 seconds', json.loads(body)['error'])
+            # the worker thread is free again once the query was interrupted
+            status, _, body = await asgi.call(application, 'GET', '/meetings/1')
+            self.assertEqual(status, 200)
+        asyncio.run(scenario())
+        self.assertEqual(errors, ['interrupted'])
+
+    def test_cancellation(self):
+        cancellation = asgi.Cancellation()
+        db = sqlite3.connect(':memory:', check_same_thread=False)
+        cancellation.watch(db)
+        self.assertTrue(cancellation.respond())
+        # a request that is already answering isn't timed out
+        self.assertFalse(cancellation.cancel(timed_out=True))
+        self.assertTrue(cancellation.cancel())
+        self.assertFalse(cancellation.respond())
+        with self.assertRaises(TimeoutError):
+            cancellation.watch(db)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+
+from app import app, get_pool, init_db
+from benchmarks import async_mode, free_interval_batch, generator, replay, report, scaling, serialization, sharding
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        database = app.config['DATABASE']
+        self.addCleanup(app.config.__setitem__, 'DATABASE', database)
+
+    def test_generator_is_deterministic(self):
+        anchor = datetime(2022, 3, 7)
+        first = generator.generate(users=20, meetings=200, seed=1, anchor=anchor)
+        self.assertEqual(first, generator.generate(users=20, meetings=200, seed=1, anchor=anchor))
+        self.assertNotEqual(first, generator.generate(users=20, meetings=200, seed=2, anchor=anchor))
+        self.assertTrue(any('repeat' in meeting for meeting in first['meetings']))
+
+    def test_replay_against_test_client(self):
+        dataset = generator.generate(users=20, meetings=100, seed=0, anchor=datetime(2022, 3, 7))
+        app.config['DATABASE'] = os.path.join(self.dir.name, 'bench.db')
+        target = replay.TestClientTarget(app, get_pool)
+        init_db()
+
+        ids = generator.load(target, dataset)
+        self.assertEqual(ids, generator.fresh_ids(dataset))
+
+        requests = generator.traffic(dataset, ids, count=100)
+        records, wall = replay.replay(target, requests, app, concurrency=2)
+        result = report.summarize(records, wall)
+        self.assertEqual(result['requests'], 100)
+        self.assertIn('GET /meetings/<int:meeting_id>', result['endpoints'])
+        for numbers in result['endpoints'].values():
+            self.assertEqual(numbers['errors'], 0)
+            self.assertGreater(numbers['sql_per_request'], 0)
+
+    def test_serialization_paths_agree(self):
+        path = os.path.join(self.dir.name, 'bench.db')
+        client = serialization.fresh_client(path, 2)
+        client.post('/meetings/bulk', json=serialization.make_meetings(20))
+        db = sqlite3.connect(path)
+        self.addCleanup(db.close)
+        for _, old_sql, sql, params, to_dict, model in serialization.QUERIES:
+            self.assertEqual(json.loads(serialization.with_records(db, sql, params, model)),
+                             json.loads(serialization.with_dicts(db, old_sql, params, to_dict)))
+
+    def test_async_modes_answer(self):
+        path = os.path.join(self.dir.name, 'bench.db')
+        client = async_mode.fresh_client(path, 4)
+        client.post('/meetings/bulk', json=async_mode.make_meetings(20, 4, seed=1))
+        for mode in async_mode.MODES:
+            name, result = async_mode.measure(mode[:3] + (0,), 10, 4, seconds=0.2, searches=1, readers=1)
+            for numbers in result.values():
+                self.assertGreater(numbers['requests'], 0)
+                self.assertEqual(numbers['errors'], 0)
+
+    def test_free_interval_batch_agrees(self):
+        anchor = datetime(2022, 3, 7)
+        target = scaling.fresh_target(os.path.join(self.dir.name, 'bench.db'))
+        generator.load(target, generator.generate(users=20, meetings=200, seed=0, anchor=anchor))
+        client = app.test_client()
+        queries = free_interval_batch.make_queries(20, 3, '2022-03-07 09:00:00')
+        self.assertEqual(len(queries), 27)
+        self.assertEqual(free_interval_batch.batched(client, queries), free_interval_batch.one_at_a_time(client, queries))
+
+    def test_sharded_writes_are_measured(self):
+        result = sharding.measure(self.dir.name, 2, processes=2, writes=10, synchronous='NORMAL', users=6)
+        self.assertEqual((result['shards'], result['writes']), (2, 20))
+        self.assertGreater(result['writes_per_second'], 0)
+
+    def test_scaling_points_have_their_own_process(self):
+        points = scaling.measure([50, 100], self.dir.name, anchor=datetime(2022, 3, 7), requests=20)
+        self.assertEqual([point['meetings'] for point in points['GET /users/<int:user_id>/meetings']], [50, 100])
+        for endpoint_points in points.values():
+            for point in endpoint_points:
+                self.assertEqual(point['errors'], 0)
+                self.assertGreater(point['peak_rss_mb'], 0)
+
+    def test_compare_flags_regressions(self):
+        baseline = {'throughput': 100, 'endpoints': {'GET /users': {'p95_ms': 10, 'sql_per_request': 1}},
+                    'scaling': {'GET /free_interval': [{'meetings': 1000, 'p95_ms': 5}]}}
+        self.assertEqual(report.compare(baseline, baseline), [])
+
+        current = {'throughput': 70, 'endpoints': {'GET /users': {'p95_ms': 11, 'sql_per_request': 2}},
+                   'scaling': {'GET /free_interval': []}}
+        self.assertEqual(report.compare(baseline, current), [
+            'run throughput: 100 -> 70',
+            'GET /users sql_per_request: 1 -> 2',
+            'GET /free_interval at 1000 meetings: missing',
+        ])
+
+    def test_percentile(self):
+        self.assertEqual(report.percentile([1, 2, 3, 4, 5], 0.5), 3)
+        self.assertEqual(report.percentile([1, 2], 0.5), 1.5)
+        self.assertIsNone(report.percentile([], 0.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+from unittest import mock
+
+from cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(size=2, ttl=60)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_entries_expire(self):
+        cache = LRUCache(size=2, ttl=10)
+        with mock.patch('cache.time.monotonic', return_value=100.0):
+            cache.put('a', 1)
+        with mock.patch('cache.time.monotonic', return_value=105.0):
+            self.assertEqual(cache.get('a'), 1)
+        with mock.patch('cache.time.monotonic', return_value=111.0):
+            self.assertIsNone(cache.get('a'))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['expirations'], stats['entries']), (1, 1, 1, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,10 @@
+import io
 import unittest
 import json
-from app import app, init_db, drop_db
-from datetime import datetime
+from app import app, init_db, drop_db, find_free_interval_, get_pool, get_write_db
+import timecodec
+from timecodec import parse
+from pagination import encode_cursor
 
 class TestCalendarService(unittest.TestCase):
 
@@ -107,6 +110,13 @@ class TestCalendarService(unittest.TestCase):
         response = self.app.post('/meetings', data=json.dumps(data), content_type='application/json')
         self.assertEqual(response.status_code, 400, response.data.decode())
 
+        # test creating a new meeting with invalid times
+        for start_time, end_time in [('2022-03-01 10:00:00', '2022-03-01 10:75:00'), ('2022-03-01 10:00:00', '2022-03-01 10:00:00'),
+                                     ('2022-03-01 11:00:00', '2022-03-01 10:00:00')]:
+            data.update(start_time=start_time, end_time=end_time)
+            response = self.app.post('/meetings', data=json.dumps(data), content_type='application/json')
+            self.assertEqual(response.status_code, 400, response.data.decode())
+
         # test creating series of meetings with valid data
         data = {
             'title': 'Team Meeting',
@@ -137,6 +147,282 @@ class TestCalendarService(unittest.TestCase):
         response = self.app.post('/meetings', data=json.dumps(data), content_type='application/json')
         self.assertEqual(response.status_code, 404, response.data.decode())
 
+    def test_create_series_without_repeat_cap(self):
+        # a daily standing meeting for a year is stored as one rule
+        data = {
+            'title': 'Standup',
+            'description': 'Daily standup',
+            'start_time': '2022-03-01 09:00:00',
+            'end_time': '2022-03-01 09:15:00',
+            'location': 'Office',
+            'organizer_id': 1,
+            'invited_users': '[2,3]',
+            'repeat': 'daily',
+            'num_of_repeats': 365
+        }
+        response = self.app.post('/meetings', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+
+        response = self.app.get('/series/1')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertEqual(response.json['num_of_repeats'], 365)
+        self.assertEqual(len(response.json['pending_users']), 2)
+
+        # only the occurrences inside the window are expanded
+        response = self.app.get('/users/1/meetings?start_time=2022-12-30 00:00:00&end_time=2023-01-05 00:00:00')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertEqual([meeting['start_time'] for meeting in response.json],
+                         ['2022-12-30 09:00:00', '2022-12-31 09:00:00', '2023-01-01 09:00:00',
+                          '2023-01-02 09:00:00', '2023-01-03 09:00:00', '2023-01-04 09:00:00'])
+        self.assertTrue(all(meeting['series_id'] == 1 for meeting in response.json))
+
+        # invitees see the occurrences once they accept the series
+        response = self.app.get('/users/2/meetings?start_time=2023-02-28 00:00:00&end_time=2023-03-10 00:00:00')
+        self.assertEqual(response.json, [])
+        response = self.app.post('/series/1/invite/2/accept')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        response = self.app.get('/users/2/meetings?start_time=2023-02-28 00:00:00&end_time=2023-03-10 00:00:00')
+        self.assertEqual([meeting['start_time'] for meeting in response.json],
+                         ['2023-02-28 09:00:00'])
+
+        response = self.app.get('/meetings?start_time=2022-03-01 00:00:00&end_time=2022-03-01 23:59:59')
+        self.assertEqual([(meeting['id'], meeting['start_time']) for meeting in response.json],
+                         [(None, '2022-03-01 09:00:00'), (1, '2022-03-01 10:00:00')])
+
+        # a series needs a valid bound
+        data['num_of_repeats'] = 0
+        response = self.app.post('/meetings', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 400, response.data.decode())
+        del data['num_of_repeats']
+        data['until'] = '2022-02-01 00:00:00'
+        response = self.app.post('/meetings', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 400, response.data.decode())
+
+        # and one that ends in a sane number of years
+        for bound in ({'num_of_repeats': 10 ** 9}, {'until': '9999-12-31 00:00:00'},
+                      {'repeat': 'yearly', 'num_of_repeats': 9000}, {'repeat': 'monthly', 'num_of_repeats': 10000}):
+            response = self.app.post('/meetings', data=json.dumps({**data, 'until': None, **bound}), content_type='application/json')
+            self.assertEqual(response.status_code, 400, response.data.decode())
+
+    def test_series_exceptions(self):
+        data = {
+            'title': 'Sync',
+            'description': 'Weekly sync',
+            'start_time': '2022-03-02 10:00:00',
+            'end_time': '2022-03-02 11:00:00',
+            'location': 'Office',
+            'organizer_id': 1,
+            'invited_users': '[]',
+            'repeat': 'weekly',
+            'until': '2022-03-23 10:00:00'
+        }
+        response = self.app.post('/meetings', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+
+        # cancel one occurrence and move another one
+        response = self.app.post('/series/1/exceptions', data=json.dumps(
+            {'occurrence_start': '2022-03-09 10:00:00', 'cancelled': True}), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        response = self.app.post('/series/1/exceptions', data=json.dumps(
+            {'occurrence_start': '2022-03-16 10:00:00', 'start_time': '2022-03-31 14:00:00', 'end_time': '2022-03-31 15:00:00'}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        response = self.app.post('/series/1/exceptions', data=json.dumps(
+            {'occurrence_start': '2022-03-16 11:00:00', 'cancelled': True}), content_type='application/json')
+        self.assertEqual(response.status_code, 404, response.data.decode())
+        response = self.app.post('/series/1/exceptions', data=json.dumps(
+            {'occurrence_start': '2022-03-23 10:00:00', 'start_time': '2022-03-23 15:00:00', 'end_time': '2022-03-23 14:00:00'}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400, response.data.decode())
+
+        response = self.app.get('/users/1/meetings?start_time=2022-03-02 00:00:00&end_time=2022-04-01 00:00:00')
+        self.assertEqual([meeting['start_time'] for meeting in response.json],
+                         ['2022-03-02 10:00:00', '2022-03-23 10:00:00', '2022-03-31 14:00:00'])
+        self.assertEqual(response.json[2]['occurrence_start'], '2022-03-16 10:00:00')
+
+        with app.app_context():
+            self.assertEqual(find_free_interval_([1], 60, parse('2022-03-31 13:30:00')), parse('2022-03-31 15:00:00'))
+
+    def test_create_meetings_bulk(self):
+        meeting = {
+            'title': 'Imported',
+            'description': 'From the old calendar',
+            'start_time': '2022-03-02 10:00:00',
+            'end_time': '2022-03-02 11:00:00',
+            'location': 'Office',
+            'organizer_id': 2,
+            'invited_users': '[1,3]'
+        }
+        series = dict(meeting, repeat='weekly', num_of_repeats=52)
+        items = [meeting, {'title': 'Broken'}, series, dict(meeting, repeat='hourly'), dict(meeting, start_time='2022-03-03 09:00:00', end_time='2022-03-03 10:00:00')]
+
+        app.config['BULK_COMMIT_SIZE'] = 2
+        try:
+            response = self.app.post('/meetings/bulk', data=json.dumps(items), content_type='application/json')
+        finally:
+            app.config['BULK_COMMIT_SIZE'] = 5000
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertEqual(response.json['created'], 3)
+        self.assertEqual(response.json['failed'], 2)
+        self.assertEqual(response.json['results'], [
+            {'index': 0, 'id': 2},
+            {'index': 1, 'error': "'start_time' is required"},
+            {'index': 2, 'series_id': 1},
+            {'index': 3, 'error': 'Repeat can only be from "daily", "weekly", "monthly", "yearly", "every weekday"'},
+            {'index': 4, 'id': 3},
+        ])
+
+        response = self.app.get('/meetings/3')
+        self.assertEqual(response.json['start_time'], '2022-03-03 09:00:00')
+        self.assertEqual(len(response.json['pending_users']), 2)
+        response = self.app.get('/series/1')
+        self.assertEqual(response.json['num_of_repeats'], 52)
+
+        # NDJSON is read line by line
+        body = '\n'.join([json.dumps(meeting), 'not json', json.dumps(meeting)]) + '\n'
+        response = self.app.post('/meetings/bulk', data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertEqual(response.json['results'], [
+            {'index': 0, 'id': 4},
+            {'index': 1, 'error': 'Invalid JSON'},
+            {'index': 2, 'id': 5},
+        ])
+
+        response = self.app.post('/meetings/bulk', data=json.dumps(meeting), content_type='application/json')
+        self.assertEqual(response.status_code, 400, response.data.decode())
+
+    def test_bulk_upload_releases_the_writer_between_chunks(self):
+        meeting = {'title': 'Imported', 'start_time': '2022-03-02 10:00:00', 'end_time': '2022-03-02 11:00:00',
+                   'location': 'Office', 'organizer_id': 2, 'invited_users': '[1]'}
+        lines = [(json.dumps(meeting) + '\n').encode()] * 3
+        held = []
+
+        class SlowUpload(io.BytesIO):
+            # hands out a line per read, noting whether the writer is taken
+            # while the client is still sending
+            def read(self, size=-1):
+                held.append(get_pool()._writer_lock.locked())
+                return self.readline(size)
+
+            def readinto(self, buffer):
+                line = self.read(len(buffer))
+                buffer[:len(line)] = line
+                return len(line)
+
+        app.config['BULK_COMMIT_SIZE'] = 1
+        self.addCleanup(app.config.__setitem__, 'BULK_COMMIT_SIZE', 5000)
+        response = self.app.post('/meetings/bulk', input_stream=SlowUpload(b''.join(lines)), content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertEqual(response.json['created'], 3)
+        self.assertEqual(held, [False] * len(held))
+
+    def test_list_pagination(self):
+        meeting = {
+            'title': 'Review',
+            'description': 'Code review',
+            'start_time': '2022-03-01 10:00:00',
+            'end_time': '2022-03-01 10:30:00',
+            'location': 'Office',
+            'organizer_id': 2,
+            'invited_users': '[1]'
+        }
+        items = [dict(meeting, start_time=f'2022-03-0{day} 09:00:00', end_time=f'2022-03-0{day} 09:30:00') for day in (3, 2, 4)]
+        items.append(dict(meeting, repeat='daily', num_of_repeats=3))
+        response = self.app.post('/meetings/bulk', data=json.dumps(items), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+
+        def collect(url):
+            pages = []
+            cursor = None
+            while True:
+                response = self.app.get(url + (f'&after={cursor}' if cursor else ''))
+                self.assertEqual(response.status_code, 200, response.data.decode())
+                pages.append([(item['id'], item['start_time']) for item in response.json])
+                cursor = response.headers.get('X-Next-Cursor')
+                if not cursor:
+                    return pages
+
+        self.assertEqual(collect('/meetings?limit=2'), [
+            [(1, '2022-03-01 10:00:00'), (3, '2022-03-02 09:00:00')],
+            [(2, '2022-03-03 09:00:00'), (4, '2022-03-04 09:00:00')],
+        ])
+        # a window pages through the series occurrences as well
+        self.assertEqual(collect('/meetings?limit=2&start_time=2022-03-01 00:00:00&end_time=2022-03-03 23:59:59'), [
+            [(1, '2022-03-01 10:00:00'), (None, '2022-03-01 10:00:00')],
+            [(3, '2022-03-02 09:00:00'), (None, '2022-03-02 10:00:00')],
+            [(2, '2022-03-03 09:00:00'), (None, '2022-03-03 10:00:00')],
+        ])
+        self.assertEqual(collect('/meetings?limit=10&organizer_id=1'), [[(1, '2022-03-01 10:00:00')]])
+
+        response = self.app.get('/users?limit=2')
+        self.assertEqual([user['name'] for user in response.json], ['Alice', 'Bob'])
+        response = self.app.get('/users?limit=2&after=' + response.headers['X-Next-Cursor'])
+        self.assertEqual([user['name'] for user in response.json], ['Nick'])
+        self.assertNotIn('X-Next-Cursor', response.headers)
+
+        response = self.app.get('/invitations?limit=4')
+        self.assertEqual([invitation['id'] for invitation in response.json], [1, 2, 3, 4])
+        response = self.app.get('/invitations?limit=4&after=' + response.headers['X-Next-Cursor'])
+        self.assertEqual([invitation['id'] for invitation in response.json], [5])
+
+        bad_cursors = [encode_cursor(key) for key in ([{}], [1, 0, {}], ['1', 0, 1], [True])]
+        for url in ('/meetings?limit=0', '/users?limit=abc', '/invitations?after=abc', '/meetings?after=WzFd',
+                    *(f'{path}?after={cursor}' for path in ('/users', '/invitations', '/meetings') for cursor in bad_cursors)):
+            response = self.app.get(url)
+            self.assertEqual(response.status_code, 400, url)
+
+    def test_list_streaming(self):
+        response = self.app.get('/meetings?stream=json')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertEqual(json.loads(response.data), self.app.get('/meetings').json)
+
+        response = self.app.get('/invitations?stream=ndjson')
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual([json.loads(line) for line in response.data.decode().splitlines()], self.app.get('/invitations').json)
+
+        response = self.app.get('/users?stream=ndjson&limit=1')
+        self.assertEqual(response.data.decode(), '{"email":"alice@example.com","name":"Alice"}\n')
+        self.assertIn('X-Next-Cursor', response.headers)
+
+        response = self.app.get('/users?stream=xml')
+        self.assertEqual(response.status_code, 400, response.data.decode())
+
+    def test_find_free_slots(self):
+        hours = {'timezone': 'Europe/Berlin', 'work_start': '09:00', 'work_end': '17:00'}
+        response = self.app.put('/users/1/working_hours', data=json.dumps(hours), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+
+        # Berlin is an hour ahead of UTC in March and the team meeting is padded by the buffer
+        data = {
+            'users': [1, 2],
+            'meeting_duration': 60,
+            'start_time': '2022-03-01 00:00:00',
+            'end_time': '2022-03-02 00:00:00',
+            'k': 3,
+            'buffer_minutes': 15,
+            'granularity_minutes': 30
+        }
+        response = self.app.post('/free_slots', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertEqual([slot['start_time'] for slot in response.json['slots']],
+                         ['2022-03-01 08:00:00', '2022-03-01 08:30:00', '2022-03-01 11:30:00'])
+        self.assertEqual(response.json['slots'][0]['end_time'], '2022-03-01 09:00:00')
+
+        # without a granularity each free gap gives one slot
+        del data['granularity_minutes']
+        data['working_hours'] = False
+        response = self.app.post('/free_slots', data=json.dumps(data), content_type='application/json')
+        self.assertEqual([slot['start_time'] for slot in response.json['slots']],
+                         ['2022-03-01 00:00:00', '2022-03-01 11:15:00'])
+
+        response = self.app.post('/free_slots', data=json.dumps(dict(data, users=[1, 7])), content_type='application/json')
+        self.assertEqual(response.status_code, 404, response.data.decode())
+        for invalid in ({'k': 0}, {'users': 5}, {'users': []}, {'users': ['1']}, {'meeting_duration': '30'}):
+            response = self.app.post('/free_slots', data=json.dumps(dict(data, **invalid)), content_type='application/json')
+            self.assertEqual(response.status_code, 400, response.data.decode())
+        response = self.app.put('/users/1/working_hours', data=json.dumps({'timezone': 'Mars/Olympus'}), content_type='application/json')
+        self.assertEqual(response.status_code, 400, response.data.decode())
+
     def test_get_meeting(self):
         # test getting meeting
         meeting_id = 1
@@ -148,6 +434,30 @@ class TestCalendarService(unittest.TestCase):
         response = self.app.get(f'/meetings/{meeting_id}')
         self.assertEqual(response.status_code, 404, response.data.decode())
 
+    def test_get_meeting_etag(self):
+        response = self.app.get('/meetings/1')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertEqual([user['name'] for user in response.json['pending_users']], ['Bob', 'Nick'])
+        etag = response.headers['ETag']
+
+        # polling an unchanged meeting is answered without a body
+        response = self.app.get('/meetings/1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+
+        # an answer to the invitation moves the version on
+        self.app.post('/meeting/1/invite/2/accept')
+        response = self.app.get('/meetings/1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual([user['name'] for user in response.json['accepted_users']], ['Bob'])
+        self.assertEqual([user['name'] for user in response.json['pending_users']], ['Nick'])
+
+        self.app.post('/meeting/1/invite/3/decline')
+        response = self.app.get('/meetings/1')
+        self.assertEqual([user['name'] for user in response.json['declined_users']], ['Nick'])
+        self.assertEqual(response.json['pending_users'], [])
+
 
     def test_accept_invitation(self):
         # test accept invitation
@@ -197,7 +507,6 @@ class TestCalendarService(unittest.TestCase):
             'description': 'Weekly team meeting',
             'end_time': '2022-03-01 11:00:00',
             'id': 1,
-            'invited_users': '[2,3]',
             'location': 'Office',
             'organizer_id': 1,
             'start_time': '2022-03-01 10:00:00',
@@ -219,16 +528,368 @@ class TestCalendarService(unittest.TestCase):
     def test_find_free_interval(self):
         # test find free interval
         data = {'users': [1, 2], 'meeting_duration': 30};
-        expected_result = 'Next meeting can be created at {time}'.format(time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        expected_result = 'Next meeting can be created at {time}'.format(time=timecodec.format(timecodec.now()))
         response = self.app.get('/free_interval', data=json.dumps(data), content_type='application/json')
         self.assertEqual(response.status_code, 200, response.data.decode())
         self.assertEqual(response.json["message"], expected_result)
 
+        # from a given time; the team meeting keeps Alice busy until 11:00
+        data = {'users': [1, 2], 'meeting_duration': 30, 'start_time': '2022-03-01 10:15:00'}
+        response = self.app.get('/free_interval', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.json['message'], 'Next meeting can be created at 2022-03-01 11:00:00')
+
         # test find free interval with missing data
         data = {'users': [1, 2]};
         response = self.app.get('/free_interval', data=json.dumps(data), content_type='application/json')
         self.assertEqual(response.status_code, 400, response.data.decode())
 
+        # test find free interval with invalid data
+        for data in ({'users': 5, 'meeting_duration': 30}, {'users': [], 'meeting_duration': 30},
+                     {'users': [1, 2], 'meeting_duration': '30'}, {'users': [1, 2], 'meeting_duration': 0}, [1, 2],
+                     {'users': [1, 2], 'meeting_duration': 30, 'start_time': 'soon'}):
+            response = self.app.get('/free_interval', data=json.dumps(data), content_type='application/json')
+            self.assertEqual(response.status_code, 400, response.data.decode())
+
+    def test_find_free_interval_skips_busy_time(self):
+        # a meeting of Nick's that runs over several search chunks
+        data = {
+            'title': 'Offsite',
+            'description': 'Two day offsite',
+            'start_time': '2022-03-01 11:00:00',
+            'end_time': '2022-03-03 09:00:00',
+            'location': 'Mountains',
+            'organizer_id': 3,
+            'invited_users': '[]'
+        }
+        response = self.app.post('/meetings', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+
+        now = parse('2022-03-01 10:30:00')
+        with app.app_context():
+            # the organizer is busy until the end of the team meeting
+            self.assertEqual(find_free_interval_([1], 30, now), parse('2022-03-01 11:00:00'))
+            # pending invitations do not block time
+            self.assertEqual(find_free_interval_([2], 30, now), now)
+            self.assertEqual(find_free_interval_([1, 3], 30, now), parse('2022-03-03 09:00:00'))
+
+        self.app.post('/meeting/1/invite/2/accept')
+        with app.app_context():
+            self.assertEqual(find_free_interval_([2], 30, now), parse('2022-03-01 11:00:00'))
+
+        # declining frees the time again
+        self.app.post('/meeting/1/invite/2/decline')
+        with app.app_context():
+            self.assertEqual(find_free_interval_([2], 30, now), now)
+
+    def test_free_interval_batch(self):
+        # Nick is away for two days and Alice has a standup every morning
+        offsite = {'title': 'Offsite', 'start_time': '2022-03-01 11:00:00', 'end_time': '2022-03-03 09:00:00',
+                   'location': 'Mountains', 'organizer_id': 3, 'invited_users': '[]'}
+        standup = {'title': 'Standup', 'start_time': '2022-03-02 09:00:00', 'end_time': '2022-03-02 09:30:00',
+                   'location': 'Office', 'organizer_id': 1, 'invited_users': '[]', 'repeat': 'daily', 'num_of_repeats': 5}
+        for meeting in (offsite, standup):
+            response = self.app.post('/meetings', data=json.dumps(meeting), content_type='application/json')
+            self.assertEqual(response.status_code, 200, response.data.decode())
+
+        window = {'start_time': '2022-03-01 10:30:00', 'end_time': '2022-03-08 00:00:00'}
+        queries = [
+            {'users': [1], 'meeting_duration': 30, **window},
+            {'users': [1, 3], 'meeting_duration': 30, **window},
+            {'users': [3, 1], 'meeting_duration': 90, 'start_time': '2022-03-03 08:00:00', 'end_time': '2022-03-04 00:00:00'},
+            {'users': [1, 2, 3], 'meeting_duration': 30, **window},
+            {'users': [3], 'meeting_duration': 30, 'start_time': '2022-03-01 12:00:00', 'end_time': '2022-03-02 12:00:00'},
+            {'users': [1], 'meeting_duration': 0, **window},
+            {'users': [1], 'meeting_duration': 30, 'start_time': 'tomorrow', 'end_time': '2022-03-02 00:00:00'},
+            {'users': [1]},
+        ]
+        response = self.app.post('/free_interval/batch', data=json.dumps(queries), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertEqual(response.json['found'], 4)
+        self.assertEqual([result['index'] for result in response.json['results']], list(range(len(queries))))
+        self.assertEqual([result.get('start_time', result.get('message', result.get('error')))
+                          for result in response.json['results']], [
+            '2022-03-01 11:00:00', '2022-03-03 09:30:00', '2022-03-03 09:30:00', '2022-03-03 09:30:00',
+            'No time for a new meeting', 'meeting_duration must be a positive number of minutes',
+            'Times must be in the format YYYY-mm-dd HH:MM:SS', 'users and meeting_duration are required'])
+        self.assertEqual(response.json['results'][2]['end_time'], '2022-03-03 11:00:00')
+
+        # the same answers as one search at a time
+        with app.app_context():
+            for query, result in zip(queries[:4], response.json['results']):
+                self.assertEqual(find_free_interval_(query['users'], query['meeting_duration'], parse(query['start_time'])),
+                                 parse(result['start_time']))
+
+        for body in ({'users': [1], 'meeting_duration': 30}, [{'users': [1], 'meeting_duration': 30, **window}] * 1001,
+                     [{'users': [1], 'meeting_duration': 30, 'start_time': '2022-01-01 00:00:00', 'end_time': '2022-01-02 00:00:00'},
+                      {'users': [1], 'meeting_duration': 30, 'start_time': '2023-06-01 00:00:00', 'end_time': '2023-06-02 00:00:00'}]):
+            response = self.app.post('/free_interval/batch', data=json.dumps(body), content_type='application/json')
+            self.assertEqual(response.status_code, 400, response.data.decode())
+
+    def test_rsvp_batch(self):
+        series = {'title': 'Standup', 'start_time': '2022-03-01 09:00:00', 'end_time': '2022-03-01 09:15:00',
+                  'location': 'Office', 'organizer_id': 1, 'invited_users': '[2]', 'repeat': 'daily', 'num_of_repeats': 5}
+        self.app.post('/meetings', data=json.dumps(series), content_type='application/json')
+
+        answers = [
+            {'meeting_id': 1, 'user_id': 2, 'status': 'accepted'},
+            {'meeting_id': 1, 'user_id': 3, 'status': 'declined'},
+            {'meeting_id': 1, 'user_id': 1, 'status': 'accepted'},
+            {'meeting_id': 7, 'user_id': 2, 'status': 'accepted'},
+            {'series_id': 1, 'user_id': 2, 'status': 'accepted'},
+            {'series_id': 1, 'user_id': 3, 'status': 'accepted'},
+            {'meeting_id': 1, 'user_id': 2, 'status': 'maybe'},
+            {'meeting_id': 1, 'series_id': 1, 'user_id': 2, 'status': 'accepted'},
+            {'meeting_id': '1', 'user_id': 2, 'status': 'accepted'},
+        ]
+        response = self.app.post('/invitations/rsvp', data=json.dumps(answers), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertEqual((response.json['updated'], response.json['failed']), (3, 6))
+        self.assertEqual([result.get('status', result.get('error')) for result in response.json['results']], [
+            'accepted', 'declined', 'Invitation not found', 'Meeting not found', 'accepted', 'Invitation not found',
+            'status must be "accepted" or "declined"', 'Each answer needs either meeting_id or series_id',
+            'meeting_id and user_id must be ids'])
+
+        response = self.app.get('/meetings/1')
+        self.assertEqual([user['name'] for user in response.json['accepted_users']], ['Bob'])
+        self.assertEqual([user['name'] for user in response.json['declined_users']], ['Nick'])
+        response = self.app.get('/series/1')
+        self.assertEqual([user['name'] for user in response.json['accepted_users']], ['Bob'])
+
+        # the last answer to an invitation is the one that counts, for busy time too
+        now = parse('2022-03-01 10:00:00')
+        with app.app_context():
+            self.assertEqual(find_free_interval_([2], 30, now), parse('2022-03-01 11:00:00'))
+        answers = [{'meeting_id': 1, 'user_id': 2, 'status': 'accepted'}, {'meeting_id': 1, 'user_id': 2, 'status': 'declined'}]
+        response = self.app.post('/invitations/rsvp', data=json.dumps(answers), content_type='application/json')
+        self.assertEqual(response.json['updated'], 2)
+        with app.app_context():
+            self.assertEqual(find_free_interval_([2], 30, now), now)
+
+        response = self.app.post('/invitations/rsvp', data=json.dumps({'meeting_id': 1}), content_type='application/json')
+        self.assertEqual(response.status_code, 400, response.data.decode())
+
+    def test_sync(self):
+        # the first sync brings everything
+        response = self.app.get('/sync')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertEqual([meeting['id'] for meeting in response.json['meetings']], [1])
+        self.assertEqual([invitation['user_id'] for invitation in response.json['invitations']], [2, 3])
+        self.assertFalse(response.json['more'])
+        token = response.json['token']
+
+        # nothing changed
+        response = self.app.get(f'/sync?token={token}')
+        self.assertEqual((response.json['meetings'], response.json['invitations']), ([], []))
+        self.assertEqual(response.json['token'], token)
+
+        # only what changed since the token, once however often it changed
+        self.app.post('/meeting/1/invite/2/accept')
+        self.app.post('/meeting/1/invite/2/decline')
+        response = self.app.get(f'/sync?token={token}')
+        self.assertEqual([meeting['id'] for meeting in response.json['meetings']], [1])
+        self.assertEqual([(invitation['user_id'], invitation['status']) for invitation in response.json['invitations']],
+                         [(2, 'declined')])
+        token = response.json['token']
+
+        series = {'title': 'Standup', 'start_time': '2022-03-01 09:00:00', 'end_time': '2022-03-01 09:15:00',
+                  'location': 'Office', 'organizer_id': 1, 'invited_users': '[2]', 'repeat': 'daily', 'num_of_repeats': 5}
+        self.app.post('/meetings', data=json.dumps(series), content_type='application/json')
+        response = self.app.get(f'/sync?token={token}&limit=1')
+        self.assertEqual([item['id'] for item in response.json['series']], [1])
+        self.assertEqual(response.json['series_invitations'], [])
+        self.assertTrue(response.json['more'])
+        response = self.app.get(f"/sync?token={response.json['token']}&limit=1")
+        self.assertEqual([item['series_id'] for item in response.json['series_invitations']], [1])
+        self.assertFalse(response.json['more'])
+
+        # deletes leave a tombstone
+        with app.app_context():
+            db = get_write_db()
+            db.execute('DELETE FROM invitations WHERE user_id = 3')
+            db.commit()
+        response = self.app.get(f'/sync?token={token}')
+        self.assertEqual(response.json['deleted']['invitations'], [2])
+        before_deletion, token = token, response.json['token']
+
+        # a series comes with its moved and cancelled occurrences
+        self.app.post('/series/1/exceptions', data=json.dumps(
+            {'occurrence_start': '2022-03-02 09:00:00', 'cancelled': True}), content_type='application/json')
+        response = self.app.get(f'/sync?token={token}')
+        self.assertEqual(response.json['series'][0]['exceptions'],
+                         [{'occurrence_start': '2022-03-02 09:00:00', 'start_time': None, 'end_time': None}])
+
+        # once old deletions are pruned, tokens from before them expire
+        with app.app_context():
+            db = get_write_db()
+            db.execute('UPDATE changes SET changed_ts = changed_ts - 31 * 86400 WHERE deleted = 1')
+            db.execute('UPDATE changes_pruned SET pruned_ts = 0')
+            db.commit()
+        self.assertEqual(self.app.get(f'/sync?token={before_deletion}').status_code, 410)
+        self.assertEqual(self.app.get(f'/sync?token={token}').status_code, 200)
+        response = self.app.get('/sync')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertEqual(response.json['deleted']['invitations'], [])
+        self.assertEqual(self.app.get(f"/sync?token={response.json['token']}").status_code, 200)
+
+        for url in ('/sync?token=abc', '/sync?limit=0', f"/sync?token={encode_cursor([1, 2])}"):
+            self.assertEqual(self.app.get(url).status_code, 400, url)
+
+    def test_user_freebusy(self):
+        self.app.post('/meeting/1/invite/2/accept')
+        response = self.app.get('/users/2/freebusy?start_time=2022-03-01 00:00:00&end_time=2022-03-02 00:00:00')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertEqual(response.json['busy'], [{'start_time': '2022-03-01 10:00:00', 'end_time': '2022-03-01 11:00:00'}])
+
+        # cut to the window
+        response = self.app.get('/users/1/freebusy?start_time=2022-03-01 10:30:00&end_time=2022-03-01 23:99:99')
+        self.assertEqual(response.json['busy'], [{'start_time': '2022-03-01 10:30:00', 'end_time': '2022-03-01 11:00:00'}])
+
+        self.app.post('/meeting/1/invite/2/decline')
+        response = self.app.get('/users/2/freebusy?start_time=2022-03-01 00:00:00&end_time=2022-03-02 00:00:00')
+        self.assertEqual(response.json['busy'], [])
+
+        self.assertEqual(self.app.get('/users/9/freebusy?start_time=2022-03-01 00:00:00&end_time=2022-03-02 00:00:00').status_code, 404)
+        self.assertEqual(self.app.get('/users/1/freebusy?start_time=2022-03-01 00:00:00').status_code, 400)
+
+    def test_conflict_policy(self):
+        # Nick's weekly series, accepted by Bob
+        series = {'title': 'Review', 'start_time': '2022-03-02 15:00:00', 'end_time': '2022-03-02 16:00:00',
+                  'location': 'Office', 'organizer_id': 3, 'invited_users': '[2]', 'repeat': 'weekly', 'num_of_repeats': 4}
+        self.app.post('/meetings', data=json.dumps(series), content_type='application/json')
+        self.app.post('/series/1/invite/2/accept')
+
+        # a daily series for Bob and Nick: Alice's meeting is only hers, Nick
+        # and Bob are busy with the review on the 2nd and the 9th
+        data = {'title': 'Sync', 'start_time': '2022-03-01 10:30:00', 'end_time': '2022-03-01 15:30:00',
+                'location': 'Office', 'organizer_id': 2, 'invited_users': '[3]', 'repeat': 'daily', 'num_of_repeats': 10,
+                'conflict_policy': 'reject'}
+        response = self.app.post('/meetings', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 409, response.data.decode())
+        self.assertEqual(response.json['conflicts'], [
+            {'start_time': '2022-03-02 10:30:00', 'end_time': '2022-03-02 15:30:00', 'users': [2, 3]},
+            {'start_time': '2022-03-09 10:30:00', 'end_time': '2022-03-09 15:30:00', 'users': [2, 3]},
+        ])
+        self.assertEqual(self.app.get('/series/2').status_code, 404)
+
+        # Alice is busy with her own meeting
+        data.update({'organizer_id': 1, 'invited_users': '[]', 'conflict_policy': 'warn', 'num_of_repeats': 1})
+        response = self.app.post('/meetings', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertEqual(response.json['conflicts'], [
+            {'start_time': '2022-03-01 10:30:00', 'end_time': '2022-03-01 15:30:00', 'users': [1]}])
+        self.assertEqual(response.json['series_id'], 2)
+
+        # back to back is no conflict
+        self.app.post('/meeting/1/invite/3/accept')
+        data = {'title': 'Next', 'start_time': '2022-03-01 11:00:00', 'end_time': '2022-03-01 11:30:00',
+                'location': 'Office', 'organizer_id': 3, 'invited_users': '[2]', 'conflict_policy': 'reject'}
+        response = self.app.post('/meetings', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertEqual(response.json['conflicts'], [])
+        self.assertNotIn('conflicts', self.app.post('/meetings', data=json.dumps(dict(data, conflict_policy='ignore')),
+                                                     content_type='application/json').json)
+
+        # nor is starting within the minute the last meeting ended in
+        data.update({'start_time': '2022-03-01 12:00:00', 'end_time': '2022-03-01 12:00:20', 'conflict_policy': 'ignore'})
+        self.app.post('/meetings', data=json.dumps(data), content_type='application/json')
+        data.update({'start_time': '2022-03-01 12:00:30', 'end_time': '2022-03-01 12:30:00', 'conflict_policy': 'reject'})
+        response = self.app.post('/meetings', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertEqual(response.json['conflicts'], [])
+
+        data['conflict_policy'] = 'sometimes'
+        response = self.app.post('/meetings', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 400, response.data.decode())
+
+    def test_include_attendees(self):
+        self.app.post('/meeting/1/invite/2/accept')
+        series = {'title': 'Standup', 'start_time': '2022-03-01 09:00:00', 'end_time': '2022-03-01 09:15:00',
+                  'location': 'Office', 'organizer_id': 1, 'invited_users': '[3, 9, 3]', 'repeat': 'daily', 'num_of_repeats': 2}
+        self.app.post('/meetings', data=json.dumps(series), content_type='application/json')
+        for index in range(5):
+            meeting = {'title': f'Meeting {index}', 'start_time': '2022-03-02 10:00:00', 'end_time': '2022-03-02 11:00:00',
+                       'location': 'Office', 'organizer_id': 2, 'invited_users': '[1]'}
+            self.app.post('/meetings', data=json.dumps(meeting), content_type='application/json')
+
+        # a page of meetings and their attendees in two statements
+        response = self.app.get('/meetings?include=attendees&limit=4')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertIn('desc="2 statements"', response.headers['Server-Timing'])
+        self.assertEqual(response.json[0]['attendees'], [
+            {'user_id': 2, 'name': 'Bob', 'email': 'bob@example.com', 'status': 'accepted'},
+            {'user_id': 3, 'name': 'Nick', 'email': 'nick@example.com', 'status': 'pending'}])
+        self.assertEqual([meeting['attendees'][0]['user_id'] for meeting in response.json[1:]], [1, 1, 1])
+        self.assertNotIn('invited_users', response.json[0])
+
+        # series occurrences get the series' attendees, unknown users included
+        window = 'start_time=2022-03-01 00:00:00&end_time=2022-03-01 23:99:99'
+        response = self.app.get(f'/users/1/meetings?{window}&include=attendees')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertEqual([meeting['title'] for meeting in response.json], ['Standup', 'Team Meeting'])
+        self.assertEqual(response.json[0]['attendees'], [
+            {'user_id': 3, 'name': 'Nick', 'email': 'nick@example.com', 'status': 'pending'},
+            {'user_id': 9, 'name': None, 'email': None, 'status': 'pending'}])
+        response = self.app.get(f'/meetings?{window}&include=attendees&stream=ndjson')
+        lines = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual([len(meeting['attendees']) for meeting in lines], [2, 2])
+
+        self.assertEqual(self.app.get('/meetings?include=everything').status_code, 400)
+        self.assertNotIn('attendees', self.app.get('/meetings').json[0])
+
+        # invited_users has to be a list of ids
+        series['invited_users'] = '["Bob"]'
+        response = self.app.post('/meetings', data=json.dumps(series), content_type='application/json')
+        self.assertEqual(response.status_code, 400, response.data.decode())
+
+    def test_calendar_feed(self):
+        response = self.app.get('/users/1/calendar.ics')
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertEqual(response.mimetype, 'text/calendar')
+        feed = response.data.decode()
+        self.assertTrue(feed.startswith('BEGIN:VCALENDAR\r\nVERSION:2.0\r\n'))
+        self.assertTrue(feed.endswith('END:VCALENDAR\r\n'))
+        self.assertIn('UID:meeting-1@calendar-backend\r\n', feed)
+        self.assertIn('DTSTART:20220301T100000Z\r\nDTEND:20220301T110000Z\r\nSUMMARY:Team Meeting\r\n', feed)
+        etag = response.headers['ETag']
+        self.assertIsNotNone(response.last_modified)
+
+        # an unchanged feed is answered from the users row alone
+        response = self.app.get('/users/1/calendar.ics', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('desc="1 statements"', response.headers['Server-Timing'])
+        response = self.app.get('/users/1/calendar.ics', headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+        self.assertEqual(response.status_code, 304)
+
+        # Bob's feed only has the meeting once he accepts it; Alice's is the same
+        bob = self.app.get('/users/2/calendar.ics')
+        self.assertNotIn('VEVENT', bob.data.decode())
+        self.app.post('/meeting/1/invite/2/accept')
+        response = self.app.get('/users/2/calendar.ics', headers={'If-None-Match': bob.headers['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('UID:meeting-1@calendar-backend', response.data.decode())
+        self.assertEqual(self.app.get('/users/1/calendar.ics', headers={'If-None-Match': etag}).status_code, 304)
+
+        # a series is one event with its rule, cancelled and moved occurrences included
+        series = {'title': 'Standup; daily', 'start_time': '2022-03-05 09:00:00', 'end_time': '2022-03-05 09:15:00',
+                  'location': 'Office', 'organizer_id': 1, 'invited_users': '[]', 'repeat': 'every weekday',
+                  'num_of_repeats': 10, 'until': '2022-03-31 00:00:00'}
+        self.app.post('/meetings', data=json.dumps(series), content_type='application/json')
+        for exception in ({'occurrence_start': '2022-03-08 09:00:00', 'cancelled': True},
+                          {'occurrence_start': '2022-03-09 09:00:00', 'start_time': '2022-03-09 15:00:00',
+                           'end_time': '2022-03-09 15:15:00'}):
+            response = self.app.post('/series/1/exceptions', data=json.dumps(exception), content_type='application/json')
+            self.assertEqual(response.status_code, 200, response.data.decode())
+        response = self.app.get('/users/1/calendar.ics', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        feed = response.data.decode()
+        self.assertEqual(feed.count('UID:series-1@calendar-backend'), 2)
+        self.assertIn('DTSTART:20220307T090000Z\r\nDTEND:20220307T091500Z\r\nSUMMARY:Standup\\; daily\r\n', feed)
+        self.assertIn('RRULE:FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR;UNTIL=20220318T090000Z\r\nEXDATE:20220308T090000Z\r\n', feed)
+        self.assertIn('DTSTART:20220309T150000Z\r\n', feed)
+        self.assertIn('RECURRENCE-ID:20220309T090000Z\r\n', feed)
+
+        self.assertEqual(self.app.get('/users/42/calendar.ics').status_code, 404)
+
 if __name__ == '__main__':
     unittest.main()
 
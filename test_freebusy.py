@@ -0,0 +1,67 @@
+import os
+import sqlite3
+import unittest
+
+import freebusy
+import timecodec
+from timecodec import parse
+
+
+def busy(db, users, start, end):
+    return [(timecodec.format(s), timecodec.format(e)) for s, e in freebusy.busy(db, users, parse(start), parse(end))]
+
+
+class TestFreeBusy(unittest.TestCase):
+
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.addCleanup(self.db.close)
+        with open(os.path.join(os.path.dirname(__file__), 'schema.sql')) as f:
+            self.db.executescript(f.read())
+
+    def test_masks_round_out_to_minutes(self):
+        bits = freebusy.masks([(parse('2022-03-01 10:00:30'), parse('2022-03-01 10:02:00'))])
+        day = parse('2022-03-01 00:00:00') // timecodec.DAY
+        self.assertEqual(bits, {day: 0b11 << 600})
+        self.assertEqual(list(freebusy.runs(day, bits[day])), [(parse('2022-03-01 10:00:00'), parse('2022-03-01 10:02:00'))])
+
+    def test_intervals_across_midnight(self):
+        bits = freebusy.masks([(parse('2022-03-01 23:00:00'), parse('2022-03-02 01:00:00'))])
+        self.assertEqual(len(bits), 2)
+        freebusy.add(self.db, [(1, parse('2022-03-01 23:00:00'), parse('2022-03-02 01:00:00'))])
+        self.assertEqual(busy(self.db, [1], '2022-03-01 00:00:00', '2022-03-03 00:00:00'),
+                         [('2022-03-01 23:00:00', '2022-03-02 00:00:00'), ('2022-03-02 00:00:00', '2022-03-02 01:00:00')])
+
+    def test_add_ors_and_replace_recomputes(self):
+        freebusy.add(self.db, [(1, parse('2022-03-01 10:00:00'), parse('2022-03-01 11:00:00'))])
+        freebusy.add(self.db, [(1, parse('2022-03-01 10:30:00'), parse('2022-03-01 12:00:00')),
+                               (2, parse('2022-03-01 14:00:00'), parse('2022-03-01 15:00:00'))])
+        self.assertEqual(busy(self.db, [1], '2022-03-01 00:00:00', '2022-03-02 00:00:00'),
+                         [('2022-03-01 10:00:00', '2022-03-01 12:00:00')])
+        # the users' days are ORed together
+        self.assertEqual(busy(self.db, [1, 2], '2022-03-01 00:00:00', '2022-03-02 00:00:00'),
+                         [('2022-03-01 10:00:00', '2022-03-01 12:00:00'), ('2022-03-01 14:00:00', '2022-03-01 15:00:00')])
+
+        day = parse('2022-03-01 00:00:00') // timecodec.DAY
+        freebusy.replace(self.db, 1, day, day, [(parse('2022-03-01 10:00:00'), parse('2022-03-01 11:00:00'))])
+        self.assertEqual(busy(self.db, [1], '2022-03-01 00:00:00', '2022-03-02 00:00:00'),
+                         [('2022-03-01 10:00:00', '2022-03-01 11:00:00')])
+        freebusy.replace(self.db, 1, day, day, [])
+        self.assertEqual(self.db.execute('SELECT COUNT(*) FROM freebusy WHERE user_id = 1').fetchone()[0], 0)
+
+    def test_rebuild_from_meetings(self):
+        self.db.executemany(
+            "INSERT INTO meetings (id, title, start_ts, end_ts, location, organizer_id) VALUES (?, 'Sync', ?, ?, 'Office', 1)",
+            [(1, parse('2022-03-01 10:00:00'), parse('2022-03-01 11:00:00')), (2, parse('2022-03-02 09:00:00'), parse('2022-03-02 09:30:00'))])
+        self.db.executemany("INSERT INTO invitations (user_id, meeting_id, status) VALUES (?, ?, ?)",
+                            [(2, 1, 'accepted'), (3, 1, 'declined'), (2, 2, 'pending')])
+        freebusy.rebuild(self.db)
+        self.assertEqual(busy(self.db, [1], '2022-03-01 00:00:00', '2022-03-03 00:00:00'),
+                         [('2022-03-01 10:00:00', '2022-03-01 11:00:00'), ('2022-03-02 09:00:00', '2022-03-02 09:30:00')])
+        self.assertEqual(busy(self.db, [2], '2022-03-01 00:00:00', '2022-03-03 00:00:00'),
+                         [('2022-03-01 10:00:00', '2022-03-01 11:00:00')])
+        self.assertEqual(busy(self.db, [3], '2022-03-01 00:00:00', '2022-03-03 00:00:00'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+import ical
+import timecodec
+
+
+def series(repeat, num_of_repeats=None, until=None):
+    return {'start_ts': timecodec.parse('2022-01-31 10:00:00'), 'end_ts': timecodec.parse('2022-01-31 11:00:00'),
+            'repeat': repeat, 'num_of_repeats': num_of_repeats,
+            'until_ts': until and timecodec.parse(until), 'title': 'Sync', 'description': None, 'location': ''}
+
+
+class TestIcal(unittest.TestCase):
+
+    def test_text(self):
+        self.assertEqual(ical.escape('a,b;c\\d\ne'), 'a\\,b\\;c\\\\d\\ne')
+        self.assertEqual(ical.timestamp(timecodec.parse('2022-03-01 10:05:09')), '20220301T100509Z')
+
+        line = 'SUMMARY:' + 'é' * 60
+        folded = ical.fold(line)
+        self.assertEqual(folded.replace('\r\n ', ''), line)
+        self.assertTrue(all(len(part.encode()) <= 75 for part in folded.split('\r\n')))
+        self.assertEqual(ical.fold('SUMMARY:short'), 'SUMMARY:short')
+
+    def test_rules(self):
+        self.assertEqual(ical.rrule(series('monthly', 3)), 'FREQ=MONTHLY;COUNT=3')
+        self.assertEqual(ical.rrule(series('weekly', until='2022-03-01 00:00:00')), 'FREQ=WEEKLY;UNTIL=20220301T000000Z')
+        # bounded both ways: the last occurrence the two bounds leave, the
+        # 31st of March since February has none
+        self.assertEqual(ical.rrule(series('monthly', 5, '2022-04-15 00:00:00')), 'FREQ=MONTHLY;UNTIL=20220331T100000Z')
+
+        # the rule's event, then one per moved occurrence
+        moved = timecodec.parse('2022-02-02 10:00:00')
+        events = list(ical.series_events('series-1', 0, series('daily', 5), [
+            (timecodec.parse('2022-02-01 10:00:00'), None, None), (moved, moved + 3600, moved + 7200)]))
+        self.assertEqual(len(events), 2)
+        self.assertIn('RRULE:FREQ=DAILY;COUNT=5\r\nEXDATE:20220201T100000Z\r\n', events[0])
+        self.assertNotIn('DESCRIPTION', events[0])
+        self.assertIn('DTSTART:20220202T110000Z\r\nDTEND:20220202T120000Z\r\n', events[1])
+        self.assertIn('RECURRENCE-ID:20220202T100000Z\r\n', events[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+from intervals import BusyTimeline, first_gaps
+
+
+class TestBusyTimeline(unittest.TestCase):
+
+    def test_merge_overlapping_intervals(self):
+        timeline = BusyTimeline([(5, 8), (1, 3), (2, 4), (8, 9), (12, 12)])
+        self.assertEqual(list(timeline), [(1, 4), (5, 9)])
+
+    def test_merge_timelines(self):
+        first = BusyTimeline([(1, 3), (10, 12)])
+        second = BusyTimeline([(2, 5), (20, 21)])
+        self.assertEqual(list(BusyTimeline.merge([first, second])), [(1, 5), (10, 12), (20, 21)])
+
+    def test_next_free(self):
+        timeline = BusyTimeline([(1, 4), (5, 9)])
+        self.assertEqual(timeline.next_free(0), 0)
+        self.assertEqual(timeline.next_free(1), 4)
+        self.assertEqual(timeline.next_free(4), 4)
+        self.assertEqual(timeline.next_free(6), 9)
+
+    def test_overlaps(self):
+        timeline = BusyTimeline([(1, 4), (5, 9)])
+        self.assertTrue(timeline.overlaps(0, 2))
+        self.assertTrue(timeline.overlaps(3, 6))
+        self.assertTrue(timeline.overlaps(6, 7))
+        self.assertFalse(timeline.overlaps(4, 5))
+        self.assertFalse(timeline.overlaps(9, 12))
+        self.assertFalse(BusyTimeline().overlaps(0, 1))
+
+    def test_first_gap(self):
+        timeline = BusyTimeline([(1, 4), (5, 9), (12, 20)])
+        self.assertEqual(timeline.first_gap(0, 1, 30), 0)
+        self.assertEqual(timeline.first_gap(2, 1, 30), 4)
+        self.assertEqual(timeline.first_gap(2, 3, 30), 9)
+        self.assertEqual(timeline.first_gap(2, 5, 30), 20)
+        self.assertIsNone(timeline.first_gap(2, 5, 24))
+
+    def test_first_gaps(self):
+        timeline = BusyTimeline([(1, 4), (5, 9)])
+        self.assertEqual(first_gaps(timeline, [(0, 1, 30), (2, 3, 30), (2, 5, 12)]), [0, 9, None])
+
+    def test_resume_point(self):
+        timeline = BusyTimeline([(1, 4), (5, 9)])
+        self.assertEqual(timeline.resume_point(0, 12), 9)
+        self.assertEqual(timeline.resume_point(0, 7), 9)
+        self.assertEqual(timeline.resume_point(10, 12), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import metrics
+from app import app, init_db, drop_db, get_registry
+
+
+class TestRegistry(unittest.TestCase):
+
+    def test_render(self):
+        registry = metrics.Registry()
+        registry.count('calendar_requests_total', (('method', 'GET'), ('route', '/users'), ('status', 200)))
+        registry.count('calendar_requests_total', (('method', 'GET'), ('route', '/users'), ('status', 200)))
+        registry.observe('calendar_sql_seconds', 0.0002, (0.0001, 0.001))
+        registry.observe('calendar_sql_seconds', 0.5, (0.0001, 0.001))
+        text = registry.render([('calendar_pool_size', 'gauge', 'Size', 8)])
+
+        self.assertIn('# TYPE calendar_requests_total counter', text)
+        self.assertIn('calendar_requests_total{method="GET",route="/users",status="200"} 2', text)
+        self.assertIn('# TYPE calendar_sql_seconds histogram', text)
+        self.assertIn('calendar_sql_seconds_bucket{le="0.0001"} 0', text)
+        self.assertIn('calendar_sql_seconds_bucket{le="0.001"} 1', text)
+        self.assertIn('calendar_sql_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn('calendar_sql_seconds_count 2', text)
+        self.assertIn('# TYPE calendar_pool_size gauge', text)
+        self.assertIn('calendar_pool_size 8', text)
+
+    def test_normalize(self):
+        self.assertEqual(metrics.normalize("SELECT *  FROM users\n WHERE id IN (?, ?, ?) AND name = 'x' AND age > 30"),
+                         'SELECT * FROM users WHERE id IN (?, ...) AND name = ? AND age > ?')
+
+
+class TestInstrumentedConnection(unittest.TestCase):
+
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:', factory=metrics.InstrumentedConnection)
+        self.addCleanup(self.db.close)
+        self.db.registry = metrics.Registry(slow_statement_seconds=10)
+
+    def test_statements_are_counted(self):
+        metrics.begin_request()
+        self.db.execute('CREATE TABLE items (id INTEGER PRIMARY KEY)')
+        self.db.executemany('INSERT INTO items (id) VALUES (?)', [(1,), (2,)])
+        self.db.cursor().execute('SELECT * FROM items').fetchall()
+        statements, seconds = metrics.end_request()
+        self.assertEqual(statements, 3)
+        self.assertGreater(seconds, 0)
+        self.assertEqual(metrics.end_request(), (0, 0.0))
+
+        text = self.db.registry.render()
+        self.assertIn('calendar_sql_statements_total{statement="INSERT"} 1', text)
+        self.assertIn('calendar_sql_seconds_count 3', text)
+
+    def test_slow_statements_are_logged(self):
+        self.db.registry.slow_statement_seconds = 0
+        with self.assertLogs('calendar.sql', 'WARNING') as logs:
+            self.db.execute('SELECT 1 WHERE 2 IN (?, ?)', (1, 2))
+        self.assertIn('SELECT ? WHERE ? IN (?, ...)', logs.output[0])
+        self.assertIn('calendar_sql_slow_statements_total 1', self.db.registry.render())
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        app.testing = True
+        drop_db()
+        init_db()
+        self.app = app.test_client()
+
+    def tearDown(self):
+        drop_db()
+
+    def test_metrics(self):
+        response = self.app.post('/users', data=json.dumps({'name': 'Alice', 'email': 'alice@example.com', 'password': 'password'}),
+                                 content_type='application/json')
+        self.assertIn('sql;dur=', response.headers['Server-Timing'])
+        self.app.get('/meetings/1')
+
+        text = self.app.get('/metrics').data.decode()
+        self.assertIn('calendar_requests_total{method="POST",route="/users",status="200"}', text)
+        self.assertIn('calendar_requests_total{method="GET",route="/meetings/<int:meeting_id>",status="404"}', text)
+        self.assertIn('calendar_request_seconds_bucket{method="POST",route="/users",le="+Inf"}', text)
+        self.assertIn('calendar_request_sql_statements_count{method="POST",route="/users"}', text)
+        self.assertIn('calendar_pool_reader_acquisitions_total', text)
+        self.assertIn('calendar_meeting_cache_misses_total', text)
+        self.assertIs(get_registry(), app.extensions['metrics'])
+
+    def test_profile_header(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        # without PROFILE_DIR the header is ignored
+        response = self.app.get('/users', headers={'X-Profile': '1'})
+        self.assertNotIn('X-Profile-File', response.headers)
+
+        app.config['PROFILE_DIR'] = directory.name
+        try:
+            response = self.app.get('/users', headers={'X-Profile': '1'})
+        finally:
+            app.config['PROFILE_DIR'] = None
+        self.assertEqual(response.status_code, 200, response.data.decode())
+        self.assertTrue(os.path.exists(os.path.join(directory.name, response.headers['X-Profile-File'])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import migrations
+
+# the schema calendar.db files were created with before versioning
+BASELINE_SCHEMA = '''
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL
+);
+
+CREATE TABLE meetings (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT,
+    start_time TEXT NOT NULL,
+    end_time TEXT NOT NULL,
+    location TEXT NOT NULL,
+    organizer_id INTEGER NOT NULL,
+    invited_users TEXT NOT NULL,
+    FOREIGN KEY (organizer_id) REFERENCES users(id)
+);
+
+CREATE TABLE invitations (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    meeting_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    FOREIGN KEY (meeting_id) REFERENCES meetings(id)
+);
+'''
+
+
+def describe_schema(db):
+    # tables with their columns and indexes, independent of how they were created
+    schema = {}
+    tables = [row[0] for row in db.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    for table in tables:
+        columns = sorted((row[1], row[2].upper(), row[3], row[5]) for row in db.execute(f'PRAGMA table_info({table})'))
+        indexes = sorted(
+            (row[1], row[2], tuple(info[2] for info in db.execute(f'PRAGMA index_info({row[1]})')))
+            for row in db.execute(f'PRAGMA index_list({table})')
+        )
+        schema[table] = (columns, indexes)
+    return schema
+
+
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def connect(self, name):
+        db = sqlite3.connect(os.path.join(self.dir.name, name))
+        self.addCleanup(db.close)
+        return db
+
+    def test_migrate_baseline_database(self):
+        db = self.connect('old.db')
+        db.executescript(BASELINE_SCHEMA)
+        db.execute("INSERT INTO users (name, email, password) VALUES ('Alice', 'alice@example.com', 'password')")
+        db.commit()
+        self.assertEqual(migrations.get_version(db), 0)
+        self.assertFalse(migrations.is_empty(db))
+
+        self.assertEqual(migrations.migrate(db), migrations.LATEST_VERSION)
+        self.assertEqual(db.execute('SELECT name FROM users').fetchall(), [('Alice',)])
+
+        # running it again is a no-op
+        self.assertEqual(migrations.migrate(db), migrations.LATEST_VERSION)
+
+    def test_times_become_epochs(self):
+        # rows written as text, in the formats older code stored them in
+        db = self.connect('times.db')
+        db.executescript(BASELINE_SCHEMA)
+        db.execute("INSERT INTO users (name, email, password) VALUES ('Alice', 'alice@example.com', 'password')")
+        db.executemany(
+            "INSERT INTO meetings (title, start_time, end_time, location, organizer_id, invited_users) VALUES ('Sync', ?, ?, 'Office', 1, '[]')",
+            [('2022-03-01 10:00:00', '2022-03-01 11:00:00'), ('2022-03-01T12:00:00', '2022-03-01 13:00:00.250000')])
+        db.commit()
+
+        migrations.migrate(db)
+        self.assertEqual(db.execute('SELECT start_ts, end_ts FROM meetings ORDER BY id').fetchall(),
+                         [(1646128800, 1646132400), (1646136000, 1646139600)])
+
+    def test_derived_tables_are_filled(self):
+        # the busy bitmaps and the change log start out with what is there
+        db = self.connect('derived.db')
+        db.executescript(BASELINE_SCHEMA)
+        db.execute("INSERT INTO users (name, email, password) VALUES ('Alice', 'alice@example.com', 'password')")
+        db.executemany(
+            "INSERT INTO meetings (title, start_time, end_time, location, organizer_id, invited_users) VALUES ('Sync', ?, ?, 'Office', 1, '[]')",
+            [('2022-03-01 10:00:00', '2022-03-01 11:00:00'), ('2022-03-01 12:00:00', '2022-03-01 13:00:00')])
+        db.commit()
+
+        migrations.migrate(db)
+        self.assertEqual(db.execute('SELECT user_id, day FROM freebusy').fetchall(), [(1, 19052)])
+        self.assertEqual(db.execute('SELECT kind, item_id FROM changes ORDER BY id').fetchall(), [('meeting', 1), ('meeting', 2)])
+
+    def test_invited_users_become_invitations(self):
+        db = self.connect('invited.db')
+        db.executescript(BASELINE_SCHEMA)
+        db.execute("INSERT INTO users (name, email, password) VALUES ('Alice', 'alice@example.com', 'password')")
+        db.executemany(
+            "INSERT INTO meetings (title, start_time, end_time, location, organizer_id, invited_users) "
+            "VALUES ('Sync', '2022-03-01 10:00:00', '2022-03-01 11:00:00', 'Office', 1, ?)",
+            [('[2, 3, 3]',), ('not json',), ('[]',)])
+        db.execute("INSERT INTO invitations (user_id, meeting_id, status) VALUES (2, 1, 'accepted')")
+        db.commit()
+
+        migrations.migrate(db)
+        self.assertEqual(db.execute('SELECT meeting_id, user_id, status FROM invitations ORDER BY id').fetchall(),
+                         [(1, 2, 'accepted'), (1, 3, 'pending')])
+        self.assertNotIn('invited_users', [row[1] for row in db.execute('PRAGMA table_info(meetings)')])
+
+    def test_archived_months_learn_their_invitation_ids(self):
+        db = self.connect('archived.db')
+        db.executescript(BASELINE_SCHEMA)
+        original = migrations.MIGRATIONS
+        migrations.MIGRATIONS = original[:11]
+        try:
+            migrations.migrate(db)
+        finally:
+            migrations.MIGRATIONS = original
+        db.execute("INSERT INTO archive_partitions VALUES ('2022-03', 1, 0, 3600, 1, 1)")
+        db.commit()
+        archived = self.connect('archived-archive-2022-03.db')
+        archived.execute('CREATE TABLE invitations (id INTEGER PRIMARY KEY, user_id INTEGER, meeting_id INTEGER, status TEXT)')
+        archived.executemany("INSERT INTO invitations VALUES (?, 2, 1, 'pending')", [(4,), (7,)])
+        archived.commit()
+
+        migrations.migrate(db)
+        self.assertEqual(db.execute('SELECT max_invitation_id FROM archive_partitions').fetchall(), [(7,)])
+
+    def test_migrations_match_schema(self):
+        migrated = self.connect('migrated.db')
+        migrated.executescript(BASELINE_SCHEMA)
+        migrations.migrate(migrated)
+
+        fresh = self.connect('fresh.db')
+        self.assertTrue(migrations.is_empty(fresh))
+        with open(os.path.join(os.path.dirname(__file__), 'schema.sql')) as f:
+            fresh.executescript(f.read())
+        migrations.stamp(fresh)
+
+        self.assertEqual(describe_schema(migrated), describe_schema(fresh))
+        self.assertEqual(migrations.get_version(migrated), migrations.get_version(fresh))
+
+    def test_failed_migration_rolls_back(self):
+        db = self.connect('broken.db')
+        db.executescript(BASELINE_SCHEMA)
+
+        def broken(db):
+            db.execute('CREATE TABLE scratch (id INTEGER PRIMARY KEY)')
+            raise RuntimeError('boom')
+
+        original = migrations.MIGRATIONS
+        migrations.MIGRATIONS = original + [broken]
+        try:
+            with self.assertRaises(RuntimeError):
+                migrations.migrate(db)
+        finally:
+            migrations.MIGRATIONS = original
+
+        self.assertEqual(migrations.get_version(db), len(original))
+        self.assertIsNone(db.execute("SELECT 1 FROM sqlite_master WHERE name = 'scratch'").fetchone())
+
+
+if __name__ == '__main__':
+    unittest.main()
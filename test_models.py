@@ -0,0 +1,61 @@
+import json
+import sqlite3
+import unittest
+from unittest import mock
+
+import models
+from app import app
+
+
+def expected(item):
+    return json.dumps(item, sort_keys=True, separators=(',', ':'))
+
+
+class TestModels(unittest.TestCase):
+
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.addCleanup(self.db.close)
+        self.db.execute('CREATE TABLE meetings (id INTEGER PRIMARY KEY, title TEXT, description TEXT, start_ts INTEGER, '
+                        'end_ts INTEGER, location TEXT, organizer_id INTEGER, version INTEGER)')
+        self.db.execute("INSERT INTO meetings VALUES (1, 'Café \"sync\"', NULL, 1646128800, 1646132400, "
+                        "'Room\\n1', 1, 4)")
+        self.db.execute("INSERT INTO meetings VALUES (2, 42, 'd', 0, 60, 'x', 'someone', 0)")
+
+    def test_rows_become_records(self):
+        cursor = self.db.cursor()
+        cursor.row_factory = models.row_factory(models.Meeting)
+        meeting, odd = cursor.execute(f'SELECT {models.columns(models.Meeting)} FROM meetings ORDER BY id').fetchall()
+        self.assertIsInstance(meeting, models.Meeting)
+        self.assertEqual((meeting.id, meeting.start_ts, meeting.description), (1, 1646128800, None))
+        self.assertFalse(hasattr(meeting, '__dict__'))
+        self.assertEqual(models.columns(models.User, 'u'), 'u.id, u.name, u.email')
+
+        self.assertEqual(meeting.json(), expected({
+            'id': 1, 'title': 'Café "sync"', 'description': None, 'start_time': '2022-03-01 10:00:00',
+            'end_time': '2022-03-01 11:00:00', 'location': 'Room\\n1', 'organizer_id': 1}))
+        self.assertEqual(json.loads(odd.json())['title'], '42')
+        self.assertEqual(json.loads(odd.json())['organizer_id'], 'someone')
+
+    def test_users_and_invitations(self):
+        self.assertEqual(models.User(1, 'Zoë', 'zoe@example.com').json(),
+                         expected({'name': 'Zoë', 'email': 'zoe@example.com'}))
+        self.assertEqual(models.Invitation(7, 2, 1, 'accepted').json(),
+                         expected({'id': 7, 'user_id': 2, 'meeting_id': 1, 'status': 'accepted'}))
+
+
+class TestJSONProvider(unittest.TestCase):
+
+    def test_same_json_with_or_without_orjson(self):
+        item = {'b': [1, 2.5, None, True], 'a': {'z': 'x', 'y': 'é'}}
+        with app.app_context():
+            encoded = app.json.dumps(item)
+            with mock.patch.object(models, 'orjson', None):
+                self.assertEqual(json.loads(app.json.dumps(item)), json.loads(encoded))
+            # what orjson can't encode goes through the standard library
+            self.assertEqual(app.json.dumps({'big': 1 << 70}), '{"big": 1180591620717411303424}')
+            self.assertIn('\n', app.json.dumps(item, indent=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from pool import ConnectionPool
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.pool = ConnectionPool(os.path.join(directory.name, 'pool.db'), size=2, timeout=0.2)
+        self.addCleanup(self.pool.close)
+
+        db = self.pool.acquire_writer()
+        db.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)')
+        db.commit()
+        self.pool.release(db)
+
+    def test_connections_are_tuned(self):
+        db = self.pool.acquire_reader()
+        self.assertEqual(db.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(db.execute('PRAGMA synchronous').fetchone()[0], 1)
+        self.assertGreater(db.execute('PRAGMA busy_timeout').fetchone()[0], 0)
+        self.pool.release(db)
+
+        durable = ConnectionPool(self.pool.path, size=1, synchronous='FULL')
+        self.addCleanup(durable.close)
+        db = durable.acquire_writer()
+        self.assertEqual(db.execute('PRAGMA synchronous').fetchone()[0], 2)
+        durable.release(db)
+
+    def test_readers_are_read_only_and_reused(self):
+        db = self.pool.acquire_reader()
+        with self.assertRaises(sqlite3.OperationalError):
+            db.execute("INSERT INTO items (name) VALUES ('x')")
+        self.pool.release(db)
+
+        self.assertIs(self.pool.acquire_reader(), db)
+        stats = self.pool.stats()
+        self.assertEqual(stats['reader_reuses'], 1)
+        self.assertEqual(stats['readers_in_use'], 1)
+
+    def test_readers_are_bounded(self):
+        first = self.pool.acquire_reader()
+        self.pool.acquire_reader()
+        with self.assertRaises(TimeoutError):
+            self.pool.acquire_reader()
+        self.assertEqual(self.pool.stats()['timeouts'], 1)
+
+        self.pool.release(first)
+        self.assertIs(self.pool.acquire_reader(), first)
+
+    def test_single_writer(self):
+        writer = self.pool.acquire_writer()
+        writer.execute("INSERT INTO items (name) VALUES ('uncommitted')")
+
+        # readers are not blocked by the open write transaction
+        reader = self.pool.acquire_reader()
+        self.assertEqual(reader.execute('SELECT COUNT(*) FROM items').fetchone()[0], 0)
+        self.pool.release(reader)
+
+        # a second writer has to wait for the first one
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(self.pool.acquire_writer()))
+        thread.start()
+        thread.join(0.05)
+        self.assertEqual(acquired, [])
+
+        # releasing rolls back what was not committed
+        self.pool.release(writer)
+        thread.join()
+        self.assertEqual(acquired, [writer])
+        self.assertEqual(writer.execute('SELECT COUNT(*) FROM items').fetchone()[0], 0)
+        self.assertEqual(self.pool.stats()['writer_waits'], 1)
+        self.pool.release(writer)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+
+from archive import ARCHIVABLE_SQL
+from freebusy import FREEBUSY_SQL, FREEBUSY_DAYS_SQL
+from app import (app, init_db, drop_db, get_db, USER_MEETINGS_SQL, USER_BUSY_SQL, MEETING_SQL,
+                 MEETING_DETAILS_SQL, MEETING_VERSION_SQL, BUMP_MEETING_VERSION_SQL, INVITATION_SQL, RSVP_SQL, USER_SERIES_SQL,
+                 CHANGES_SQL, RSVP_LOOKUP_SQL, SERIES_RSVP_LOOKUP_SQL, SERIES_RSVP_SQL, USERS_SERIES_SQL,
+                 ATTENDEES_SQL, SERIES_ATTENDEES_SQL, FEED_VERSION_SQL, FEED_MEETINGS_SQL, FEED_SERIES_SQL)
+
+
+class TestQueryPlans(unittest.TestCase):
+
+    def setUp(self):
+        app.testing = True
+        drop_db()
+        init_db()
+
+    def tearDown(self):
+        drop_db()
+
+    def assertIndexedPlan(self, sql, params):
+        with app.app_context():
+            plan = [row[3] for row in get_db().execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()]
+        self.assertTrue(any(step.startswith('SEARCH') for step in plan), plan)
+        self.assertFalse(any(step.startswith('SCAN') for step in plan), plan)
+
+    def test_user_meetings_plan(self):
+        window = (1646092800, 1646179200)
+        self.assertIndexedPlan(USER_MEETINGS_SQL, (1, *window, 1, *window))
+        self.assertIndexedPlan(USER_BUSY_SQL, (1, window[1], window[0], 1, window[1], window[0]))
+        self.assertIndexedPlan(USER_SERIES_SQL, (1, window[1], window[0], 1, window[1], window[0]))
+
+    def test_freebusy_plan(self):
+        self.assertIndexedPlan(FREEBUSY_SQL.format('?, ?'), (1, 2, 19052, 19053))
+
+    def test_conflict_plans(self):
+        window = (1646092800, 1646179200)
+        self.assertIndexedPlan(USERS_SERIES_SQL.format('?, ?'), (1, 2, window[1], window[0]) * 2)
+        with app.app_context():
+            plan = [row[3] for row in get_db().execute('EXPLAIN QUERY PLAN ' + FREEBUSY_DAYS_SQL.format('?, ?'),
+                                                       (1, 2, '[19052, 19060]')).fetchall()]
+        self.assertTrue(any(step.startswith('SEARCH freebusy') for step in plan), plan)
+        self.assertFalse(any(step.startswith('SCAN freebusy') for step in plan), plan)
+
+    def test_attendees_plan(self):
+        self.assertIndexedPlan(ATTENDEES_SQL.format('?, ?'), (1, 2))
+        self.assertIndexedPlan(SERIES_ATTENDEES_SQL.format('?, ?'), (1, 2))
+
+    def test_archive_plan(self):
+        self.assertIndexedPlan(ARCHIVABLE_SQL, (1646092800, 1646092800, 5000))
+
+    def test_feed_plan(self):
+        self.assertIndexedPlan(FEED_VERSION_SQL, (1,))
+        self.assertIndexedPlan(FEED_MEETINGS_SQL, (1, 1))
+        self.assertIndexedPlan(FEED_SERIES_SQL, (1, 1))
+
+    def test_sync_plan(self):
+        self.assertIndexedPlan(CHANGES_SQL, (10, 100))
+
+    def test_get_meeting_plan(self):
+        self.assertIndexedPlan(MEETING_SQL, (1,))
+        self.assertIndexedPlan(MEETING_DETAILS_SQL, (1,))
+        self.assertIndexedPlan(MEETING_VERSION_SQL, (1,))
+
+    def test_rsvp_plan(self):
+        self.assertIndexedPlan(INVITATION_SQL, (1, 2))
+        self.assertIndexedPlan(RSVP_SQL, ('accepted', 1, 2))
+        self.assertIndexedPlan(BUMP_MEETING_VERSION_SQL, (1,))
+        self.assertIndexedPlan(SERIES_RSVP_SQL, ('accepted', 1, 2))
+
+    def test_rsvp_batch_plan(self):
+        # the batch itself is walked, every table is searched
+        for sql in (RSVP_LOOKUP_SQL, SERIES_RSVP_LOOKUP_SQL):
+            with app.app_context():
+                plan = [row[3] for row in get_db().execute('EXPLAIN QUERY PLAN ' + sql, ('[[1, 2]]',)).fetchall()]
+            self.assertEqual([step.split()[0] for step in plan], ['SCAN', 'SEARCH', 'SEARCH'], plan)
+            self.assertTrue(plan[0].startswith('SCAN p VIRTUAL TABLE'), plan)
+
+
+if __name__ == '__main__':
+    unittest.main()
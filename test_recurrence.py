@@ -0,0 +1,87 @@
+import unittest
+from datetime import datetime, timedelta
+
+import recurrence
+
+
+def starts(occurrences):
+    return [occurrence[0] for occurrence in occurrences]
+
+
+class TestRecurrence(unittest.TestCase):
+
+    def setUp(self):
+        # a Friday
+        self.start = datetime(2022, 3, 4, 10, 0)
+        self.end = self.start + timedelta(hours=1)
+
+    def test_daily_and_weekly(self):
+        self.assertEqual(starts(recurrence.walk(self.start, self.end, 'daily', 3)),
+                         [self.start, datetime(2022, 3, 5, 10), datetime(2022, 3, 6, 10)])
+        self.assertEqual(starts(recurrence.walk(self.start, self.end, 'weekly', until=datetime(2022, 3, 18, 10))),
+                         [self.start, datetime(2022, 3, 11, 10), datetime(2022, 3, 18, 10)])
+
+    def test_every_weekday(self):
+        self.assertEqual([day.day for day in starts(recurrence.walk(self.start, self.end, 'every weekday', 4))],
+                         [4, 7, 8, 9])
+        # a series starting on a Saturday begins on the Monday after
+        saturday = datetime(2022, 3, 5, 10)
+        self.assertEqual(starts(recurrence.walk(saturday, saturday + timedelta(hours=1), 'every weekday', 1)),
+                         [datetime(2022, 3, 7, 10)])
+
+    def test_monthly_and_yearly_skip_missing_days(self):
+        start = datetime(2022, 1, 31, 9)
+        self.assertEqual([day.month for day in starts(recurrence.walk(start, start, 'monthly', 4))], [1, 3, 5, 7])
+        leap = datetime(2024, 2, 29, 9)
+        self.assertEqual([day.year for day in starts(recurrence.walk(leap, leap, 'yearly', 2))], [2024, 2028])
+
+    def test_rules_end_with_the_calendar(self):
+        # unbounded rules stop at the last occurrence datetime can hold
+        # instead of overflowing or skipping years forever
+        start = datetime(9998, 2, 28, 9)
+        self.assertEqual([day.year for day in starts(recurrence.walk(start, start, 'yearly'))], [9998, 9999])
+        start = datetime(9999, 11, 30, 9)
+        self.assertEqual([day.month for day in starts(recurrence.walk(start, start, 'monthly'))], [11, 12])
+        start = datetime(9999, 12, 30, 9)
+        self.assertEqual(starts(recurrence.walk(start, start + timedelta(hours=1), 'daily')),
+                         [start, datetime(9999, 12, 31, 9)])
+        self.assertIsNone(recurrence.last_occurrence(start, start, 'daily', 10 ** 9))
+
+    def test_expand_only_walks_the_window(self):
+        occurrences = list(recurrence.expand(
+            self.start, self.end, 'daily', datetime(2030, 1, 1), datetime(2030, 1, 3), num_of_repeats=10 ** 9))
+        self.assertEqual(starts(occurrences), [datetime(2030, 1, 1, 10), datetime(2030, 1, 2, 10)])
+
+        occurrences = list(recurrence.expand(
+            self.start, self.end, 'every weekday', datetime(2030, 1, 4), datetime(2030, 1, 8), num_of_repeats=10 ** 9))
+        self.assertEqual([day.day for day in starts(occurrences)], [4, 7])
+
+    def test_expand_applies_exceptions(self):
+        exceptions = [
+            (datetime(2022, 3, 5, 10), None, None),
+            (datetime(2022, 3, 6, 10), datetime(2022, 3, 4, 15), datetime(2022, 3, 4, 16)),
+        ]
+        occurrences = list(recurrence.expand(
+            self.start, self.end, 'daily', datetime(2022, 3, 4), datetime(2022, 3, 8), num_of_repeats=4,
+            exceptions=exceptions))
+        self.assertEqual(occurrences, [
+            (self.start, self.end, self.start),
+            (datetime(2022, 3, 4, 15), datetime(2022, 3, 4, 16), datetime(2022, 3, 6, 10)),
+            (datetime(2022, 3, 7, 10), datetime(2022, 3, 7, 11), datetime(2022, 3, 7, 10)),
+        ])
+
+    def test_last_occurrence(self):
+        self.assertEqual(recurrence.last_occurrence(self.start, self.end, 'daily', 365),
+                         (datetime(2023, 3, 3, 10), datetime(2023, 3, 3, 11)))
+        self.assertEqual(recurrence.last_occurrence(self.start, self.end, 'weekly', 10, datetime(2022, 3, 12)),
+                         (datetime(2022, 3, 11, 10), datetime(2022, 3, 11, 11)))
+        self.assertIsNone(recurrence.last_occurrence(self.start, self.end, 'daily', until=datetime(2022, 3, 1)))
+
+    def test_is_occurrence(self):
+        self.assertTrue(recurrence.is_occurrence(self.start, self.end, 'weekly', datetime(2022, 3, 18, 10), 3))
+        self.assertFalse(recurrence.is_occurrence(self.start, self.end, 'weekly', datetime(2022, 3, 25, 10), 3))
+        self.assertFalse(recurrence.is_occurrence(self.start, self.end, 'weekly', datetime(2022, 3, 18, 11), 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
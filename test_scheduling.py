@@ -0,0 +1,56 @@
+import calendar
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import scheduling
+
+
+def epoch(*fields):
+    return calendar.timegm(datetime(*fields).timetuple())
+
+
+class TestScheduling(unittest.TestCase):
+
+    def check_find_slots(self, find_slots):
+        starts = [10, 30, 35, 90]
+        ends = [20, 40, 50, 95]
+        self.assertEqual(find_slots(starts, ends, 0, 100, 10, 5, None), [0, 20, 50])
+        self.assertEqual(find_slots(starts, ends, 0, 100, 10, 2, None), [0, 20])
+        self.assertEqual(find_slots(starts, ends, 15, 100, 20, 5, None), [50])
+        self.assertEqual(find_slots(starts, ends, 0, 100, 10, 4, 15), [0, 60, 75])
+        self.assertEqual(find_slots([], [], 0, 100, 30, 3, 25), [0, 25, 50])
+        self.assertEqual(find_slots([0], [100], 0, 100, 1, 3, None), [])
+
+    def test_find_slots(self):
+        self.check_find_slots(scheduling.find_slots)
+
+    def test_find_slots_without_numpy(self):
+        with mock.patch.object(scheduling, 'np', None):
+            self.check_find_slots(scheduling.find_slots)
+
+    def test_working_hours_follow_the_timezone(self):
+        # Monday 2022-03-28, the day after Berlin moved to summer time
+        hours = scheduling.working_hours(
+            epoch(2022, 3, 25), epoch(2022, 3, 29), 'Europe/Berlin', '09:00', '17:00')
+        self.assertEqual(hours, [
+            (epoch(2022, 3, 25, 8), epoch(2022, 3, 25, 16)),
+            (epoch(2022, 3, 28, 7), epoch(2022, 3, 28, 15)),
+        ])
+
+    def test_overnight_working_hours(self):
+        hours = scheduling.working_hours(
+            epoch(2022, 3, 1), epoch(2022, 3, 2), 'UTC', '22:00', '06:00', [0, 1, 2, 3, 4, 5, 6])
+        self.assertEqual(hours, [
+            (epoch(2022, 2, 28, 22), epoch(2022, 3, 1, 6)),
+            (epoch(2022, 3, 1, 22), epoch(2022, 3, 2, 6)),
+        ])
+
+    def test_off_hours(self):
+        self.assertEqual(scheduling.off_hours(0, 100, [(-10, 10), (30, 40), (90, 120)]),
+                         [(10, 30), (40, 90)])
+        self.assertEqual(scheduling.off_hours(0, 100, []), [(0, 100)])
+
+
+if __name__ == '__main__':
+    unittest.main()
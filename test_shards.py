@@ -0,0 +1,246 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import freebusy
+import shards
+import timecodec
+from app import app, init_db
+from intervals import BusyTimeline
+
+ALICE, CAROL, VICTOR = 'alice@example.com', 'carol@example.com', 'victor@example.com'
+
+
+def meeting(title, start, end, organizer, invitees):
+    return {'title': title, 'description': None, 'start_ts': timecodec.parse(start), 'end_ts': timecodec.parse(end),
+            'location': 'Office', 'organizer_id': organizer, 'invitees': invitees, 'repeat': None}
+
+
+def answered(store, meeting_id, status):
+    # the names of who gave an answer to a meeting, by user id
+    return [name for answer, _, name in store.get_meeting(meeting_id)[1] if answer == status]
+
+
+class TestShards(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.database = os.path.join(self.dir.name, 'calendar.db')
+        self.store = self.open(3)
+
+    def open(self, count):
+        store = shards.ShardedCalendar(self.database, count)
+        self.addCleanup(store.close)
+        return store
+
+    def populate(self, store):
+        users = [store.create_user(email.split('@')[0].title(), email, 'password') for email in (ALICE, CAROL, VICTOR)]
+        ids = store.create_meetings([
+            meeting('Kickoff', '2022-03-01 10:00:00', '2022-03-01 11:00:00', users[0], users[1:]),
+            meeting('Review', '2022-03-01 09:00:00', '2022-03-01 09:30:00', users[1], [users[0]]),
+            meeting('Retro', '2022-03-02 14:00:00', '2022-03-02 15:00:00', users[2], [users[1]]),
+        ])
+        return users, ids
+
+    def test_users_and_meetings_live_on_their_shards(self):
+        (alice, carol, victor), (kickoff, review, retro) = self.populate(self.store)
+        for user_id, email in ((alice, ALICE), (carol, CAROL), (victor, VICTOR)):
+            self.assertEqual(shards.shard_of(user_id, 3), shards.home_shard(email, 3))
+        self.assertEqual(len({alice, carol, victor}), 3)
+        self.assertEqual([shards.shard_of(meeting_id, 3) for meeting_id in (kickoff, review, retro)],
+                         [shards.shard_of(user_id, 3) for user_id in (alice, carol, victor)])
+        self.assertIsNone(self.store.create_user('Alice', ALICE, 'password'))
+
+        # invitations are kept with the invitee, with their meeting's times
+        times = {}
+        for index in range(3):
+            db = sqlite3.connect(shards.path(self.database, index, 3))
+            self.addCleanup(db.close)
+            for user_id, meeting_id, start, end in db.execute(
+                    'SELECT user_id, meeting_id, meeting_start_ts, meeting_end_ts FROM invitations'):
+                self.assertEqual(shards.shard_of(user_id, 3), index)
+                times[meeting_id] = (timecodec.format(start), timecodec.format(end))
+        self.assertEqual(times[kickoff], ('2022-03-01 10:00:00', '2022-03-01 11:00:00'))
+
+        self.assertTrue(self.store.rsvp(kickoff, carol, 'accepted'))
+        self.assertTrue(self.store.rsvp(kickoff, victor, 'declined'))
+        self.assertFalse(self.store.rsvp(kickoff, alice, 'accepted'))
+        self.assertFalse(self.store.rsvp(10 ** 6, carol, 'accepted'))
+
+        found, answers = self.store.get_meeting(kickoff)
+        self.assertEqual((found.title, found.organizer_id), ('Kickoff', alice))
+        self.assertEqual(sorted(answers), [('accepted', CAROL, 'Carol'), ('declined', VICTOR, 'Victor')])
+        self.assertIsNone(self.store.get_meeting(10 ** 6))
+
+        day = timecodec.parse('2022-03-01 00:00:00'), timecodec.parse('2022-03-03 00:00:00')
+        self.assertEqual([item.title for item in self.store.user_meetings(carol, *day)], ['Review', 'Kickoff'])
+        self.assertIsNone(self.store.user_meetings(10 ** 6, *day))
+        self.assertEqual(self.store.user_meetings(carol, day[1] - timecodec.DAY, day[1]), [])
+        self.assertEqual(set(self.store.meetings([kickoff, retro, 10 ** 6])), {kickoff, retro})
+
+        # Carol is busy with their review and the kickoff they accepted
+        start = timecodec.parse('2022-03-01 09:00:00')
+        busy = BusyTimeline(self.store.busy([alice, carol], start, start + timecodec.DAY))
+        self.assertEqual(busy.first_gap(start, 60 * timecodec.MINUTE, start + timecodec.DAY), timecodec.parse('2022-03-01 11:00:00'))
+        self.assertTrue(self.store.rsvp(kickoff, carol, 'declined'))
+        busy = self.store.busy_by_user([carol, victor], range(*freebusy.days(start, start + timecodec.DAY)))
+        self.assertEqual(set(busy), {carol})
+        self.assertEqual(BusyTimeline(busy[carol]).first_gap(start, 30 * timecodec.MINUTE, start + timecodec.DAY),
+                         timecodec.parse('2022-03-01 09:30:00'))
+
+        with self.assertRaises(ValueError):
+            self.store.create_meetings([dict(meeting('Standup', '2022-03-01 09:00:00', '2022-03-01 09:15:00', alice, []),
+                                             repeat='daily')])
+
+    def test_invitations_to_other_shards_survive_a_crash(self):
+        alice, carol, victor = [self.store.create_user(email.split('@')[0].title(), email, 'password')
+                            for email in (ALICE, CAROL, VICTOR)]
+        # the process stops once the meeting is committed, before its
+        # invitations reached the invitees' shards
+        deliver = self.store.deliver
+        self.store.deliver = lambda indexes=None: 0
+        kickoff, = self.store.create_meetings([meeting('Kickoff', '2022-03-01 10:00:00', '2022-03-01 11:00:00', alice, [carol, victor])])
+        self.assertFalse(self.store.rsvp(kickoff, carol, 'accepted'))
+        self.assertEqual(deliver(), 2)
+        self.assertEqual(deliver(), 0)
+        self.assertTrue(self.store.rsvp(kickoff, carol, 'accepted'))
+
+        # delivered again after a crash before the outbox was cleared, the
+        # invitations are neither doubled nor reset; the next process to
+        # open the shards delivers what is waiting
+        db = sqlite3.connect(shards.path(self.database, shards.shard_of(alice, 3), 3))
+        self.addCleanup(db.close)
+        start, end = timecodec.parse('2022-03-01 10:00:00'), timecodec.parse('2022-03-01 11:00:00')
+        db.execute(shards.INSERT_OUTBOX_SQL, (shards.shard_of(carol, 3), carol, kickoff, start, end))
+        db.commit()
+        self.open(3)
+        self.assertEqual((answered(self.store, kickoff, 'accepted'), answered(self.store, kickoff, 'pending')),
+                         (['Carol'], ['Victor']))
+        self.assertEqual(db.execute('SELECT COUNT(*) FROM outbox').fetchone(), (0,))
+
+    def test_reshard(self):
+        (alice, carol, victor), (kickoff, review, retro) = self.populate(self.store)
+        self.store.rsvp(kickoff, carol, 'accepted')
+        self.store.close()
+
+        self.assertEqual(shards.reshard(self.database, 2, 3), {'users': 3, 'meetings': 3, 'invitations': 4, 'freebusy': 3})
+        with self.assertRaises(FileExistsError):
+            shards.reshard(self.database, 2, 3)
+
+        store = self.open(2)
+        self.assertEqual(answered(store, kickoff, 'accepted'), ['Carol'])
+        found = store.meetings([kickoff, review, retro])
+        self.assertEqual([found[meeting_id].title for meeting_id in (kickoff, review, retro)], ['Kickoff', 'Review', 'Retro'])
+        start = timecodec.parse('2022-03-01 09:00:00')
+        busy = BusyTimeline(store.busy([carol], start, start + timecodec.DAY))
+        self.assertEqual(busy.first_gap(start, 60 * timecodec.MINUTE, start + timecodec.DAY), timecodec.parse('2022-03-01 11:00:00'))
+
+        # new ids come after every old one, and never twice
+        self.assertIsNone(store.create_user('Carol', CAROL, 'password'))
+        users = [store.create_user(f'User {i}', f'user{i}@example.com', 'password') for i in range(6)]
+        self.assertGreater(min(users), max(alice, carol, victor))
+        self.assertEqual(len(set(users)), 6)
+        ids = store.create_meetings([meeting('Sync', '2022-03-03 10:00:00', '2022-03-03 10:30:00', user, [carol]) for user in users])
+        self.assertGreater(min(ids), max(kickoff, review, retro))
+        self.assertEqual(len(set(ids)), 6)
+        self.assertEqual(answered(store, ids[0], 'pending'), ['Carol'])
+
+    def test_split_the_app_database(self):
+        database = app.config['DATABASE']
+        self.addCleanup(app.config.__setitem__, 'DATABASE', database)
+        app.config['DATABASE'] = os.path.join(self.dir.name, 'app.db')
+        init_db()
+        client = app.test_client()
+        for name in ('Alice', 'Carol'):
+            client.post('/users', json={'name': name, 'email': f'{name.lower()}@example.com', 'password': 'password'})
+        client.post('/meetings', json={'title': 'Sync', 'start_time': '2022-03-01 10:00:00', 'end_time': '2022-03-01 11:00:00',
+                                       'location': 'Office', 'organizer_id': 1, 'invited_users': '[2]'})
+
+        self.assertEqual(shards.reshard(app.config['DATABASE'], 2)['meetings'], 1)
+        store = shards.ShardedCalendar(app.config['DATABASE'], 2)
+        self.addCleanup(store.close)
+        self.assertEqual(answered(store, 1, 'pending'), ['Carol'])
+
+
+class TestShardedApp(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        for name in ('DATABASE', 'SHARDS'):
+            self.addCleanup(app.config.__setitem__, name, app.config[name])
+        app.config['DATABASE'] = os.path.join(self.dir.name, 'calendar.db')
+        app.config['SHARDS'] = 2
+        self.addCleanup(lambda: app.extensions.pop('shards').close())
+        self.client = app.test_client()
+
+    def create(self, title, start, end, organizer, invitees):
+        return {'title': title, 'start_time': start, 'end_time': end, 'location': 'Office',
+                'organizer_id': organizer, 'invited_users': str(invitees)}
+
+    def test_routes_go_through_the_shards(self):
+        for email in (ALICE, CAROL, VICTOR):
+            response = self.client.post('/users', json={'name': email.split('@')[0].title(), 'email': email, 'password': 'password'})
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.post('/users', json={'name': 'Alice', 'email': ALICE, 'password': 'password'}).status_code, 409)
+        page = self.client.get('/users?limit=2')
+        users = page.get_json() + self.client.get(f'/users?after={page.headers["X-Next-Cursor"]}').get_json()
+        self.assertEqual(sorted(user['email'] for user in users), [ALICE, CAROL, VICTOR])
+        ids = {email: user_id for user_id, email in app.extensions['shards'].select(
+            'SELECT id, email FROM users ORDER BY id', (), None, lambda row: row[0])}
+        alice, carol, victor = ids[ALICE], ids[CAROL], ids[VICTOR]
+
+        response = self.client.post('/meetings', json=self.create(
+            'Kickoff', '2022-03-01 10:00:00', '2022-03-01 11:00:00', alice, [carol, victor]))
+        kickoff = response.get_json()['id']
+        response = self.client.post('/meetings/bulk', json=[
+            self.create('Review', '2022-03-01 09:00:00', '2022-03-01 09:30:00', carol, [alice]),
+            self.create('Retro', '2022-03-02 14:00:00', '2022-03-02 15:00:00', victor, [carol]),
+            dict(self.create('Standup', '2022-03-01 08:00:00', '2022-03-01 08:15:00', alice, []), repeat='daily'),
+        ])
+        self.assertEqual(response.get_json()['results'][2], {'index': 2, 'error': 'Series are not available on sharded storage'})
+        for extra in ({'repeat': 'daily'}, {'conflict_policy': 'warn'}):
+            response = self.client.post('/meetings', json=dict(self.create(
+                'Standup', '2022-03-01 08:00:00', '2022-03-01 08:15:00', alice, []), **extra))
+            self.assertEqual(response.status_code, 501)
+
+        self.assertEqual(self.client.post(f'/meeting/{kickoff}/invite/{carol}/accept').status_code, 200)
+        response = self.client.post(f'/meeting/{kickoff}/invite/{alice}/accept')
+        self.assertEqual((response.status_code, response.get_json()), (404, {'error': 'Invitation not found'}))
+        response = self.client.post(f'/meeting/1000000/invite/{carol}/decline')
+        self.assertEqual((response.status_code, response.get_json()), (404, {'error': 'Meeting not found'}))
+
+        result = self.client.get(f'/meetings/{kickoff}').get_json()
+        self.assertEqual((result['title'], result['accepted_users'], result['pending_users']),
+                         ('Kickoff', [{'name': 'Carol', 'email': CAROL}], [{'name': 'Victor', 'email': VICTOR}]))
+        self.assertEqual(self.client.get('/meetings/1000000').status_code, 404)
+
+        page = self.client.get('/meetings?limit=2')
+        self.assertEqual([item['title'] for item in page.get_json()], ['Review', 'Kickoff'])
+        response = self.client.get(f'/meetings?limit=2&after={page.headers["X-Next-Cursor"]}')
+        self.assertEqual([item['title'] for item in response.get_json()], ['Retro'])
+        self.assertEqual([item['title'] for item in self.client.get(f'/meetings?organizer_id={victor}').get_json()], ['Retro'])
+        self.assertEqual(len(self.client.get('/meetings?stream=ndjson').get_data(as_text=True).splitlines()), 3)
+
+        window = 'start_time=2022-03-01 00:00:00&end_time=2022-03-03 00:00:00'
+        response = self.client.get(f'/users/{carol}/meetings?{window}')
+        self.assertEqual([item['title'] for item in response.get_json()], ['Review', 'Kickoff'])
+        self.assertEqual(self.client.get(f'/users/1000000/meetings?{window}').status_code, 404)
+
+        # Carol is busy with their review and the kickoff they accepted
+        response = self.client.get('/free_interval', json={'users': [alice, carol], 'meeting_duration': 60,
+                                                           'start_time': '2022-03-01 09:00:00'})
+        self.assertEqual(response.get_json()['message'], 'Next meeting can be created at 2022-03-01 11:00:00')
+        response = self.client.post('/free_interval/batch', json=[
+            {'users': [carol, victor], 'meeting_duration': 30, 'start_time': '2022-03-01 09:00:00'}])
+        self.assertEqual(response.get_json()['results'][0]['start_time'], '2022-03-01 09:30:00')
+
+        # what the shards don't have isn't read from an empty DATABASE
+        self.assertEqual(self.client.get('/sync').status_code, 501)
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        self.assertFalse(os.path.exists(app.config['DATABASE']))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import calendar
+import unittest
+from datetime import datetime, timezone
+
+import timecodec
+
+
+class TestTimeCodec(unittest.TestCase):
+
+    def test_parse_matches_timegm(self):
+        for fields in [(2022, 3, 1, 10, 0, 0), (2024, 2, 29, 23, 59, 59), (1969, 12, 31, 0, 0, 1), (2100, 3, 1, 0, 0, 0)]:
+            text = datetime(*fields).strftime(timecodec.TIME_FORMAT)
+            self.assertEqual(timecodec.parse(text), calendar.timegm(fields), text)
+            self.assertEqual(timecodec.format(timecodec.parse(text)), text)
+
+    def test_parse_other_forms(self):
+        epoch = 1646128800
+        self.assertEqual(timecodec.parse('2022-03-01T10:00:00'), epoch)
+        self.assertEqual(timecodec.parse('2022-03-01 10:00:00.750000'), epoch)
+        self.assertEqual(timecodec.parse('2022-03-01T12:00:00+02:00'), epoch)
+        self.assertEqual(timecodec.parse(datetime(2022, 3, 1, 10)), epoch)
+        self.assertEqual(timecodec.parse(datetime(2022, 3, 1, 10, tzinfo=timezone.utc)), epoch)
+        self.assertEqual(timecodec.parse(epoch), epoch)
+
+    def test_clock_fields_are_clamped_for_windows(self):
+        self.assertEqual(timecodec.parse('2022-03-01 23:99:99', clamp=True), timecodec.parse('2022-03-01 23:59:59'))
+        self.assertEqual(timecodec.parse('2022-03-01 9:99', clamp=True), timecodec.parse('2022-03-01 09:59:00'))
+        for value in ['2022-03-01 10:75:00', '2022-03-01 24:00:00', '2022-03-01 9:99']:
+            with self.assertRaises(ValueError, msg=value):
+                timecodec.parse(value)
+
+    def test_parse_rejects_bad_times(self):
+        for value in ['2022-02-30 10:00:00', '2022-13-01 10:00:00', 'tomorrow', '', None, True, 1.5]:
+            with self.assertRaises(ValueError, msg=repr(value)):
+                timecodec.parse(value)
+
+    def test_datetime_round_trip(self):
+        moment = datetime(2022, 3, 1, 10, 30)
+        self.assertEqual(timecodec.to_datetime(timecodec.from_datetime(moment)), moment)
+        self.assertIsNone(timecodec.parse_or_none(None))
+        self.assertIsNone(timecodec.format_or_none(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from app import app, init_db, drop_db, get_write_queue
+from pool import ConnectionPool
+from writequeue import WriteQueue
+
+
+def insert(db, name):
+    return db.execute('INSERT INTO items (name) VALUES (?)', (name,)).lastrowid
+
+
+class TestWriteQueue(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.pool = ConnectionPool(os.path.join(directory.name, 'queue.db'), size=2, timeout=1.0)
+        self.addCleanup(self.pool.close)
+
+        db = self.pool.acquire_writer()
+        db.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT UNIQUE)')
+        db.commit()
+        self.pool.release(db)
+
+    def count(self):
+        db = self.pool.acquire_reader()
+        try:
+            return db.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+        finally:
+            self.pool.release(db)
+
+    def test_writes_are_committed_in_groups(self):
+        write_queue = WriteQueue(self.pool, max_batch=50, max_delay=0.05)
+        self.addCleanup(write_queue.close)
+
+        # hold the writer so every write piles up behind it
+        db = self.pool.acquire_writer()
+        futures = [write_queue.submit(insert, f'item {number}') for number in range(100)]
+        self.pool.release(db)
+
+        self.assertEqual(sorted(future.result() for future in futures), list(range(1, 101)))
+        self.assertEqual(self.count(), 100)
+        stats = write_queue.stats()
+        self.assertEqual(stats['operations'], 100)
+        self.assertLessEqual(stats['largest_batch'], 50)
+        self.assertLess(stats['batches'], 100)
+        self.assertEqual(stats['queue_depth'], 0)
+
+    def test_a_failed_write_is_rolled_back_alone(self):
+        write_queue = WriteQueue(self.pool, max_batch=10, max_delay=0.05)
+        self.addCleanup(write_queue.close)
+
+        db = self.pool.acquire_writer()
+        first = write_queue.submit(insert, 'same')
+        second = write_queue.submit(insert, 'same')
+        third = write_queue.submit(insert, 'other')
+        self.pool.release(db)
+
+        self.assertEqual(first.result(), 1)
+        with self.assertRaises(sqlite3.IntegrityError):
+            second.result()
+        self.assertEqual(third.result(), 2)
+        self.assertEqual(self.count(), 2)
+        self.assertEqual(write_queue.stats()['failed_operations'], 1)
+
+    def test_close_writes_what_is_queued(self):
+        write_queue = WriteQueue(self.pool, max_batch=10, max_delay=1.0)
+        futures = [write_queue.submit(insert, f'item {number}') for number in range(3)]
+        write_queue.close()
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual(self.count(), 3)
+
+
+class TestWriteQueueEndpoints(unittest.TestCase):
+
+    def setUp(self):
+        app.testing = True
+        drop_db()
+        init_db()
+        app.config['WRITE_QUEUE'] = True
+        self.addCleanup(app.config.__setitem__, 'WRITE_QUEUE', False)
+        self.app = app.test_client()
+
+    def tearDown(self):
+        drop_db()
+
+    def post(self, path, data=None):
+        return app.test_client().post(path, data=json.dumps(data), content_type='application/json')
+
+    def test_concurrent_answers(self):
+        users = [{'name': f'User {number}', 'email': f'user{number}@example.com', 'password': 'password'}
+                 for number in range(20)]
+        responses = []
+        threads = [threading.Thread(target=lambda user=user: responses.append(self.post('/users', user)))
+                   for user in users + users[:1]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(response.status_code for response in responses), [200] * 20 + [409])
+
+        meeting = {'title': 'All hands', 'start_time': '2022-03-01 10:00:00', 'end_time': '2022-03-01 11:00:00',
+                   'location': 'Hall', 'organizer_id': 1, 'invited_users': json.dumps(list(range(2, 21)))}
+        self.assertEqual(self.post('/meetings', meeting).status_code, 200)
+
+        responses = []
+        threads = [threading.Thread(target=lambda user_id=user_id: responses.append(
+                       self.post(f'/meeting/1/invite/{user_id}/{"accept" if user_id % 2 else "decline"}')))
+                   for user_id in range(2, 22)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(response.status_code for response in responses), [200] * 19 + [404])
+
+        response = self.app.get('/meetings/1')
+        self.assertEqual(len(response.json['accepted_users']), 9)
+        self.assertEqual(len(response.json['declined_users']), 10)
+
+        with app.app_context():
+            stats = get_write_queue().stats()
+        self.assertEqual(stats['operations'], 41)
+        self.assertIn('calendar_write_queue_batches_total', self.app.get('/metrics').data.decode())
+
+    def test_queue_of_a_replaced_pool_is_closed(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        database = app.config['DATABASE']
+        self.addCleanup(app.config.__setitem__, 'DATABASE', database)
+        with app.app_context():
+            write_queue = get_write_queue()
+            app.config['DATABASE'] = os.path.join(directory.name, 'other.db')
+            self.assertIsNot(get_write_queue(), write_queue)
+        self.assertFalse(write_queue._thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+# times are stored as integer seconds since the epoch, in UTC, and cross the
+# API as 'YYYY-mm-dd HH:MM:SS' text. every route parses and renders them
+# through here, so the database and the hot loops only ever see ints
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+
+EPOCH = datetime(1970, 1, 1)
+
+_DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def _is_leap(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+
+def _days_from_civil(year, month, day):
+    # days since 1970-01-01 of a proleptic Gregorian date, without building
+    # a date object
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+def _epoch(year, month, day, hour, minute, second, clamp):
+    # with `clamp`, clock fields past their range are clamped instead of
+    # rejected, so a window ending at '23:99:99' still means the end of
+    # that day, as it did when windows were only ever compared as strings
+    if not 1 <= month <= 12 or not 1 <= day <= _DAYS_IN_MONTH[month - 1] + (month == 2 and _is_leap(year)):
+        raise ValueError('day is out of range for month')
+    if hour < 0 or minute < 0 or second < 0:
+        raise ValueError('clock fields must not be negative')
+    if clamp:
+        hour, minute, second = min(hour, 23), min(minute, 59), min(second, 59)
+    elif hour > 23 or minute > 59 or second > 59:
+        raise ValueError('clock fields are out of range')
+    return _days_from_civil(year, month, day) * DAY + hour * HOUR + minute * MINUTE + second
+
+
+def parse(value, clamp=False):
+    # epoch seconds of a time from a request or a legacy row: the usual
+    # 'YYYY-mm-dd HH:MM:SS' text is sliced without going through datetime,
+    # other ISO 8601 forms ('T', fractions, offsets) are taken as well, and
+    # ints are already epochs. raises ValueError for anything else; clock
+    # fields past their range are only accepted with `clamp`, which is for
+    # the bounds of query windows, never for times that get stored
+    if isinstance(value, str):
+        if (len(value) == 19 and value[4] == '-' and value[7] == '-' and value[10] in ' T'
+                and value[13] == ':' and value[16] == ':'):
+            return _epoch(int(value[:4]), int(value[5:7]), int(value[8:10]),
+                          int(value[11:13]), int(value[14:16]), int(value[17:19]), clamp)
+        try:
+            return from_datetime(datetime.fromisoformat(value))
+        except ValueError:
+            pass
+        day, _, clock = value.strip().partition(' ')
+        year, month, day = (int(field) for field in day.split('-'))
+        hour, minute, second = (clock.split(':') + ['0', '0', '0'])[:3]
+        return _epoch(year, month, day, int(hour), int(minute), int(float(second)), clamp)
+    if isinstance(value, datetime):
+        return from_datetime(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    raise ValueError(f'Invalid time {value!r}')
+
+
+def parse_or_none(value, clamp=False):
+    return None if value is None else parse(value, clamp)
+
+
+def format(seconds):
+    # 'YYYY-mm-dd HH:MM:SS' of epoch seconds
+    return time.strftime(TIME_FORMAT, time.gmtime(seconds))
+
+
+def format_or_none(seconds):
+    return None if seconds is None else format(seconds)
+
+
+def from_datetime(value):
+    # naive datetimes are taken as UTC, aware ones are converted to it
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value.toordinal() - 719163) * DAY + value.hour * HOUR + value.minute * MINUTE + value.second
+
+
+def to_datetime(seconds):
+    # a naive UTC datetime, for the calendar arithmetic of recurrence rules
+    return EPOCH + timedelta(seconds=seconds)
+
+
+def now():
+    return int(time.time())
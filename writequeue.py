@@ -0,0 +1,137 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# the sizes of the groups the queue commits, for the batch size histogram
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+_STOP = object()
+
+
+class WriteQueue:
+    # group commit: small writes submitted from many threads are run one
+    # after the other on a single thread that takes the pool's writer,
+    # and committed together once `max_batch` of them are waiting or
+    # `max_delay` seconds after the first one arrived, whichever is sooner.
+    # each write runs in a savepoint, so one that fails is rolled back on
+    # its own, and its caller gets the result only once it is committed
+
+    def __init__(self, pool, max_batch=64, max_delay=0.002, registry=None):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.registry = registry
+        self._queue = queue.SimpleQueue()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'operations': 0,
+            'failed_operations': 0,
+            'batches': 0,
+            'failed_batches': 0,
+            'largest_batch': 0,
+            'commit_seconds': 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name='write-queue', daemon=True)
+        self._thread.start()
+
+    def submit(self, operation, *args):
+        # a Future for operation(db, *args) run on the writer connection
+        future = Future()
+        self._queue.put((operation, args, future))
+        return future
+
+    def run(self, operation, *args):
+        # submit and wait until the write is committed; exceptions raised
+        # by the operation, or by the commit, come back to the caller
+        return self.submit(operation, *args).result()
+
+    def close(self):
+        # write what is already queued, then stop the thread
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _collect(self):
+        # block for the first write, then gather more until the group is
+        # full or its deadline passes; None once the queue was closed
+        first = self._queue.get()
+        if first is _STOP:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        try:
+            db = self.pool.acquire_writer()
+        except Exception as error:
+            self._fail(batch, error)
+            return
+        results = []
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            for operation, args, future in batch:
+                db.execute('SAVEPOINT write_queue')
+                try:
+                    results.append((future, operation(db, *args), None))
+                except Exception as error:
+                    db.execute('ROLLBACK TO write_queue')
+                    results.append((future, None, error))
+                db.execute('RELEASE write_queue')
+            started = time.perf_counter()
+            db.commit()
+            commit_seconds = time.perf_counter() - started
+        except Exception as error:
+            self._fail(batch, error)
+            return
+        finally:
+            self.pool.release(db)
+
+        failed = sum(1 for _, _, error in results if error is not None)
+        with self._stats_lock:
+            self._stats['operations'] += len(batch)
+            self._stats['failed_operations'] += failed
+            self._stats['batches'] += 1
+            self._stats['largest_batch'] = max(self._stats['largest_batch'], len(batch))
+            self._stats['commit_seconds'] += commit_seconds
+        if self.registry is not None:
+            self.registry.observe('calendar_write_batch_size', len(batch), BATCH_BUCKETS)
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def _fail(self, batch, error):
+        # nothing of the group was committed
+        with self._stats_lock:
+            self._stats['operations'] += len(batch)
+            self._stats['failed_operations'] += len(batch)
+            self._stats['failed_batches'] += 1
+        for _, _, future in batch:
+            future.set_exception(error)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({'queue_depth': self._queue.qsize(), 'max_batch': self.max_batch, 'max_delay': self.max_delay})
+        return stats